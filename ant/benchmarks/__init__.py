@@ -0,0 +1,7 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from ant.benchmarks.datasets import Dataset
+from ant.benchmarks.instance import InstanceBenchmark
+from ant.benchmarks.load import ServiceBenchmark
+from ant.benchmarks.report import environment, write_report, read_report, compare
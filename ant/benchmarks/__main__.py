@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of a `TopKSearch` in process or of a running service, written as JSON.
+
+    python -m ant.benchmarks instance --num-base 100000 --output instance.json
+    python -m ant.benchmarks service --url http://127.0.0.1:1234 --concurrency 1 8 32 --output service.json
+    python -m ant.benchmarks compare baseline.json instance.json
+
+`compare` exits with 1 when a metric regressed beyond the tolerance.
+"""
+import sys
+import json
+import argparse
+
+from ant.core.threads import budget
+from ant.benchmarks.datasets import Dataset
+from ant.benchmarks.instance import InstanceBenchmark
+from ant.benchmarks.load import ServiceBenchmark, API_JSON, API_BINARY
+from ant.benchmarks.report import environment, write_report, read_report, compare
+
+
+def add_dataset_args(parser):
+    group = parser.add_argument_group("dataset", "Synthetic clusters unless `--base` and `--queries` are given.")
+    group.add_argument("--base", help="Base vectors, `.npy` or `.fvecs`/`.bvecs`.")
+    group.add_argument("--queries", help="Query vectors, `.npy` or `.fvecs`/`.bvecs`.")
+    group.add_argument("--ground-truth", help="Exact neighbor ids, `.npy` or `.ivecs`, computed when left out.")
+    group.add_argument("--num-base", type=int, default=100000)
+    group.add_argument("--num-queries", type=int, default=1000)
+    group.add_argument("--dim", type=int, default=128)
+    group.add_argument("--clusters", type=int, default=256)
+    group.add_argument("--seed", type=int, default=1234)
+    group.add_argument("--metric", default="IP", choices=("IP", "L2", "cosine"))
+    group.add_argument("--cache-dir", help="Directory keeping computed ground truths.")
+
+
+def load_dataset(args):
+    if args.base is not None or args.queries is not None:
+        if args.base is None or args.queries is None:
+            raise ValueError("`--base` and `--queries` go together.")
+        return Dataset.from_files(args.base, args.queries, ground_truth=args.ground_truth, metric=args.metric,
+                                  num_base=args.num_base, num_queries=args.num_queries, cache_dir=args.cache_dir)
+    return Dataset.synthetic(num_base=args.num_base, num_queries=args.num_queries, dim=args.dim,
+                             num_clusters=args.clusters, metric=args.metric, seed=args.seed,
+                             cache_dir=args.cache_dir)
+
+
+def run_instance(args, dataset):
+    with InstanceBenchmark(dataset, configs=args.configs, data_dir=args.data_dir, top_k=args.top_k,
+                           batch_size=args.batch_size, seed=args.seed) as bench:
+        results = bench.run(nprobes=args.nprobe, write_steps=args.write_steps, restart_steps=args.restart_steps,
+                            restart_batch=args.restart_batch)
+        params = {"configs": bench.configs, "top_k": args.top_k, "batch_size": args.batch_size,
+                  "threads": budget.budget}
+    return params, results
+
+
+def run_service(args, dataset):
+    bench = ServiceBenchmark(args.url, dataset, instance_name=args.instance_name, configs=args.configs,
+                             top_k=args.top_k)
+    build_seconds = bench.setup()
+    try:
+        load = [bench.run(api=api, concurrency=concurrency, nprobe=nprobe, batch_size=args.batch_size,
+                          num_requests=args.requests, duration=args.duration)
+                for api in args.api for nprobe in args.nprobe for concurrency in args.concurrency]
+        overhead = [bench.overhead(nprobe=nprobe, num_requests=args.overhead_requests) for nprobe in args.nprobe]
+    finally:
+        bench.teardown()
+    params = {"url": args.url, "configs": bench.configs, "top_k": args.top_k, "batch_size": args.batch_size}
+    results = {
+        "build": {"num_vectors": len(dataset.base), "seconds": round(build_seconds, 4),
+                  "vectors_per_sec": round(len(dataset.base) / build_seconds, 1)},
+        "load": load,
+        "overhead": overhead,
+    }
+    return params, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m ant.benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    for name, help_text in (("instance", "Build, search, write and restart of a `TopKSearch` in process."),
+                            ("service", "Load against the search APIs of a running service.")):
+        command = commands.add_parser(name, help=help_text)
+        add_dataset_args(command)
+        command.add_argument("--configs", type=json.loads, default={},
+                             help="Instance configs as JSON, as for `/ant/create`.")
+        command.add_argument("--top-k", type=int, default=10)
+        command.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+        command.add_argument("--batch-size", type=int, default=1, help="Queries per search call.")
+        command.add_argument("--output", default="-", help="JSON report path, `-` for stdout.")
+
+    instance = commands.choices["instance"]
+    instance.add_argument("--data-dir", help="Where instances are written, a temporary directory by default.")
+    instance.add_argument("--threads", type=int, help="Faiss thread budget, cpu count by default.")
+    instance.add_argument("--write-steps", type=int, default=5)
+    instance.add_argument("--restart-steps", type=int, default=5)
+    instance.add_argument("--restart-batch", type=int, default=10000, help="Updates appended per restart step.")
+
+    service = commands.choices["service"]
+    service.add_argument("--url", default="http://127.0.0.1:1234")
+    service.add_argument("--instance-name", default="ant-bench")
+    service.add_argument("--api", nargs="+", default=[API_JSON, API_BINARY], choices=(API_JSON, API_BINARY))
+    service.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    service.add_argument("--requests", type=int, default=1000, help="Requests per concurrency level.")
+    service.add_argument("--duration", type=float, help="Seconds per concurrency level, instead of `--requests`.")
+    service.add_argument("--overhead-requests", type=int, default=200)
+
+    compare_parser = commands.add_parser("compare", help="Regressions of a report against a baseline.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown allowed.")
+    compare_parser.add_argument("--recall-tolerance", type=float, default=0.005, help="Absolute recall drop allowed.")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        regressions = compare(read_report(args.baseline), read_report(args.current),
+                              tolerance=args.tolerance, recall_tolerance=args.recall_tolerance)
+        print(json.dumps(regressions, indent=2))
+        return 1 if regressions else 0
+
+    if args.command == "instance" and args.threads is not None:
+        budget.resize(args.threads)
+    dataset = load_dataset(args)
+    run = run_instance if args.command == "instance" else run_service
+    params, results = run(args, dataset)
+    write_report(args.output, {
+        "benchmark": args.command,
+        "environment": environment(),
+        "dataset": dataset.describe(),
+        "params": params,
+        "results": results,
+    })
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
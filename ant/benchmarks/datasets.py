@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+
+import numpy as np
+import faiss as core
+
+
+def read_vecs(path: str):
+    """
+    Read a `.fvecs`, `.ivecs` or `.bvecs` file (the TEXMEX format of SIFT1M,
+    GIST1M, ...): every row is its int32 dim followed by dim values.
+    """
+    dtype = {".fvecs": "float32", ".ivecs": "int32", ".bvecs": "uint8"}.get(os.path.splitext(path)[1])
+    if dtype is None:
+        raise ValueError("`{}` should be a `.fvecs`, `.ivecs` or `.bvecs` file.".format(path))
+    raw = np.fromfile(path, dtype="uint8")
+    if len(raw) == 0:
+        return np.zeros((0, 0), dtype=dtype)
+    dim = int(raw[:4].view("int32")[0])
+    row_size = 4 + dim * np.dtype(dtype).itemsize
+    if len(raw) % row_size != 0:
+        raise ValueError("`{}` of {} bytes is not a multiple of the row size {}.".format(path, len(raw), row_size))
+    return raw.reshape(-1, row_size)[:, 4:].copy().view(dtype)
+
+
+def read_vectors(path: str):
+    """ Vectors of a `.npy` or TEXMEX file. """
+    if path.endswith(".npy"):
+        return np.load(path)
+    return read_vecs(path)
+
+
+def exact_search(base, queries, top_k: int, metric: str = "IP", batch_size: int = 1024):
+    """ Brute force `(distances, ids)` of `queries` against `base`, ids are row numbers. """
+    base = np.ascontiguousarray(base, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    if metric == "cosine":
+        base, queries = base.copy(), queries.copy()
+        core.normalize_L2(base)
+        core.normalize_L2(queries)
+    index = core.IndexFlatL2(base.shape[1]) if metric == "L2" else core.IndexFlatIP(base.shape[1])
+    index.add(base)
+    distances, ids = [], []
+    for start in range(0, len(queries), batch_size):
+        _distances, _ids = index.search(queries[start:start + batch_size], top_k)
+        distances.append(_distances)
+        ids.append(_ids)
+    return np.concatenate(distances), np.concatenate(ids)
+
+
+class Dataset(object):
+    """
+    Base vectors, held-out queries and their exact nearest neighbors.
+
+    Ids are the row numbers of `base`, so the results of any index can be
+    checked against `ground_truth`. It is computed by exact search the first
+    time it is needed (and kept in `cache_dir` when given, keyed by the
+    contents), or given with the dataset.
+    """
+
+    def __init__(self, name: str, base, queries, metric: str = "IP", ground_truth=None, cache_dir: str = None):
+        self._name = name
+        self._base = np.ascontiguousarray(base, dtype="float32")
+        self._queries = np.ascontiguousarray(queries, dtype="float32")
+        self._metric = metric
+        self._ground_truth = None if ground_truth is None else np.asarray(ground_truth, dtype="int64")
+        self._cache_dir = cache_dir
+
+        if self._base.ndim != 2 or self._queries.ndim != 2 or self._base.shape[1] != self._queries.shape[1]:
+            raise ValueError("`base` shape {} and `queries` shape {} not match!".format(
+                self._base.shape, self._queries.shape))
+        if self._ground_truth is not None and len(self._ground_truth) != len(self._queries):
+            raise ValueError("`ground_truth` has {} rows for {} queries.".format(
+                len(self._ground_truth), len(self._queries)))
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def base(self):
+        return self._base
+
+    @property
+    def queries(self):
+        return self._queries
+
+    @property
+    def ids(self):
+        return np.arange(len(self._base), dtype="int64")
+
+    @property
+    def metric(self):
+        return self._metric
+
+    @property
+    def dim(self):
+        return self._base.shape[1]
+
+    def fingerprint(self):
+        """ Digest of the vectors and metric, results of different datasets are never compared. """
+        digest = hashlib.sha1(self._metric.encode("utf-8"))
+        digest.update(self._base.tobytes())
+        digest.update(self._queries.tobytes())
+        return digest.hexdigest()[:16]
+
+    def ground_truth(self, top_k: int):
+        """ Ids of the exact `top_k` nearest neighbors of every query. """
+        if self._ground_truth is not None and self._ground_truth.shape[1] >= top_k:
+            return self._ground_truth[:, :top_k]
+
+        cached = None
+        if self._cache_dir is not None:
+            cached = os.path.join(self._cache_dir, "{}-{}-gt{}.npy".format(self._name, self.fingerprint(), top_k))
+            if os.path.exists(cached):
+                self._ground_truth = np.load(cached)
+                return self._ground_truth
+
+        _, self._ground_truth = exact_search(self._base, self._queries, top_k, metric=self._metric)
+        if cached is not None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            np.save(cached, self._ground_truth)
+        return self._ground_truth
+
+    def describe(self):
+        return {
+            "name": self._name,
+            "num_base": len(self._base),
+            "num_queries": len(self._queries),
+            "dim": self.dim,
+            "metric": self._metric,
+            "fingerprint": self.fingerprint(),
+        }
+
+    @classmethod
+    def synthetic(cls, num_base: int = 100000, num_queries: int = 1000, dim: int = 128, num_clusters: int = 256,
+                  metric: str = "IP", seed: int = 1234, cache_dir: str = None):
+        """
+        Gaussian clusters around random centers, queries drawn from the same
+        clusters. Real embeddings are clustered too, uniform noise would make
+        every IVF list look alike. The same arguments give the same vectors.
+        """
+        rng = np.random.default_rng(seed)
+        centers = rng.standard_normal((num_clusters, dim), dtype="float32")
+
+        def draw(count):
+            labels = rng.integers(0, num_clusters, count)
+            return centers[labels] + 0.5 * rng.standard_normal((count, dim), dtype="float32")
+
+        name = "synthetic-{}x{}-c{}-s{}".format(num_base, dim, num_clusters, seed)
+        return cls(name, draw(num_base), draw(num_queries), metric=metric, cache_dir=cache_dir)
+
+    @classmethod
+    def from_files(cls, base: str, queries: str, ground_truth: str = None, metric: str = "IP",
+                   num_base: int = None, num_queries: int = None, cache_dir: str = None):
+        """
+        Dataset of `.npy` or TEXMEX files, e.g. SIFT1M's `sift_base.fvecs`,
+        `sift_query.fvecs` and `sift_groundtruth.ivecs`. A given ground truth is
+        only kept when the whole base is used.
+        """
+        base_vectors = read_vectors(base)
+        query_vectors = read_vectors(queries)
+        gt = read_vectors(ground_truth) if ground_truth is not None else None
+        if num_base is not None and num_base < len(base_vectors):
+            base_vectors, gt = base_vectors[:num_base], None
+        if num_queries is not None and num_queries < len(query_vectors):
+            query_vectors = query_vectors[:num_queries]
+            gt = gt[:num_queries] if gt is not None else None
+        name = os.path.splitext(os.path.basename(base))[0]
+        return cls(name, base_vectors, query_vectors, metric=metric, ground_truth=gt, cache_dir=cache_dir)
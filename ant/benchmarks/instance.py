@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+from ant.core import TopKSearch
+from ant.benchmarks.datasets import Dataset
+from ant.benchmarks.stats import recall_at_k, summarize, Stopwatch
+
+
+class InstanceBenchmark(object):
+    """
+    `TopKSearch` measured in process against raw Faiss calls on the same index type.
+
+    Every run starts from an empty `data_dir` (a temporary one by default) with
+    the instance `configs` of `/ant/create`, `nlist` defaults to 4 x sqrt of the
+    base size. Results are plain dicts, ready for `report.write_report`.
+    """
+
+    def __init__(self, dataset: Dataset, configs: dict = None, data_dir: str = None, top_k: int = 10,
+                 batch_size: int = 1, seed: int = 1234):
+        self._dataset = dataset
+        self._configs = dict(configs or {})
+        self._configs.setdefault("nlist", max(1, min(65536, int(4 * np.sqrt(len(dataset.base))))))
+        self._configs.setdefault("metric", dataset.metric)
+        self._configs.pop("dim", None)
+        self._data_dir = data_dir
+        self._top_k = top_k
+        self._batch_size = batch_size
+        self._seed = seed
+        self._instance = None
+        self._raw_index = None
+
+    @property
+    def configs(self):
+        return dict(self._configs, dim=self._dataset.dim)
+
+    def __enter__(self):
+        self._owns_data_dir = self._data_dir is None
+        if self._owns_data_dir:
+            self._data_dir = tempfile.mkdtemp(prefix="ant-bench-")
+        os.makedirs(self._data_dir, exist_ok=True)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._instance is not None:
+            self._instance.close()
+            self._instance = None
+        if self._owns_data_dir:
+            shutil.rmtree(self._data_dir, ignore_errors=True)
+
+    def new_instance(self, version: str):
+        return TopKSearch(self._data_dir, version, self._dataset.dim, **self._configs)
+
+    def _batches(self, vectors):
+        for start in range(0, len(vectors), self._batch_size):
+            yield vectors[start:start + self._batch_size]
+
+    def bench_build(self):
+        """ Build throughput of the instance (train, add and AOF record) and of raw Faiss train plus add. """
+        base, ids = self._dataset.base, self._dataset.ids
+        self._instance = self.new_instance("build")
+
+        started_at = time.perf_counter()
+        raw_index = self._instance.new_index()
+        if not raw_index.is_trained:
+            raw_index.train(self._instance.training_sample(self._instance.normalize(base), raw_index))
+        raw_index.add_with_ids(self._instance.normalize(base), ids)
+        raw_seconds = time.perf_counter() - started_at
+        self._raw_index = raw_index
+
+        started_at = time.perf_counter()
+        self._instance.build(base, ids)
+        seconds = time.perf_counter() - started_at
+        return {
+            "num_vectors": len(base),
+            "seconds": round(seconds, 4),
+            "vectors_per_sec": round(len(base) / seconds, 1),
+            "raw_seconds": round(raw_seconds, 4),
+            "raw_vectors_per_sec": round(len(base) / raw_seconds, 1),
+            "aof_bytes": self._instance.get_aof_file().size,
+        }
+
+    def bench_search(self, nprobes=(1, 4, 16, 64)):
+        """
+        QPS, batch latency and recall@k for every `nprobe`, through `TopKSearch.search`
+        and straight on the raw Faiss index. Needs `bench_build` first.
+        """
+        if self._instance is None:
+            raise ValueError("Exec bench_search method, must run `bench_build` method before.")
+        queries = self._dataset.queries
+        ground_truth = self._dataset.ground_truth(self._top_k)
+
+        results = []
+        for nprobe in nprobes:
+            instance_watch, raw_watch = Stopwatch(), Stopwatch()
+            found, raw_found = [], []
+            for batch in self._batches(queries):
+                with instance_watch.measure():
+                    _, ids = self._instance.search(batch, top_k=self._top_k, nprobe=nprobe)
+                found.append(ids)
+            params = self._instance.search_params(nprobe)
+            for batch in self._batches(queries):
+                with raw_watch.measure():
+                    _, ids = self._raw_index.search(self._instance.normalize(batch), self._top_k, params=params)
+                raw_found.append(ids)
+
+            results.append({
+                "nprobe": nprobe,
+                "qps": round(len(queries) / instance_watch.total, 1),
+                "recall": recall_at_k(np.concatenate(found), ground_truth, self._top_k),
+                "latency_ms": summarize(instance_watch.laps),
+                "raw_qps": round(len(queries) / raw_watch.total, 1),
+                "raw_recall": recall_at_k(np.concatenate(raw_found), ground_truth, self._top_k),
+                "raw_latency_ms": summarize(raw_watch.laps),
+            })
+        return results
+
+    def bench_writes(self, steps: int = 5, initial_fraction: float = 0.5, remove_batch: int = 100):
+        """
+        Insert and remove cost as the index grows: built on `initial_fraction`
+        of the base, the rest is inserted in `steps` chunks, after each one
+        `remove_batch` random ids are removed then inserted back.
+        """
+        base, ids = self._dataset.base, self._dataset.ids
+        initial = max(1, int(len(base) * initial_fraction))
+        instance = self.new_instance("writes")
+        rng = np.random.default_rng(self._seed)
+        points = []
+        try:
+            instance.build(base[:initial], ids[:initial])
+            for chunk in np.array_split(np.arange(initial, len(base)), steps):
+                if len(chunk) == 0:
+                    continue
+                started_at = time.perf_counter()
+                instance.insert(base[chunk], ids[chunk])
+                insert_seconds = time.perf_counter() - started_at
+
+                removed = rng.choice(chunk[-1] + 1, min(remove_batch, chunk[-1] + 1), replace=False)
+                started_at = time.perf_counter()
+                instance.remove(removed)
+                remove_seconds = time.perf_counter() - started_at
+                instance.insert(base[removed], removed)
+
+                points.append({
+                    "num_total": instance.num_total,
+                    "insert_count": len(chunk),
+                    "insert_us_per_vector": round(insert_seconds / len(chunk) * 1e6, 3),
+                    "remove_count": len(removed),
+                    "remove_us_per_vector": round(remove_seconds / len(removed) * 1e6, 3),
+                })
+        finally:
+            instance.close()
+        return points
+
+    def bench_restart(self, steps: int = 5, batch_size: int = 10000):
+        """
+        Startup time (snapshot load plus AOF replay) as the AOF grows: a
+        snapshot of the base, then `steps` times `batch_size` updates appended
+        to the AOF before each restart.
+        """
+        base, ids = self._dataset.base, self._dataset.ids
+        instance = self.new_instance("restart")
+        rng = np.random.default_rng(self._seed)
+        points = []
+        try:
+            instance.build(base, ids)
+            snapshot = instance.bgsave("restart-snapshot")
+            for step in range(steps + 1):
+                if step > 0:
+                    rows = rng.choice(len(base), min(batch_size, len(base)), replace=False)
+                    instance.update(base[rows], ids[rows])
+                instance.get_aof_file().fsync()
+
+                restarted = self.new_instance(instance.version)
+                try:
+                    restarted.rebuild()
+                    points.append({
+                        "aof_updates": step * min(batch_size, len(base)),
+                        "aof_bytes": instance.get_aof_file().size,
+                        "snapshot_bytes": snapshot["bytes"],
+                        "rebuild_seconds": restarted.get_info()["rebuild_time"],
+                        "num_total": restarted.num_total,
+                    })
+                finally:
+                    restarted.close()
+        finally:
+            instance.close()
+        return points
+
+    def run(self, nprobes=(1, 4, 16, 64), write_steps: int = 5, restart_steps: int = 5, restart_batch: int = 10000):
+        return {
+            "build": self.bench_build(),
+            "search": self.bench_search(nprobes),
+            "writes": self.bench_writes(steps=write_steps),
+            "restart": self.bench_restart(steps=restart_steps, batch_size=restart_batch),
+        }
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import io
+import time
+import threading
+import itertools
+from collections import Counter
+
+import numpy as np
+import requests
+
+from ant.service import AntAPIs, ContentType, ResultFormat, Status
+from ant.benchmarks.datasets import Dataset
+from ant.benchmarks.stats import recall_at_k, summarize
+
+
+API_JSON = "json"
+API_BINARY = "binary"
+
+
+class ServiceBenchmark(object):
+    """
+    Closed loop load generator for a running service.
+
+    `setup` creates a throwaway instance and builds it with the dataset through
+    `/ant/build/binary`, `run` has `concurrency` threads, each with its own
+    connection, send search requests back to back, `teardown` deletes the
+    instance. Run it from the service host (or one close to it), the network
+    is part of the numbers.
+    """
+
+    def __init__(self, base_url: str, dataset: Dataset, instance_name: str = "ant-bench", configs: dict = None,
+                 top_k: int = 10, timeout: float = 60):
+        self._base_url = base_url.rstrip("/")
+        self._dataset = dataset
+        self._instance_name = instance_name
+        self._configs = dict(configs or {})
+        self._configs.setdefault("nlist", max(1, min(65536, int(4 * np.sqrt(len(dataset.base))))))
+        self._configs.setdefault("metric", dataset.metric)
+        self._configs["dim"] = dataset.dim
+        self._top_k = top_k
+        self._timeout = timeout
+
+    @property
+    def configs(self):
+        return dict(self._configs)
+
+    def _url(self, path):
+        return self._base_url + path
+
+    @staticmethod
+    def _check(resp):
+        resp.raise_for_status()
+        content = resp.json()
+        if content.get("status") != Status.SUCCESS:
+            raise ValueError("`{}` failed: {}".format(content.get("api"), content.get("error") or content.get("msg")))
+        return content
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.teardown()
+
+    def setup(self):
+        """ Create and build the instance, returns the seconds the build request took. """
+        with requests.Session() as session:
+            self._check(session.post(self._url(AntAPIs.CREATE.path), timeout=self._timeout,
+                                     json={"instance_name": self._instance_name, "configs": self._configs}))
+            body = io.BytesIO()
+            np.save(body, self._dataset.base)
+            np.save(body, self._dataset.ids)
+            started_at = time.perf_counter()
+            self._check(session.post(self._url(AntAPIs.BUILD_BINARY.path), timeout=None,
+                                     params={"instance_name": self._instance_name}, data=body.getvalue(),
+                                     headers={"Content-Type": ContentType.NPY}))
+            return time.perf_counter() - started_at
+
+    def teardown(self):
+        with requests.Session() as session:
+            session.post(self._url(AntAPIs.DELETE.path), json={"instance_name": self._instance_name},
+                         timeout=self._timeout)
+
+    def _search(self, session, api, queries, nprobe, explain=False):
+        """ `(ids, response content or None)` of one search request. """
+        if api == API_JSON:
+            resp = session.post(self._url(AntAPIs.SEARCH.path), timeout=self._timeout, json={
+                "instance_name": self._instance_name,
+                "vectors": queries.tolist(),
+                "top_k": self._top_k,
+                "nprobe": nprobe,
+                "format": ResultFormat.COLUMNAR,
+                "explain": explain,
+            })
+            content = self._check(resp)
+            return np.asarray(content["result"]["ids"], dtype="int64"), content
+
+        resp = session.post(self._url(AntAPIs.SEARCH_BINARY.path), timeout=self._timeout,
+                            params={"instance_name": self._instance_name, "top_k": self._top_k, "nprobe": nprobe,
+                                    "format": ResultFormat.RAW},
+                            data=np.ascontiguousarray(queries, dtype="<f4").tobytes(),
+                            headers={"Content-Type": ContentType.RAW})
+        resp.raise_for_status()
+        if resp.headers.get("X-Ant-Status") != Status.SUCCESS:
+            # Errors come back as JSON.
+            self._check(resp)
+        ids = np.frombuffer(resp.content, dtype="<i8", count=len(queries) * self._top_k)
+        return ids.reshape(len(queries), self._top_k), None
+
+    def run(self, api: str = API_JSON, concurrency: int = 1, nprobe: int = 16, batch_size: int = 1,
+            num_requests: int = 1000, duration: float = None):
+        """
+        `num_requests` searches of `batch_size` queries (or as many as fit in
+        `duration` seconds), cycling through the dataset queries, from
+        `concurrency` threads. QPS counts queries, not requests.
+        """
+        queries = self._dataset.queries
+        ground_truth = self._dataset.ground_truth(self._top_k)
+        num_batches = max(1, len(queries) // batch_size)
+        counter = itertools.count()
+        lock = threading.Lock()
+        latencies, errors, found = [], Counter(), {}
+        deadline = None if duration is None else time.perf_counter() + duration
+
+        def worker():
+            with requests.Session() as session:
+                while True:
+                    n = next(counter)
+                    if (deadline is None and n >= num_requests) or (deadline is not None and
+                                                                    time.perf_counter() >= deadline):
+                        return
+                    rows = slice((n % num_batches) * batch_size, (n % num_batches + 1) * batch_size)
+                    started_at = time.perf_counter()
+                    try:
+                        ids, _ = self._search(session, api, queries[rows], nprobe)
+                    except requests.HTTPError as e:
+                        error = str(e.response.status_code)
+                    except (requests.RequestException, ValueError) as e:
+                        error = type(e).__name__
+                    else:
+                        error = None
+                    seconds = time.perf_counter() - started_at
+                    with lock:
+                        if error is None:
+                            latencies.append(seconds)
+                            found.setdefault(rows.start, ids)
+                        else:
+                            errors[error] += 1
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        starts = sorted(found)
+        recall = None
+        if starts:
+            recall = recall_at_k(np.concatenate([found[start] for start in starts]),
+                                 np.concatenate([ground_truth[start:start + batch_size] for start in starts]),
+                                 self._top_k)
+        return {
+            "api": api,
+            "concurrency": concurrency,
+            "batch_size": batch_size,
+            "nprobe": nprobe,
+            "requests": len(latencies),
+            "errors": dict(errors),
+            "seconds": round(elapsed, 4),
+            "rps": round(len(latencies) / elapsed, 1),
+            "qps": round(len(latencies) * batch_size / elapsed, 1),
+            "recall": recall,
+            "latency_ms": summarize(latencies),
+        }
+
+    def overhead(self, nprobe: int = 16, num_requests: int = 200):
+        """
+        Where the time of a lone search request goes: client latency against
+        the stages `explain` reports, `overhead_ms` is everything besides the
+        Faiss call (HTTP, parsing, queueing, encoding).
+        """
+        queries = self._dataset.queries
+        latencies, stages, faiss_ms = [], {}, []
+        with requests.Session() as session:
+            for n in range(num_requests):
+                started_at = time.perf_counter()
+                _, content = self._search(session, API_JSON, queries[n % len(queries)][None], nprobe, explain=True)
+                latencies.append(time.perf_counter() - started_at)
+                for stage, ms in content["explain"]["stages"].items():
+                    stages.setdefault(stage, []).append(ms)
+                faiss_ms.append(content["explain"]["stages"].get("faiss", 0.))
+        latency = summarize(latencies)
+        return {
+            "nprobe": nprobe,
+            "latency_ms": latency,
+            "stages_ms": {stage: round(float(np.mean(values)), 3) for stage, values in stages.items()},
+            "faiss_ms": round(float(np.mean(faiss_ms)), 3),
+            "overhead_ms": round(latency["mean"] - float(np.mean(faiss_ms)), 3),
+        }
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import platform
+import subprocess
+import datetime as dt
+
+import numpy as np
+import faiss as core
+
+
+# Metrics `compare` checks, with whether higher is better. Keys not listed are context.
+HIGHER_IS_BETTER = {
+    "vectors_per_sec": True,
+    "raw_vectors_per_sec": True,
+    "qps": True,
+    "raw_qps": True,
+    "recall": True,
+    "raw_recall": True,
+    "mean": False,
+    "p50": False,
+    "p90": False,
+    "p99": False,
+    "insert_us_per_vector": False,
+    "remove_us_per_vector": False,
+    "rebuild_seconds": False,
+    "overhead_ms": False,
+}
+
+# Recall is deterministic for a given dataset and index, timings are noisy.
+RECALL_KEYS = ("recall", "raw_recall")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """ What the numbers depend on besides the code: versions, cores and the commit. """
+    return {
+        "timestamp": dt.datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "faiss": core.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_report(path: str, report: dict):
+    """ The report as JSON, to stdout for `-`. """
+    content = json.dumps(report, indent=2, sort_keys=False)
+    if path == "-":
+        print(content)
+        return
+    with open(path + ".tmp", "w") as f:
+        f.write(content + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def read_report(path: str):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _flatten(value, prefix=""):
+    """ `{path: number}` of a report, list items keyed by their `nprobe`, `concurrency`, ... when they have one. """
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _flatten(v, "{}.{}".format(prefix, k) if prefix else k)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            key = str(i)
+            if isinstance(item, dict):
+                key = ",".join("{}={}".format(k, item[k]) for k in ("api", "nprobe", "concurrency", "batch_size")
+                               if k in item) or key
+            yield from _flatten(item, "{}[{}]".format(prefix, key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1, recall_tolerance: float = 0.005):
+    """
+    Metrics of `current` worse than `baseline` by more than `tolerance`
+    (relative) or, for recall, `recall_tolerance` (absolute). Reports of
+    different datasets are not comparable and raise.
+    """
+    if baseline.get("dataset", {}).get("fingerprint") != current.get("dataset", {}).get("fingerprint"):
+        raise ValueError("Reports of different datasets `{}` and `{}` are not comparable.".format(
+            baseline.get("dataset", {}).get("name"), current.get("dataset", {}).get("name")))
+
+    base_values = dict(_flatten(baseline.get("results", {})))
+    regressions = []
+    for path, value in _flatten(current.get("results", {})):
+        metric = path.rsplit(".", 1)[-1]
+        if metric not in HIGHER_IS_BETTER or path not in base_values:
+            continue
+        before = base_values[path]
+        change = value - before if HIGHER_IS_BETTER[metric] else before - value
+        if metric in RECALL_KEYS:
+            regressed = change < -recall_tolerance
+        else:
+            regressed = before != 0 and change / abs(before) < -tolerance
+        if regressed:
+            regressions.append({
+                "metric": path,
+                "baseline": before,
+                "current": value,
+                "change": round((value - before) / abs(before), 4) if before != 0 else None,
+            })
+    return regressions
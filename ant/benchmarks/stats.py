@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def recall_at_k(found_ids, true_ids, top_k: int):
+    """ Mean fraction of the exact `top_k` neighbors of every query among the `top_k` found. """
+    found_ids = np.asarray(found_ids)[:, :top_k]
+    true_ids = np.asarray(true_ids)[:, :top_k]
+    hits = sum(len(np.intersect1d(found, true)) for found, true in zip(found_ids, true_ids))
+    return round(hits / float(max(true_ids.size, 1)), 4)
+
+
+def summarize(seconds):
+    """ Count, mean and percentiles of latencies in seconds, reported in ms. """
+    seconds = np.asarray(seconds, dtype="float64")
+    if len(seconds) == 0:
+        return {"count": 0}
+    ms = seconds * 1000
+    return {
+        "count": len(ms),
+        "mean": round(float(ms.mean()), 3),
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p90": round(float(np.percentile(ms, 90)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "max": round(float(ms.max()), 3),
+    }
+
+
+class Stopwatch(object):
+    """ Wall time of the blocks run under `measure`, each kept in `laps`. """
+
+    def __init__(self):
+        self.laps = []
+
+    @contextmanager
+    def measure(self):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.laps.append(time.perf_counter() - started_at)
+
+    @property
+    def total(self):
+        return sum(self.laps)
+
+    @property
+    def last(self):
+        return self.laps[-1] if self.laps else None
@@ -2,5 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from ant.core.multi_instances import MultiInstances
+from ant.core.multi_instances import InstanceState
 from ant.core.top_k_search import TopKSearch
+from ant.core.sharded import ShardedTopKSearch
 from ant.core.ops import OPS
+from ant.core.aof import AppendOnlyFile
+from ant.core.id_index import IdIndex
+from ant.core.result_cache import ResultCache
+from ant.core.ingest import NpyChunkReader
+from ant.core.threads import ThreadBudget
+from ant.core.snapshot import ListSnapshot
@@ -0,0 +1,452 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import zlib
+import struct
+import weakref
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
+
+import numpy as np
+
+
+Record = namedtuple("Record", ["cmd", "timestamp", "ids", "vectors"])
+
+
+class _EverysecFlusher(object):
+    """ One daemon thread fsyncs every `everysec` AOF once per second. """
+
+    def __init__(self):
+        self._files = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, aof):
+        with self._lock:
+            self._files.add(aof)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="aof-everysec", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(1)
+            with self._lock:
+                files = list(self._files)
+            for aof in files:
+                aof.fsync(only_dirty=True)
+
+
+class AppendOnlyFile(object):
+    """
+    Binary append only file written into rolling segments under `aof_dir`.
+
+    Every record is `<QI` (body length, crc32 of body) followed by the body:
+    a fixed `_META` struct (cmd, timestamp, num ids, num rows, dim, dtype),
+    the int64 ids and the raw row-major payload.
+
+    A rewrite compacts the sealed segments into `{n}.base.aof`, which
+    supersedes every segment numbered `<= n`.
+    """
+
+    FSYNC_ALWAYS = "always"
+    FSYNC_EVERYSEC = "everysec"
+    FSYNC_NO = "no"
+
+    CMD_BUILD = "BUILD"
+    CMD_INSERT = "INSERT"
+    CMD_UPDATE = "UPDATE"
+    CMD_TRAIN = "TRAIN"
+    CMD_REMOVE = "REMOVE"
+
+    SEGMENT_SUFFIX = ".aof"
+    BASE_SUFFIX = ".base.aof"
+
+    _HEADER = struct.Struct("<QI")
+    _META = struct.Struct("<8sdQQQ4s")
+
+    _flusher = _EverysecFlusher()
+
+    def __init__(self,
+                 aof_dir: str,
+                 appendfsync: str = FSYNC_EVERYSEC,
+                 segment_size: int = 64 * 1024 * 1024,
+                 auto_rewrite_percentage: int = 100,
+                 auto_rewrite_min_size: int = 64 * 1024 * 1024):
+        if appendfsync not in (self.FSYNC_ALWAYS, self.FSYNC_EVERYSEC, self.FSYNC_NO):
+            raise ValueError("`appendfsync` should be in ('always', 'everysec', 'no'), got `{}`.".format(appendfsync))
+
+        self._aof_dir = aof_dir
+        self._appendfsync = appendfsync
+        self._segment_size = segment_size
+        self._auto_rewrite_percentage = auto_rewrite_percentage
+        self._auto_rewrite_min_size = auto_rewrite_min_size
+
+        self._lock = threading.Lock()
+        self._rewrite_lock = threading.Lock()
+        self._bgrewrite_lock = threading.Lock()
+        self._rewrite_thread = None
+        self._file = None
+        self._segment = None
+        self._segment_bytes = 0
+        self._dirty = False
+        self._size = None
+        self._base_size = None
+        self._appends = 0
+        self._append_time = 0.
+
+    @property
+    def aof_dir(self):
+        return self._aof_dir
+
+    @property
+    def appendfsync(self):
+        return self._appendfsync
+
+    @property
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.segments())
+
+    @property
+    def rewrite_in_progress(self):
+        return self._rewrite_thread is not None and self._rewrite_thread.is_alive()
+
+    def get_info(self):
+        return {
+            "size": self.size,
+            "segments": len(self.segments()),
+            "rewrite_in_progress": self.rewrite_in_progress,
+            "appends": self._appends,
+            # Total seconds spent appending, waiting for the file lock included.
+            "append_time": round(self._append_time, 6),
+        }
+
+    def _segment_files(self):
+        if not os.path.isdir(self._aof_dir):
+            return []
+        names = [fn for fn in os.listdir(self._aof_dir) if fn.endswith(self.SEGMENT_SUFFIX)]
+        return [os.path.join(self._aof_dir, fn) for fn in sorted(names, key=self.segment_number)]
+
+    def segments(self):
+        files = self._segment_files()
+        bases = [path for path in files if path.endswith(self.BASE_SUFFIX)]
+        if not bases:
+            return files
+        base = bases[-1]
+        number = self.segment_number(base)
+        return [base] + [path for path in files if self.segment_number(path) > number]
+
+    @classmethod
+    def segment_number(cls, path):
+        return int(os.path.basename(path).split(".")[0])
+
+    def append(self, cmd: str, ids: np.ndarray, vectors: np.ndarray = None):
+        started_at = time.time()
+        with self._lock:
+            if self._file is None or self._segment_bytes >= self._segment_size:
+                self._roll()
+            written = self.write_record(self._file, cmd, ids, vectors)
+            self._file.flush()
+            self._segment_bytes += written
+            self._size += written
+            self._dirty = True
+
+            if self._appendfsync == self.FSYNC_ALWAYS:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+            self._appends += 1
+            self._append_time += time.time() - started_at
+
+        if self._should_rewrite():
+            self.bgrewrite()
+
+    @classmethod
+    def write_record(cls, f, cmd: str, ids: np.ndarray, vectors: np.ndarray = None):
+        ids = np.ascontiguousarray(ids, dtype="<i8")
+        if vectors is None:
+            vectors = np.empty((0, 0), dtype="<f4")
+        vectors = np.ascontiguousarray(vectors)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+
+        meta = cls._META.pack(cmd.encode("ascii"),
+                              time.time(),
+                              ids.shape[0],
+                              vectors.shape[0],
+                              vectors.shape[1],
+                              vectors.dtype.str.encode("ascii"))
+        crc = zlib.crc32(meta)
+        crc = zlib.crc32(ids.view(np.uint8), crc)
+        crc = zlib.crc32(vectors.reshape(-1).view(np.uint8), crc)
+        length = len(meta) + ids.nbytes + vectors.nbytes
+
+        f.write(cls._HEADER.pack(length, crc))
+        f.write(meta)
+        f.write(ids.view(np.uint8))
+        f.write(vectors.reshape(-1).view(np.uint8))
+        return cls._HEADER.size + length
+
+    def _should_rewrite(self):
+        if self._auto_rewrite_percentage <= 0 or self.rewrite_in_progress:
+            return False
+        if self._size < self._auto_rewrite_min_size:
+            return False
+        growth = (self._size - self._base_size) * 100 / max(self._base_size, 1)
+        return growth >= self._auto_rewrite_percentage
+
+    def _roll(self):
+        if self._file is not None:
+            self._file.flush()
+            if self._appendfsync != self.FSYNC_NO:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+        if not os.path.exists(self._aof_dir):
+            os.makedirs(self._aof_dir)
+
+        segments = self._segment_files()
+        number = max(self.segment_number(path) for path in segments) + 1 if segments else 0
+        if self._size is None:
+            self._size = sum(os.path.getsize(path) for path in self.segments())
+            self._base_size = self._size
+        self._segment = os.path.join(self._aof_dir, "{:08d}{}".format(number, self.SEGMENT_SUFFIX))
+        self._file = open(self._segment, "ab")
+        self._segment_bytes = 0
+        self._dirty = False
+
+        if self._appendfsync == self.FSYNC_EVERYSEC:
+            self._flusher.register(self)
+
+    def fsync(self, only_dirty=False):
+        with self._lock:
+            if self._file is None or (only_dirty and not self._dirty):
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            if self._appendfsync != self.FSYNC_NO:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._segment = None
+
+    def clear(self):
+        self.close()
+        for path in self._segment_files():
+            os.remove(path)
+        self._size = None
+        self._base_size = None
+
+    def roll(self):
+        """ Seal the active segment and return the number of the next one. """
+        with self._lock:
+            if self._file is not None:
+                self._roll()
+                return self.segment_number(self._segment)
+            segments = self._segment_files()
+            return max(self.segment_number(path) for path in segments) + 1 if segments else 0
+
+    def staging_file(self):
+        """
+        A new file for records written aside with `write_record`, in the log
+        directory so that `append_staged` can move it in.
+        """
+        if not os.path.exists(self._aof_dir):
+            os.makedirs(self._aof_dir)
+        fd, path = tempfile.mkstemp(suffix=".staged", dir=self._aof_dir)
+        return os.fdopen(fd, "wb"), path
+
+    def append_staged(self, path):
+        """ Seal the active segment and move the staged file `path` in as the next one. """
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                if self._appendfsync != self.FSYNC_NO:
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                # The next append opens a segment after the staged one.
+                self._file = None
+                self._segment = None
+            segments = self._segment_files()
+            number = max(self.segment_number(path) for path in segments) + 1 if segments else 0
+            if self._size is None:
+                self._size = sum(os.path.getsize(path) for path in self.segments())
+                self._base_size = self._size
+            size = os.path.getsize(path)
+            os.replace(path, os.path.join(self._aof_dir, "{:08d}{}".format(number, self.SEGMENT_SUFFIX)))
+            self._fsync_dir()
+            self._size += size
+            self._appends += 1
+
+        if self._should_rewrite():
+            self.bgrewrite()
+
+    def link_segments(self, aof_dir, from_number):
+        """ Close the writer and hard link the segments numbered `>= from_number` into `aof_dir`. """
+        self.close()
+        if not os.path.exists(aof_dir):
+            os.makedirs(aof_dir)
+        for path in self._segment_files():
+            if self.segment_number(path) < from_number or os.path.getsize(path) == 0:
+                continue
+            os.link(path, os.path.join(aof_dir, os.path.basename(path)))
+
+    @contextmanager
+    def rewrite_paused(self):
+        with self._rewrite_lock:
+            yield
+
+    def bgrewrite(self):
+        with self._bgrewrite_lock:
+            if self.rewrite_in_progress:
+                return False
+            self._rewrite_thread = threading.Thread(target=self.rewrite, name="aof-rewrite", daemon=True)
+            self._rewrite_thread.start()
+            return True
+
+    def rewrite(self):
+        """ Collapse the sealed segments into the minimal set of live records. """
+        with self._rewrite_lock:
+            with self._lock:
+                if self._file is not None:
+                    self._roll()
+                sealed = [path for path in self.segments() if path != self._segment]
+            if not sealed:
+                return
+
+            number = self.segment_number(sealed[-1])
+            base = os.path.join(self._aof_dir, "{:08d}{}".format(number, self.BASE_SUFFIX))
+            tmp = base + ".tmp"
+            with open(tmp, "wb") as f:
+                self._compact(sealed, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, base)
+            self._fsync_dir()
+
+            for path in self._segment_files():
+                if path != base and self.segment_number(path) <= number:
+                    os.remove(path)
+
+            with self._lock:
+                self._size = sum(os.path.getsize(path) for path in self.segments())
+                self._base_size = self._size
+
+    def _compact(self, segments, f):
+        event_ids, event_upsert, event_record, event_row = [], [], [], []
+        reset, reset_cmd, base_removed, num_records = None, None, [], 0
+        for no, record in enumerate(self._read_segments(segments)):
+            num_records += 1
+            if record.cmd in (self.CMD_BUILD, self.CMD_TRAIN):
+                event_ids, event_upsert, event_record, event_row = [], [], [], []
+                reset, reset_cmd, base_removed = no, record.cmd, []
+            if record.cmd in (self.CMD_UPDATE, self.CMD_REMOVE) and reset is None:
+                base_removed.append(record.ids.copy())
+            upsert = record.cmd != self.CMD_REMOVE
+            event_ids.append(record.ids.copy())
+            event_upsert.append(np.full(len(record.ids), upsert))
+            event_record.append(np.full(len(record.ids), no))
+            event_row.append(np.arange(len(record.ids)))
+
+        if reset_cmd == self.CMD_TRAIN and not event_ids:
+            return self._copy_record(segments, reset, f)
+        if not event_ids:
+            return
+
+        # The last event of every id decides whether it is still alive, inserts are upserts so it is the only copy.
+        event_ids = np.hstack(event_ids)[::-1]
+        _, last = np.unique(event_ids, return_index=True)
+        last = last[np.hstack(event_upsert)[::-1][last]]
+        live_record = np.hstack(event_record)[::-1][last]
+        live_row = np.hstack(event_row)[::-1][last]
+        order = np.lexsort((live_row, live_record))
+        live_record, live_row = live_record[order], live_row[order]
+        bounds = np.searchsorted(live_record, np.arange(num_records + 1))
+
+        if base_removed:
+            self.write_record(f, self.CMD_REMOVE, np.unique(np.hstack(base_removed)))
+
+        # After a TRAIN the live rows are kept as inserts, they never need to be held at once.
+        streamed = reset is None or reset_cmd == self.CMD_TRAIN
+        live_ids, live_vectors = [], []
+        for no, record in enumerate(self._read_segments(segments)):
+            if reset is not None and no == reset and reset_cmd == self.CMD_TRAIN:
+                self.write_record(f, record.cmd, record.ids, record.vectors)
+            elif reset is not None and no == reset and len(live_row) == 0:
+                self.write_record(f, record.cmd, record.ids, record.vectors)
+                self.write_record(f, self.CMD_REMOVE, record.ids)
+                return
+            rows = live_row[bounds[no]:bounds[no + 1]]
+            if len(rows) == 0:
+                continue
+            if streamed:
+                self.write_record(f, self.CMD_INSERT, record.ids[rows], record.vectors[rows])
+            else:
+                live_ids.append(record.ids[rows])
+                live_vectors.append(record.vectors[rows])
+
+        if not streamed:
+            self.write_record(f, self.CMD_BUILD, np.hstack(live_ids), np.vstack(live_vectors))
+
+    def _copy_record(self, segments, no, f):
+        for _no, record in enumerate(self._read_segments(segments)):
+            if _no == no:
+                return self.write_record(f, record.cmd, record.ids, record.vectors)
+
+    def _read_segments(self, segments):
+        for path in segments:
+            for record in self.read_segment(path):
+                yield record
+
+    def _fsync_dir(self):
+        fd = os.open(self._aof_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __iter__(self):
+        return self._read_segments(self.segments())
+
+    @classmethod
+    def read_segment(cls, path):
+        """ Yield the records of one segment, stopping at a torn or corrupted tail. """
+        with open(path, "rb") as f:
+            while True:
+                record = cls.read_record(f)
+                if record is None:
+                    return
+                yield record
+
+    @classmethod
+    def read_record(cls, f):
+        """ The next record of `f`, `None` at the end or at a torn or corrupted tail. """
+        header = f.read(cls._HEADER.size)
+        if len(header) < cls._HEADER.size:
+            return None
+        length, crc = cls._HEADER.unpack(header)
+        body = bytearray(length)
+        if f.readinto(body) < length or zlib.crc32(body) != crc:
+            return None
+        return cls.decode(body)
+
+    @classmethod
+    def decode(cls, body):
+        cmd, timestamp, num_ids, num_rows, dim, dtype = cls._META.unpack_from(body)
+        offset = cls._META.size
+        ids = np.frombuffer(body, dtype="<i8", count=num_ids, offset=offset)
+        offset += ids.nbytes
+        dtype = np.dtype(dtype.rstrip(b"\x00").decode("ascii"))
+        vectors = np.frombuffer(body, dtype=dtype, count=num_rows * dim, offset=offset).reshape(num_rows, dim)
+        return Record(cmd.rstrip(b"\x00").decode("ascii"), timestamp, ids, vectors)
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+import numpy as np
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.vectors = []
+        self.num = 0
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.distances = None
+        self.ids = None
+        self.error = None
+
+
+class SearchBatcher(object):
+    """
+    Coalesce concurrent searches with the same `top_k` and `nprobe` into one call.
+
+    The first request of a batch is the leader, it waits up to `window_ms` or
+    until `max_batch_size` query vectors arrived, runs `search_fn` once on the
+    stacked queries and hands every follower its slice of the result.
+    """
+
+    def __init__(self, search_fn, window_ms: float = 2, max_batch_size: int = 256):
+        self._search_fn = search_fn
+        self._window = window_ms / 1000.
+        self._max_batch_size = max_batch_size
+
+        self._lock = threading.Lock()
+        self._pending = {}
+
+        self._batches = 0
+        self._requests = 0
+        self._queries = 0
+        self._max_batch_queries = 0
+        self._wait_time = 0.
+
+    def search(self, vectors, top_k, nprobe):
+        if len(vectors) >= self._max_batch_size:
+            return self._search_fn(vectors, top_k, nprobe)
+
+        start_time = time.time()
+        key = (top_k, nprobe)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._pending[key] = batch
+            offset = batch.num
+            batch.vectors.append(vectors)
+            batch.num += len(vectors)
+            if batch.num >= self._max_batch_size:
+                self._pending.pop(key)
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self._window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    self._pending.pop(key)
+            self._run(batch, top_k, nprobe)
+        else:
+            batch.done.wait()
+
+        with self._lock:
+            self._wait_time += time.time() - start_time
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.distances[offset:offset + len(vectors)], batch.ids[offset:offset + len(vectors)]
+
+    def _run(self, batch, top_k, nprobe):
+        try:
+            vectors = batch.vectors[0] if len(batch.vectors) == 1 else np.vstack(batch.vectors)
+            batch.distances, batch.ids = self._search_fn(vectors, top_k, nprobe)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+        with self._lock:
+            self._batches += 1
+            self._requests += len(batch.vectors)
+            self._queries += batch.num
+            self._max_batch_queries = max(self._max_batch_queries, batch.num)
+
+    def get_stats(self):
+        with self._lock:
+            batches = max(self._batches, 1)
+            requests = max(self._requests, 1)
+            return {
+                "window_ms": self._window * 1000,
+                "max_batch_size": self._max_batch_size,
+                "batches": self._batches,
+                "requests": self._requests,
+                "queries": self._queries,
+                "avg_batch_requests": round(self._requests / batches, 4),
+                "avg_batch_queries": round(self._queries / batches, 4),
+                "max_batch_queries": self._max_batch_queries,
+                "avg_wait_ms": round(self._wait_time * 1000 / requests, 4),
+            }
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class IdIndex(object):
+    """
+    Set of int64 ids kept as a sorted base array with a dead mask plus a small sorted delta.
+
+    Lookups are vectorized binary searches. Adds go to the delta and removes flip
+    the mask, both cost `O(batch + len(delta))`. Once the delta and dead entries pass
+    `merge_ratio` of the base they are merged back into a new base.
+    """
+
+    def __init__(self, ids=None, merge_ratio: float = 0.02, assume_sorted: bool = False):
+        ids = np.empty(0, dtype="int64") if ids is None else np.asarray(ids, dtype="int64").ravel()
+        self._base = ids if assume_sorted else np.unique(ids)
+        self._alive = np.ones(len(self._base), dtype=bool)
+        self._delta = np.empty(0, dtype="int64")
+        self._dead = 0
+        self._merge_ratio = merge_ratio
+
+    def __len__(self):
+        return len(self._base) - self._dead + len(self._delta)
+
+    @staticmethod
+    def _search(sorted_ids, ids):
+        if len(sorted_ids) == 0:
+            return np.zeros(len(ids), dtype="int64"), np.zeros(len(ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return pos, sorted_ids[pos] == ids
+
+    def contains(self, ids):
+        ids = np.asarray(ids, dtype="int64").ravel()
+        pos, found = self._search(self._base, ids)
+        found[found] = self._alive[pos[found]]
+        return found | self._search(self._delta, ids)[1]
+
+    def add(self, ids):
+        ids = np.unique(np.asarray(ids, dtype="int64"))
+        pos, found = self._search(self._base, ids)
+        revive = pos[found][~self._alive[pos[found]]]
+        self._alive[revive] = True
+        self._dead -= len(revive)
+
+        rest = ids[~found]
+        rest = rest[~self._search(self._delta, rest)[1]]
+        if len(rest) > 0:
+            self._delta = np.sort(np.concatenate([self._delta, rest]), kind="stable")
+        self._maybe_merge()
+
+    def discard(self, ids):
+        ids = np.unique(np.asarray(ids, dtype="int64"))
+        pos, found = self._search(self._base, ids)
+        kill = pos[found][self._alive[pos[found]]]
+        self._alive[kill] = False
+        self._dead += len(kill)
+
+        in_delta = self._search(self._delta, ids)[1]
+        if in_delta.any():
+            self._delta = np.setdiff1d(self._delta, ids[in_delta], assume_unique=True)
+        self._maybe_merge()
+
+    def _maybe_merge(self):
+        if len(self._delta) + self._dead > self._merge_ratio * max(len(self._base), 1024):
+            self._base = self.to_array()
+            self._alive = np.ones(len(self._base), dtype=bool)
+            self._delta = np.empty(0, dtype="int64")
+            self._dead = 0
+
+    def to_array(self):
+        base = self._base[self._alive] if self._dead else self._base
+        if len(self._delta) == 0:
+            return base.copy()
+        # Both parts are sorted, the stable sort merges the two runs in linear time.
+        return np.sort(np.concatenate([base, self._delta]), kind="stable")
+
+    def copy(self):
+        return IdIndex(self.to_array(), merge_ratio=self._merge_ratio, assume_sorted=True)
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            np.save(f, self.to_array())
+
+    @classmethod
+    def load(cls, filename, merge_ratio: float = 0.02):
+        return cls(np.load(filename), merge_ratio=merge_ratio, assume_sorted=True)
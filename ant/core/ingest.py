@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
+
+def sample_rows(total: int, size: int, seed: int = None):
+    """ Sorted random rows without replacement, all of them when `size >= total`. """
+    if size >= total:
+        return np.arange(total)
+    return np.sort(np.random.default_rng(seed).choice(total, size, replace=False))
+
+
+def hash_partition(int64_ids, num_parts: int):
+    """ Partition number of every id, a multiplicative hash spreads sequential ids evenly. """
+    hashed = np.asarray(int64_ids, dtype="int64").view("uint64") * np.uint64(0x9E3779B97F4A7C15)
+    return ((hashed >> np.uint64(32)) % np.uint64(num_parts)).astype("int64")
+
+
+class NpyChunkReader(object):
+    """
+    Vectors and ids read back in bounded chunks instead of loaded whole.
+
+    `vectors` and `ids` are arrays, `.npy` files or directories of `.npy`
+    shards paired by sorted filename, `ids` may be left out when only the
+    vectors are needed (e.g. for training). Files are memory mapped, so only the
+    chunk being consumed is paged in and the reader can be iterated again.
+
+    `partition=(part, num_parts)` restricts `chunks` to the rows whose ids hash
+    to `part`, `len`, `take` and `sample` still cover the whole dataset. A
+    reader pickles as its sources and re-opens them when loaded.
+    """
+
+    def __init__(self, vectors, ids=None, partition=None):
+        self._sources = (vectors, ids)
+        self._partition = partition
+        if partition is not None and ids is None:
+            raise ValueError("`partition` needs `ids` to hash.")
+        vectors_shards = self._open(vectors)
+        ids_shards = self._open(ids) if ids is not None else [None] * len(vectors_shards)
+        if not vectors_shards:
+            raise ValueError("No `.npy` shards found in `{}`.".format(vectors))
+        if len(vectors_shards) != len(ids_shards):
+            raise ValueError("{} `vectors` shards and {} `ids` shards not match!".format(
+                len(vectors_shards), len(ids_shards)))
+        self._shards = list(zip(vectors_shards, ids_shards))
+        for _vectors, _ids in self._shards:
+            if _vectors.ndim != 2 or (_ids is not None and len(_vectors) != len(_ids)):
+                raise ValueError("`vectors` shape {} and `ids` shape {} not match!".format(
+                    _vectors.shape, _ids.shape if _ids is not None else None))
+        self._dim = self._shards[0][0].shape[1]
+        if any(_vectors.shape[1] != self._dim for _vectors, _ in self._shards):
+            raise ValueError("All `vectors` shards must have the same dim.")
+
+    @staticmethod
+    def _open(source):
+        if isinstance(source, str) and os.path.isdir(source):
+            filenames = sorted(fn for fn in os.listdir(source) if fn.endswith(".npy"))
+            return [np.load(os.path.join(source, fn), mmap_mode="r") for fn in filenames]
+        if isinstance(source, str):
+            return [np.load(source, mmap_mode="r")]
+        return [np.asarray(source)]
+
+    def __reduce__(self):
+        return self.__class__, self._sources + (self._partition,)
+
+    def partition(self, part: int, num_parts: int):
+        """ View of the rows whose ids hash to `part` of `num_parts`. """
+        return self.__class__(*self._sources, partition=(part, num_parts))
+
+    @property
+    def dim(self):
+        return self._dim
+
+    @property
+    def num_shards(self):
+        return len(self._shards)
+
+    def __len__(self):
+        return sum(len(_vectors) for _vectors, _ in self._shards)
+
+    def chunks(self, chunk_size: int):
+        for _vectors, _ids in self._shards:
+            for start in range(0, len(_vectors), chunk_size):
+                float32_vectors = np.ascontiguousarray(_vectors[start:start + chunk_size], dtype="float32")
+                if _ids is None:
+                    yield float32_vectors, None
+                    continue
+                int64_ids = np.ascontiguousarray(_ids[start:start + chunk_size], dtype="int64")
+                if self._partition is not None:
+                    keep = hash_partition(int64_ids, self._partition[1]) == self._partition[0]
+                    if not keep.any():
+                        continue
+                    float32_vectors, int64_ids = float32_vectors[keep], int64_ids[keep]
+                yield float32_vectors, int64_ids
+
+    def take(self, rows):
+        """ Gather the vectors at the sorted global `rows` shard by shard. """
+        rows = np.asarray(rows, dtype="int64")
+        gathered, offset = [], 0
+        for _vectors, _ in self._shards:
+            lo, hi = np.searchsorted(rows, [offset, offset + len(_vectors)])
+            if hi > lo:
+                gathered.append(np.asarray(_vectors[rows[lo:hi] - offset], dtype="float32"))
+            offset += len(_vectors)
+        if not gathered:
+            return np.empty((0, self._dim), dtype="float32")
+        return np.ascontiguousarray(np.vstack(gathered))
+
+    def sample(self, size: int, seed: int = None):
+        """ Random rows, enough to train on without reading the whole dataset. """
+        return self.take(sample_rows(len(self), size, seed))
@@ -2,28 +2,60 @@
 # -*- coding: utf-8 -*-
 import os
 import yaml
+import time
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from ant.core.top_k_search import TopKSearch
+from ant.core.sharded import ShardedTopKSearch
+from ant.core.replica import AofTailer
+
+
+class InstanceState(object):
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    LOADED = "loaded"
+    FAILED = "failed"
 
 
 class MultiInstances(object):
 
     __instances = {}
+    __states = {}
+    __load_locks = {}
 
     __conf__ = ['data_dir', 'version', 'configs']
 
+    LOAD_EAGER = "eager"
+    LOAD_LAZY = "lazy"
+
     def __new__(cls, *args, **kwargs):
         if not hasattr(cls, "__instance"):
             cls.__instance = super(MultiInstances, cls).__new__(cls)
 
         return cls.__instance
 
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, load_mode: str = LOAD_EAGER, load_workers: int = None, load_timeout: float = 60,
+                 replica: bool = False):
         super().__init__()
 
+        if load_mode not in (self.LOAD_EAGER, self.LOAD_LAZY):
+            raise ValueError("`load_mode` should be in ('eager', 'lazy'), got `{}`.".format(load_mode))
+
         self._data_dir = data_dir
         self._members_dir = os.path.join(self._data_dir, "members")
+        self._load_mode = load_mode
+        self._load_workers = load_workers or os.cpu_count()
+        # How long a request waits on an instance being loaded by another request or the loaders.
+        self._load_timeout = load_timeout
+        self._load_futures = []
+        # A replica follows the instances of a writer process sharing `data_dir`, see `sync_replica`.
+        self._replica = replica
+        self._tailers = {}
+        self._resyncs = {}
+        self._unfollowed = set()
+        self._sync_thread = None
 
         if not os.path.exists(self._data_dir):
             raise FileNotFoundError(self._data_dir)
@@ -31,7 +63,7 @@ class MultiInstances(object):
         if os.path.exists(self._members_dir):
             self.initialization()
         else:
-            os.mkdir(self._members_dir)
+            os.makedirs(self._members_dir, exist_ok=True)
 
     @property
     def member_dir(self):
@@ -40,30 +72,181 @@ class MultiInstances(object):
     def initialization(self):
 
         for member_name in os.listdir(self._members_dir):
-            if os.path.isfile(member_name):
-                continue
-            member_dir = os.path.join(self._members_dir, member_name)
-            config_file = os.path.join(member_dir, "conf.yml")
-            if not os.path.exists(config_file):
-                print("`{}` instance's `conf.yml` missing. Skipped.".format(member_name))
-                continue
-            conf_obj = self.load_instance_conf(config_file)
+            self.register_member(member_name)
+
+        if self._load_mode == self.LOAD_EAGER:
+            executor = ThreadPoolExecutor(max_workers=self._load_workers, thread_name_prefix="ant-loader")
+            for member_name in list(self.__instances):
+                if self.__states.get(member_name) == InstanceState.UNLOADED:
+                    self.__states[member_name] = InstanceState.LOADING
+                    self._load_futures.append(executor.submit(self.load_instance, member_name))
+            executor.shutdown(wait=False)
+
+    def register_member(self, member_name):
+        """ Register the instance of a member directory from its `conf.yml`, unloaded. """
+        member_dir = os.path.join(self._members_dir, member_name)
+        if not os.path.isdir(member_dir):
+            return False
+        config_file = os.path.join(member_dir, "conf.yml")
+        if not os.path.exists(config_file):
+            print("`{}` instance's `conf.yml` missing. Skipped.".format(member_name))
+            return False
+        conf_obj = self.load_instance_conf(config_file)
+
+        if self.check_config_file(conf_obj) is False:
+            return False
+
+        if self._replica and conf_obj["configs"].get("num_shards") is not None:
+            # Shard processes belong to the writer, replicas leave sharded instances to it.
+            self._unfollowed.add(member_name)
+            return False
+
+        instance = None
+        # Sharded instances start their shard processes on their first load.
+        if conf_obj["configs"].get("num_shards") is None:
+            instance = self.new_instance(conf_obj["data_dir"], conf_obj["version"], conf_obj["configs"])
+
+        self.__instances[member_name] = {}
+        self.__instances[member_name]["instance"] = instance
+        self.__instances[member_name]["data_dir"] = conf_obj["data_dir"]
+        self.__instances[member_name]["version"] = conf_obj["version"]
+        self.__instances[member_name]["configs"] = conf_obj["configs"]
+        self.__states[member_name] = InstanceState.UNLOADED
+        self.__load_locks[member_name] = threading.Lock()
+        return True
 
-            if self.check_config_file(conf_obj) is False:
+    def load_instance(self, instance_name, timeout: float = None):
+        """ Load an instance, or wait up to `timeout` seconds for the caller already loading it. """
+        load_lock = self.__load_locks[instance_name]
+        if not load_lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise ValueError("Instance `{}` is still loading after {}s.".format(instance_name, timeout))
+        try:
+            if self.__states.get(instance_name) in (InstanceState.LOADED, InstanceState.FAILED):
+                return
+            self.__states[instance_name] = InstanceState.LOADING
+            _instance = self.__instances[instance_name]
+            try:
+                if _instance["instance"] is None:
+                    _instance["instance"] = self.new_instance(
+                        _instance["data_dir"], _instance["version"], _instance["configs"])
+                if self._replica:
+                    self._follow(instance_name, _instance["instance"])
+                else:
+                    _instance["instance"].rebuild()
+            except Exception as e:
+                self.__states[instance_name] = InstanceState.FAILED
+                print("`{}` instance load failed: {!r}".format(instance_name, e))
+                raise
+            self.__states[instance_name] = InstanceState.LOADED
+        finally:
+            load_lock.release()
+
+    def _follow(self, instance_name, instance):
+        instance.restore_from_fif()
+        # Replicas never append to the AOF, they replay the one of the writer.
+        instance.aof_lock = True
+        tailer = AofTailer(instance.get_aof_file().aof_dir)
+        tailer.apply(instance)
+        self._tailers[instance_name] = tailer
+
+    def sync_replica(self):
+        """
+        Catch a replica up with the writer.
+
+        Instances created or deleted by the writer are loaded or dropped, new
+        AOF records replayed, and an instance whose `conf.yml` moved to a new
+        version (or whose AOF tail was compacted away) is reloaded from that
+        snapshot aside and swapped in.
+        """
+        member_names = set()
+        for member_name in os.listdir(self._members_dir):
+            if not os.path.exists(os.path.join(self._members_dir, member_name, "conf.yml")):
                 continue
-
-            instance = TopKSearch(conf_obj["data_dir"], conf_obj["version"], **conf_obj["configs"])
-            instance.rebuild()
-
-            self.__instances[member_name] = {}
-            self.__instances[member_name]["instance"] = instance
-            self.__instances[member_name]["data_dir"] = conf_obj["data_dir"]
-            self.__instances[member_name]["version"] = conf_obj["version"]
-            self.__instances[member_name]["configs"] = conf_obj["configs"]
+            member_names.add(member_name)
+            if member_name in self._unfollowed:
+                continue
+            try:
+                if member_name not in self.__instances:
+                    if self.register_member(member_name):
+                        self.load_instance(member_name)
+                    continue
+                if self.__states.get(member_name) != InstanceState.LOADED:
+                    continue
+                conf_obj = self.load_instance_conf(os.path.join(self._members_dir, member_name, "conf.yml"))
+                tailer = self._tailers[member_name]
+                if conf_obj["version"] == self.__instances[member_name]["version"]:
+                    tailer.apply(self.__instances[member_name]["instance"])
+                if conf_obj["version"] != self.__instances[member_name]["version"] or tailer.lost:
+                    self._resync(member_name, conf_obj)
+            except Exception as e:
+                print("`{}` instance sync failed: {!r}".format(member_name, e))
+
+        for member_name in list(self.__instances):
+            if member_name not in member_names:
+                self.detach_instance(member_name)
+        self._unfollowed &= member_names
+
+    def _resync(self, instance_name, conf_obj):
+        instance = self.new_instance(conf_obj["data_dir"], conf_obj["version"], conf_obj["configs"])
+        self._follow(instance_name, instance)
+        _instance = self.__instances[instance_name]
+        old_instance = _instance["instance"]
+        _instance["instance"] = instance
+        _instance["version"] = conf_obj["version"]
+        _instance["configs"] = conf_obj["configs"]
+        self._resyncs[instance_name] = self._resyncs.get(instance_name, 0) + 1
+        old_instance.close()
+
+    def start_replica_sync(self, interval: float):
+        """ Run `sync_replica` every `interval` seconds in a daemon thread. """
+        def run():
+            while True:
+                time.sleep(interval)
+                self.sync_replica()
+
+        if self._sync_thread is None:
+            self._sync_thread = threading.Thread(target=run, name="ant-replica-sync", daemon=True)
+            self._sync_thread.start()
+
+    def get_replica_info(self, instance_name):
+        tailer = self._tailers.get(instance_name)
+        if tailer is None:
+            return None
+        info = tailer.get_info()
+        info["version"] = self.__instances[instance_name]["version"]
+        info["resyncs"] = self._resyncs.get(instance_name, 0)
+        return info
+
+    def wait_loaded(self, timeout=None):
+        wait(self._load_futures, timeout=timeout)
+
+    def get_instance_state(self, instance_name):
+        return self.__states.get(instance_name)
+
+    def list_instances_state(self):
+        return {ins: self.__states.get(ins) for ins in self.__instances}
 
     def get_instance(self, instance_name):
-        if self.__instances.get(instance_name) is not None:
-            return self.__instances[instance_name]["instance"]
+        if self.__instances.get(instance_name) is None:
+            return
+        state = self.__states.get(instance_name)
+        if state == InstanceState.LOADING or (state == InstanceState.UNLOADED and self._load_mode == self.LOAD_LAZY):
+            # Concurrent first requests wait on the one loading the instance.
+            self.load_instance(instance_name, timeout=self._load_timeout)
+            state = self.__states.get(instance_name)
+        if state == InstanceState.FAILED:
+            raise ValueError("Instance `{}` failed to load.".format(instance_name))
+        return self.__instances[instance_name]["instance"]
+
+    def get_instance_info(self, instance_name):
+        state = self.__states.get(instance_name)
+        if state != InstanceState.LOADED:
+            return {"state": state, "configs": self.__instances[instance_name]["configs"]}
+        info = self.__instances[instance_name]["instance"].get_info()
+        info["state"] = state
+        if self._replica:
+            info["replication"] = self.get_replica_info(instance_name)
+        return info
 
     def get_instance_conf(self, instance_name):
         if self.__instances.get(instance_name) is not None:
@@ -85,16 +268,41 @@ class MultiInstances(object):
         version = TopKSearch.get_strtime(fmt="%Y%m%d%H%M%S%f")
 
         self.__instances[instance_name] = {}
-        self.__instances[instance_name]["instance"] = TopKSearch(instance_dir, version, **configs)
+        self.__instances[instance_name]["instance"] = self.new_instance(instance_dir, version, configs)
         self.__instances[instance_name]["data_dir"] = instance_dir
         self.__instances[instance_name]["version"] = version
         self.__instances[instance_name]["configs"] = configs
+        self.__states[instance_name] = InstanceState.LOADED
+        self.__load_locks[instance_name] = threading.Lock()
 
         self.save_instance_conf(instance_name)
 
+    @staticmethod
+    def new_instance(data_dir, version, configs: dict):
+        # `num_shards` at create time makes the instance sharded across processes.
+        if configs.get("num_shards") is not None:
+            return ShardedTopKSearch(data_dir, version, **configs)
+        return TopKSearch(data_dir, version, **configs)
+
     def delete_instance(self, instance_name):
+        if self.__instances[instance_name]["instance"] is not None:
+            self.__instances[instance_name]["instance"].close()
         shutil.rmtree(self.__instances[instance_name]["data_dir"])
         self.__instances.pop(instance_name)
+        self.__states.pop(instance_name, None)
+        self.__load_locks.pop(instance_name, None)
+
+    def detach_instance(self, instance_name):
+        """ Drop an instance deleted by another process, its files are left alone. """
+        instance = self.__instances.pop(instance_name)["instance"]
+        self.__states.pop(instance_name, None)
+        self.__load_locks.pop(instance_name, None)
+        self._resyncs.pop(instance_name, None)
+        tailer = self._tailers.pop(instance_name, None)
+        if tailer is not None:
+            tailer.close()
+        if instance is not None:
+            instance.close()
 
     def save_instance_conf(self, instance_name):
         _skip_conf = ["instance"]
@@ -113,6 +321,10 @@ class MultiInstances(object):
     def update_instance_version(self, instance_name, version):
         self.__instances[instance_name]["version"] = version
 
+    def update_instance_configs(self, instance_name, **configs):
+        self.__instances[instance_name]["configs"].update(configs)
+        self.save_instance_conf(instance_name)
+
     @staticmethod
     def load_instance_conf(config_file):
         with open(config_file, "r") as f:
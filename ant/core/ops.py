@@ -12,3 +12,7 @@ class OPS(object):
     UPDATE = "UPDATE"
     REMOVE = "REMOVE"
     SEARCH = "SEARCH"
+    EXISTS = "EXISTS"
+    FETCH = "FETCH"
+    UPLOAD = "UPLOAD"
+    TRAIN = "TRAIN"
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import time
+import contextvars
+
+_current = contextvars.ContextVar("ant_profile", default=None)
+
+
+class Profile(object):
+    """
+    Wall time of one request split into named stages.
+
+    `mark(stage)` adds the time since the previous mark (or the start) to
+    `stage`, so code only marks where a stage ends. The active profile
+    follows the request through `contextvars`, `mark` is a no-op without one.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.attrs = {}
+        self._last = self.started_at
+        self._stages = {}
+
+    def mark(self, stage: str):
+        now = time.time()
+        self._stages[stage] = self._stages.get(stage, 0.) + now - self._last
+        self._last = now
+
+    @property
+    def duration(self):
+        return self._last - self.started_at
+
+    def get_stages(self):
+        """ Stage durations in ms, in the order they first ended. """
+        return {stage: round(duration * 1000, 3) for stage, duration in self._stages.items()}
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def mark(stage: str):
+    profile = _current.get()
+    if profile is not None:
+        profile.mark(stage)
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from ant.core.aof import AppendOnlyFile
+
+
+class AofTailer(object):
+    """
+    Follow the AOF of an instance version while another process appends to it.
+
+    The first `poll` reads the current base and segments from the start, later
+    ones continue at the last complete record, moving to the next segment once
+    it exists (the writer seals a segment before creating the next). When the
+    next segment is gone, e.g. compacted by a rewrite before it was read, the
+    tailer is `lost` and the follower has to reload from the snapshot.
+    """
+
+    def __init__(self, aof_dir: str):
+        self._aof_dir = aof_dir
+        self._pending = None
+        self._segment = None
+        self._file = None
+        self._offset = 0
+        self._lost = False
+
+        self._records = 0
+        self._last_record_time = None
+        self._last_apply_time = None
+        self._caught_up_at = None
+
+    @property
+    def lost(self):
+        return self._lost
+
+    def _open(self, path):
+        self._close()
+        try:
+            self._file = open(path, "rb")
+        except FileNotFoundError:
+            self._lost = True
+            return False
+        self._segment = AppendOnlyFile.segment_number(path)
+        self._offset = 0
+        return True
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _next_path(self):
+        if self._pending is None:
+            # Base first, then every later segment, as a restore replays them.
+            self._pending = AppendOnlyFile(self._aof_dir).segments()
+        if self._pending:
+            return self._pending.pop(0)
+        if self._segment is None:
+            # Nothing written yet, list again on the next poll.
+            self._pending = None
+            return None
+        path = os.path.join(self._aof_dir, "{:08d}{}".format(self._segment + 1, AppendOnlyFile.SEGMENT_SUFFIX))
+        if os.path.exists(path):
+            return path
+        if any(AppendOnlyFile.segment_number(fn) > self._segment + 1 for fn in os.listdir(self._aof_dir)
+               if fn.endswith(AppendOnlyFile.SEGMENT_SUFFIX) and not fn.endswith(AppendOnlyFile.BASE_SUFFIX)):
+            self._lost = True
+        return None
+
+    def _read(self):
+        while True:
+            record = AppendOnlyFile.read_record(self._file)
+            if record is None:
+                self._file.seek(self._offset)
+                return
+            self._offset = self._file.tell()
+            yield record
+
+    def poll(self):
+        """ Yield the records appended since the last poll. """
+        if self._lost or not os.path.isdir(self._aof_dir):
+            return
+        while True:
+            if self._file is not None:
+                yield from self._read()
+            path = self._next_path()
+            if path is None:
+                break
+            if self._file is not None:
+                # The next segment exists, so this one is sealed, read what landed after the last read.
+                yield from self._read()
+            if not self._open(path):
+                return
+        self._caught_up_at = time.time()
+
+    def apply(self, instance):
+        """ Replay the new records into `instance`, returns how many were applied. """
+        applied = 0
+        for record in self.poll():
+            instance.apply_record(record)
+            applied += 1
+            self._last_record_time = record.timestamp
+            self._last_apply_time = time.time()
+        self._records += applied
+        return applied
+
+    def close(self):
+        self._close()
+
+    def get_info(self):
+        now = time.time()
+        return {
+            "aof_dir": self._aof_dir,
+            "segment": self._segment,
+            "offset": self._offset,
+            "lost": self._lost,
+            "records": self._records,
+            "last_record_time": self._last_record_time,
+            # Writer append to follower apply of the last record.
+            "lag": round(self._last_apply_time - self._last_record_time, 4)
+            if self._last_record_time is not None else None,
+            # How far behind the writer the follower may be, the time since it last read to the end.
+            "staleness": round(now - self._caught_up_at, 4) if self._caught_up_at is not None else None,
+        }
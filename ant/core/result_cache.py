@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResultCache(object):
+    """
+    LRU cache of single-query search results bounded by `max_bytes`, with an optional TTL.
+
+    Entries are keyed by a hash of the query bytes plus `top_k` and `nprobe`, and
+    tagged with the instance generation they were computed at. A lookup or insert
+    at a newer generation drops every entry, so a write invalidates the cache
+    without touching it.
+    """
+
+    # Rough per-entry cost of the key, the tuple and the dict slot, on top of the result arrays.
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_bytes: int, ttl: float = 0):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def keys(vectors, top_k, nprobe):
+        vectors = np.ascontiguousarray(vectors)
+        return [(hashlib.blake2b(row.tobytes(), digest_size=16).digest(), top_k, nprobe) for row in vectors]
+
+    def _sync_generation(self, generation):
+        if generation > self._generation:
+            if self._entries:
+                self._invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
+        return generation == self._generation
+
+    def get(self, keys, generation, top_k):
+        """ Returns `(distances, ids, missing)`, rows listed in `missing` are left to the caller to fill. """
+        distances = np.empty((len(keys), top_k), dtype="float32")
+        ids = np.empty((len(keys), top_k), dtype="int64")
+        missing = []
+        now = time.time()
+        with self._lock:
+            current = self._sync_generation(generation)
+            for row, key in enumerate(keys):
+                entry = self._entries.get(key) if current else None
+                if entry is not None and self._ttl > 0 and now - entry[2] > self._ttl:
+                    self._pop(key)
+                    entry = None
+                if entry is None:
+                    missing.append(row)
+                    continue
+                self._entries.move_to_end(key)
+                distances[row], ids[row] = entry[0], entry[1]
+            self._hits += len(keys) - len(missing)
+            self._misses += len(missing)
+        return distances, ids, np.asarray(missing, dtype="int64")
+
+    def put(self, keys, distances, ids, generation):
+        now = time.time()
+        with self._lock:
+            if not self._sync_generation(generation):
+                return
+            for key, _distances, _ids in zip(keys, distances, ids):
+                if key in self._entries:
+                    self._pop(key)
+                entry = (_distances.copy(), _ids.copy(), now)
+                self._entries[key] = entry
+                self._bytes += self._entry_bytes(entry)
+            while self._bytes > self._max_bytes and self._entries:
+                self._pop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _entry_bytes(self, entry):
+        return entry[0].nbytes + entry[1].nbytes + self.ENTRY_OVERHEAD
+
+    def _pop(self, key):
+        self._bytes -= self._entry_bytes(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "ttl": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.,
+                "miss_rate": round(self._misses / lookups, 4) if lookups else 0.,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
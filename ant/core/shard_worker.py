@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Shard process of a `ShardedTopKSearch`, started as `python -m ant.core.shard_worker <fd>`.
+
+`fd` is this end of a socket pair. The first message holds the
+`TopKSearch` arguments and the shard's thread budget, every later one a `(req_id, method, args, kwargs)`
+call that runs in a thread pool and is answered with `(req_id, ok, result)`,
+`None` shuts the shard down.
+"""
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+
+from ant.core.threads import budget
+from ant.core.top_k_search import TopKSearch
+
+
+def serve(conn):
+    data_dir, version, configs, omp_budget = conn.recv()
+    try:
+        budget.resize(omp_budget)
+        instance = TopKSearch(data_dir, version, **configs)
+    except Exception as e:
+        conn.send((False, e))
+        return
+    conn.send((True, None))
+
+    send_lock = threading.Lock()
+
+    def reply(req_id, method, args, kwargs):
+        try:
+            attr = getattr(instance, method)
+            result, ok = (attr(*args, **kwargs) if callable(attr) else attr), True
+        except Exception as e:
+            result, ok = e, False
+        with send_lock:
+            try:
+                conn.send((req_id, ok, result))
+            except Exception as e:
+                # e.g. an exception that doesn't pickle, the caller still gets an answer.
+                conn.send((req_id, False, RuntimeError(repr(e))))
+
+    executor = ThreadPoolExecutor(thread_name_prefix="ant-shard")
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        executor.submit(reply, *message)
+    executor.shutdown(wait=True)
+    instance.close()
+
+
+if __name__ == "__main__":
+    serve(Connection(int(sys.argv[1])))
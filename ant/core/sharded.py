@@ -0,0 +1,346 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import socket
+import itertools
+import threading
+import subprocess
+from concurrent.futures import Future
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+from ant.core.rwlock import ReadWriteLock
+from ant.core.threads import budget
+from ant.core.top_k_search import TopKSearch
+from ant.core.ingest import NpyChunkReader, hash_partition
+
+
+class _ShardClient(object):
+    """ Proxy of a `TopKSearch` running in a `shard_worker` process, calls return futures. """
+
+    def __init__(self, data_dir, version, configs, omp_budget):
+        parent, child = socket.socketpair()
+        # Run as a fresh interpreter, `multiprocessing` start methods would re-import the service's `__main__`.
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p or os.getcwd() for p in sys.path))
+        self._process = subprocess.Popen([sys.executable, "-m", "ant.core.shard_worker", str(child.fileno())],
+                                         pass_fds=(child.fileno(),), env=env)
+        child.close()
+        self._conn = Connection(parent.detach())
+        self._conn.send((data_dir, version, configs, omp_budget))
+
+        self._send_lock = threading.Lock()
+        self._futures = {}
+        self._req_ids = itertools.count()
+        self._reader = None
+
+    def wait_started(self):
+        try:
+            ok, error = self._conn.recv()
+        except EOFError:
+            ok, error = False, RuntimeError("Shard process exited with code {}.".format(self._process.wait()))
+        if not ok:
+            self.close()
+            raise error
+        self._reader = threading.Thread(target=self._read, name="ant-shard-reader", daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                req_id, ok, result = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._futures.pop(req_id)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        for req_id in list(self._futures):
+            self._futures.pop(req_id).set_exception(RuntimeError("Shard process exited."))
+
+    def submit(self, method, *args, **kwargs):
+        future = Future()
+        with self._send_lock:
+            req_id = next(self._req_ids)
+            self._futures[req_id] = future
+            self._conn.send((req_id, method, args, kwargs))
+        return future
+
+    def call(self, method, *args, **kwargs):
+        return self.submit(method, *args, **kwargs).result()
+
+    def close(self, timeout=30):
+        try:
+            with self._send_lock:
+                self._conn.send(None)
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._conn.close()
+
+
+def _results(futures):
+    # Wait for every shard before raising, so no call is left running behind the caller's back.
+    errors = [f.exception() for f in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [f.result() for f in futures]
+
+
+class ShardedTopKSearch(object):
+    """
+    One instance hash partitioned by id across `num_shards` `TopKSearch` shard processes.
+
+    Every shard keeps its own AOF and snapshots under
+    `<data_dir>/<version>/shard-NN`. Writes are split by the owning shard of
+    each id and run on the shards in parallel, searches are fanned out to all
+    of them and the per-shard top-k merged. In `bulk_build` every shard trains
+    on the same seeded sample of the whole dataset, `build` trains once on the
+    first shard and builds every shard from that index (a shard may own few or
+    none of the rows), `train` shares one trained index across the shards
+    explicitly.
+    """
+
+    def __init__(self, data_dir: str, version: str, dim: int, num_shards: int = 2, **configs):
+        if not isinstance(num_shards, int) or num_shards < 1:
+            raise ValueError("`num_shards` should be a positive integer, got `{}`.".format(num_shards))
+        if not os.path.exists(data_dir):
+            raise FileNotFoundError(data_dir)
+
+        self._d = dim
+        self._num_shards = num_shards
+        self._data_dir = data_dir
+        self._version = version
+        self._metric = configs.get("metric", TopKSearch.METRIC_IP)
+        # Writes hold the read side, `bgsave` switches every shard under the write side.
+        self._rwlock = ReadWriteLock()
+        self._last_save = None
+
+        version_dir = os.path.join(self._data_dir, self._version)
+        if not os.path.exists(version_dir):
+            os.mkdir(version_dir)
+
+        configs = dict(configs, dim=dim)
+        # The shards split the cores of this process' thread budget.
+        omp_budget = max(1, budget.budget // num_shards)
+        self._shards = [_ShardClient(data_dir, self.shard_version(version, shard_no), configs, omp_budget)
+                        for shard_no in range(num_shards)]
+        try:
+            for shard in self._shards:
+                shard.wait_started()
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def shard_version(version, shard_no):
+        return os.path.join(version, "shard-{:02d}".format(shard_no))
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def dim(self):
+        return self._d
+
+    @property
+    def num_shards(self):
+        return self._num_shards
+
+    @property
+    def num_total(self):
+        return sum(_results([shard.submit("num_total") for shard in self._shards]))
+
+    @property
+    def ids(self):
+        return np.hstack(_results([shard.submit("ids") for shard in self._shards]))
+
+    def _fanout(self, method, *args, **kwargs):
+        return _results([shard.submit(method, *args, **kwargs) for shard in self._shards])
+
+    def _partition(self, int64_ids):
+        """ `(shard_no, rows)` of every shard owning some of `int64_ids`. """
+        owners = hash_partition(int64_ids, self._num_shards)
+        order = np.argsort(owners, kind="stable")
+        bounds = np.searchsorted(owners[order], np.arange(self._num_shards + 1))
+        return [(shard_no, order[lo:hi]) for shard_no, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))
+                if hi > lo]
+
+    def _routed(self, method, int64_ids, float32_vectors=None, all_shards=False, **kwargs):
+        parts = dict(self._partition(int64_ids))
+        futures = []
+        for shard_no, shard in enumerate(self._shards):
+            rows = parts.get(shard_no)
+            if rows is None and not all_shards:
+                continue
+            if rows is None:
+                rows = np.empty(0, dtype="int64")
+            args = (int64_ids[rows],) if float32_vectors is None else (float32_vectors[rows], int64_ids[rows])
+            futures.append((rows, shard.submit(method, *args, **kwargs)))
+        return [rows for rows, _ in futures], _results([future for _, future in futures])
+
+    def _write(self, method, float32_vectors, int64_ids):
+        float32_vectors = np.ascontiguousarray(float32_vectors, dtype="float32")
+        int64_ids = np.ascontiguousarray(int64_ids, dtype="int64")
+        with self._rwlock.read_lock():
+            self._routed(method, int64_ids, float32_vectors)
+
+    def build(self, float32_vectors, int64_ids):
+        float32_vectors = np.ascontiguousarray(float32_vectors, dtype="float32")
+        int64_ids = np.ascontiguousarray(int64_ids, dtype="int64")
+        with self._rwlock.read_lock():
+            # Every shard is built, even one owning none of the ids, so that all of them can be searched.
+            trained = self._shards[0].call("train_index", float32_vectors)
+            self._routed("build", int64_ids, float32_vectors, all_shards=True, trained=trained)
+
+    def insert(self, float32_vectors, int64_ids):
+        self._write("insert", float32_vectors, int64_ids)
+
+    def update(self, float32_vectors, int64_ids):
+        self._write("update", float32_vectors, int64_ids)
+
+    def remove(self, int64_ids):
+        with self._rwlock.read_lock():
+            self._routed("remove", np.ascontiguousarray(int64_ids, dtype="int64"))
+
+    def bulk_build(self, reader):
+        with self._rwlock.read_lock():
+            _results([shard.submit("bulk_build", reader.partition(shard_no, self._num_shards))
+                      for shard_no, shard in enumerate(self._shards)])
+
+    def bulk_insert(self, reader):
+        with self._rwlock.read_lock():
+            _results([shard.submit("bulk_insert", reader.partition(shard_no, self._num_shards))
+                      for shard_no, shard in enumerate(self._shards)])
+
+    def train(self, source, filename=None):
+        """ Train once on the first shard and make the result the template of every shard. """
+        if not isinstance(source, NpyChunkReader):
+            source = np.asarray(source, dtype="float32")
+        filename = self._shards[0].call("train", source, filename=filename)
+        _results([shard.submit("use_trained", filename) for shard in self._shards[1:]])
+        return filename
+
+    def contains(self, int64_ids):
+        int64_ids = np.ascontiguousarray(int64_ids, dtype="int64")
+        result = np.zeros(len(int64_ids), dtype="bool")
+        for rows, contained in zip(*self._routed("contains", int64_ids)):
+            result[rows] = contained
+        return result
+
+    def reconstruct_batch(self, int64_ids):
+        int64_ids = np.ascontiguousarray(int64_ids, dtype="int64")
+        positions, vectors = [np.empty(0, dtype="int64")], [np.empty((0, self._d), dtype="float32")]
+        for rows, (_vectors, alive_ids) in zip(*self._routed("reconstruct_batch", int64_ids)):
+            positions.append(rows[np.isin(int64_ids[rows], alive_ids)])
+            vectors.append(_vectors)
+        # Back to request order, as a single `TopKSearch` returns them.
+        positions = np.hstack(positions)
+        order = np.argsort(positions, kind="stable")
+        return np.vstack(vectors)[order], int64_ids[positions[order]]
+
+    def _merge(self, results, top_k):
+        distances = np.hstack([result[0] for result in results])
+        ids = np.hstack([result[1] for result in results])
+        # Shards pad missing hits with the worst distance of the metric, so they sort last as well.
+        keys = distances if self._metric == TopKSearch.METRIC_L2 else -distances
+        order = np.argsort(keys, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def search(self, float32_vectors, top_k: int = 10, nprobe: int = 10):
+        float32_vectors = np.ascontiguousarray(float32_vectors, dtype="float32")
+        return self._merge(self._fanout("search", float32_vectors, top_k=top_k, nprobe=nprobe), top_k)
+
+    def explain(self, float32_vectors, top_k: int = 10, nprobe: int = 10):
+        """ `search` with the Faiss counters of every shard, summed and per shard in `shards`. """
+        float32_vectors = np.ascontiguousarray(float32_vectors, dtype="float32")
+        results = self._fanout("explain", float32_vectors, top_k=top_k, nprobe=nprobe)
+        shards = [stats for _, _, stats in results]
+        stats = {key: sum(shard[key] for shard in shards) for key in shards[0] if key not in ("nq", "nprobe")}
+        stats.update(nq=len(float32_vectors), nprobe=nprobe, shards=shards)
+        distances, ids = self._merge(results, top_k)
+        return distances, ids, stats
+
+    def rebuild(self):
+        self._fanout("rebuild")
+
+    def restore_from_fif(self):
+        self._fanout("restore_from_fif")
+
+    def save(self):
+        self._fanout("save")
+
+    def bgsave(self, version, on_switch=None):
+        """
+        Snapshot every shard into `version` as of one point across all of them.
+
+        The shards write their snapshots in parallel, then switch over together
+        while writes are held off, so no write lands in some shards' snapshots
+        and not in the others'.
+        """
+        started_at = time.time()
+        version_dir = os.path.join(self._data_dir, version)
+        if not os.path.exists(version_dir):
+            os.mkdir(version_dir)
+
+        versions = [self.shard_version(version, shard_no) for shard_no in range(self._num_shards)]
+        try:
+            _results([shard.submit("bgsave_prepare", _version) for shard, _version in zip(self._shards, versions)])
+        except Exception:
+            _results([shard.submit("bgsave_abort", _version) for shard, _version in zip(self._shards, versions)])
+            raise
+
+        with self._rwlock.write_lock():
+            saves = _results([shard.submit("bgsave_switch", _version)
+                              for shard, _version in zip(self._shards, versions)])
+            self._version = version
+            if on_switch is not None:
+                on_switch()
+
+        self._last_save = {
+            "version": version,
+            "started_at": started_at,
+            "duration": round(time.time() - started_at, 4),
+            "bytes": sum(save["bytes"] for save in saves),
+        }
+        return self._last_save
+
+    @property
+    def last_save(self):
+        return self._last_save
+
+    def bgrewriteaof(self):
+        return all(self._fanout("bgrewriteaof"))
+
+    def get_info(self):
+        shards = self._fanout("get_info")
+        configs = dict(shards[0]["configs"], data_dir=self._data_dir, version=self._version,
+                       num_shards=self._num_shards)
+        rebuild_times = [info["rebuild_time"] for info in shards]
+        return {
+            "num_total": sum(info["num_total"] for info in shards),
+            "last_save": self._last_save,
+            # The shards rebuild in parallel, the slowest one is the instance's.
+            "rebuild_time": None if None in rebuild_times else max(rebuild_times),
+            "aof": {key: sum(info["aof"][key] for info in shards) for key in ("size", "appends", "append_time")},
+            "buffer": {key: sum(info["buffer"][key] for info in shards) for key in ("size", "appends", "append_time")},
+            "shards": shards,
+            "configs": configs,
+        }
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+    @staticmethod
+    def get_strtime(tz=None, fmt="%Y-%m-%d %H:%M:%S.%f"):
+        return TopKSearch.get_strtime(tz=tz, fmt=fmt)
@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import faiss as core
+
+
+def _extract_ivf(index):
+    try:
+        return core.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _digest(*buffers):
+    digest = hashlib.blake2b(digest_size=16)
+    for buffer in buffers:
+        digest.update(buffer)
+    return digest.hexdigest()
+
+
+class ListSnapshot(object):
+    """
+    IVF index snapshot stored as content-addressed chunks in a `LISTS` directory.
+
+    Every non-empty inverted list is one `<digest>.ivl` chunk (its int64 ids then
+    its codes), the index without its lists (quantizer, transforms, parameters)
+    is the `<digest>.index` skeleton, and `MANIFEST.json` maps list numbers to
+    chunks. A new snapshot hard links the chunks it shares with the previous
+    one and only writes the lists whose content changed, so versions share
+    their unchanged data on disk and removing a version only drops its links.
+    """
+
+    MANIFEST = "MANIFEST.json"
+    CHUNK_SUFFIX = ".ivl"
+    SKELETON_SUFFIX = ".index"
+    FORMAT = 1
+
+    def __init__(self, lists_dir: str, manifest: dict):
+        self._lists_dir = lists_dir
+        self._manifest = manifest
+        # `TopKSearch` generation the snapshot was taken (or loaded) at, unchanged data needs no hashing.
+        self.generation = None
+
+    @property
+    def lists_dir(self):
+        return self._lists_dir
+
+    @property
+    def skeleton(self):
+        return self._manifest["skeleton"]
+
+    @property
+    def lists(self):
+        return self._manifest["lists"]
+
+    @property
+    def ntotal(self):
+        return self._manifest["ntotal"]
+
+    def has(self, name):
+        return name is not None and os.path.exists(os.path.join(self._lists_dir, name))
+
+    @classmethod
+    def open(cls, lists_dir: str):
+        """ The snapshot in `lists_dir`, None when there is none. """
+        _fn = os.path.join(lists_dir, cls.MANIFEST)
+        if not os.path.exists(_fn):
+            return None
+        with open(_fn, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != cls.FORMAT:
+            raise ValueError("Unsupported snapshot format `{}` in `{}`.".format(manifest.get("format"), lists_dir))
+        return cls(lists_dir, manifest)
+
+    @staticmethod
+    def supports(index):
+        ivf = _extract_ivf(index) if index is not None else None
+        return ivf is not None and isinstance(core.downcast_InvertedLists(ivf.invlists), core.ArrayInvertedLists)
+
+    @classmethod
+    def serialize_skeleton(cls, index):
+        """
+        `(name, bytes)` of `index` without its inverted lists. The lists are
+        swapped out for the copy, the caller must exclude searches and writes.
+        """
+        ivf = _extract_ivf(index)
+        invlists, own_invlists = ivf.invlists, ivf.own_invlists
+        # Owned by Python, kept referenced until the original lists are back.
+        empty = core.ArrayInvertedLists(ivf.nlist, ivf.code_size)
+        ivf.own_invlists = False
+        ivf.replace_invlists(empty, False)
+        try:
+            skeleton = core.clone_index(index)
+        finally:
+            ivf.replace_invlists(invlists, own_invlists)
+        skeleton_ivf = _extract_ivf(skeleton)
+        skeleton_ivf.set_direct_map_type(core.DirectMap.NoMap)
+        skeleton_ivf.ntotal = skeleton.ntotal = 0
+        data = core.serialize_index(skeleton)
+        return _digest(data) + cls.SKELETON_SUFFIX, data
+
+    @classmethod
+    def capture(cls, index, skeleton: str, previous=None, workers: int = None):
+        """
+        Hash every inverted list of `index`, copying out the lists `previous`
+        doesn't have. Lists must not change meanwhile, the caller holds off
+        writes. Returns what `write` needs.
+        """
+        ivf = _extract_ivf(index)
+        invlists = core.downcast_InvertedLists(ivf.invlists)
+        code_size = ivf.code_size
+
+        def chunk(list_no):
+            size = invlists.list_size(list_no)
+            if size == 0:
+                return None, 0, None
+            ids = core.rev_swig_ptr(invlists.get_ids(list_no), size)
+            codes = core.rev_swig_ptr(invlists.get_codes(list_no), size * code_size)
+            # hashlib releases the GIL on large buffers, lists are hashed in parallel.
+            name = _digest(ids, codes) + cls.CHUNK_SUFFIX
+            if previous is not None and previous.has(name):
+                return name, size, None
+            return name, size, ids.tobytes() + codes.tobytes()
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            chunks = list(executor.map(chunk, range(ivf.nlist)))
+
+        return {
+            "manifest": {
+                "format": cls.FORMAT,
+                "skeleton": skeleton,
+                "nlist": ivf.nlist,
+                "code_size": code_size,
+                "ntotal": int(sum(size for _, size, _ in chunks)),
+                "lists": [[name, size] for name, size, _ in chunks],
+            },
+            "dirty": {name: data for name, _, data in chunks if data is not None},
+        }
+
+    @classmethod
+    def reuse(cls, previous, skeleton: str):
+        """ `capture` of an index unchanged since `previous`. """
+        return {"manifest": dict(previous._manifest, skeleton=skeleton), "dirty": {}}
+
+    @classmethod
+    def write(cls, lists_dir: str, captured: dict, previous=None, skeleton_data: bytes = None):
+        """
+        Write a captured snapshot into `lists_dir`, replacing the one there:
+        dirty chunks (and `skeleton_data` if given) are written, the others
+        linked from `previous`. Returns the snapshot and what it took.
+        """
+        manifest, dirty = captured["manifest"], captured["dirty"]
+        tmp_dir = lists_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.mkdir(tmp_dir)
+        written, written_bytes, linked, linked_bytes = 0, 0, 0, 0
+
+        names = [(manifest["skeleton"], skeleton_data)] + [(name, dirty.get(name)) for name, _ in manifest["lists"]
+                                                             if name is not None]
+        for name, data in names:
+            _fn = os.path.join(tmp_dir, name)
+            if os.path.exists(_fn):
+                continue
+            if data is None:
+                if previous is None or not previous.has(name):
+                    raise ValueError("Chunk `{}` is neither dirty nor in the previous snapshot.".format(name))
+                os.link(os.path.join(previous.lists_dir, name), _fn)
+                linked += 1
+                linked_bytes += os.path.getsize(_fn)
+                continue
+            with open(_fn, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            written += 1
+            written_bytes += len(data)
+
+        with open(os.path.join(tmp_dir, cls.MANIFEST), "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        cls._fsync_dir(tmp_dir)
+
+        old_dir = lists_dir + ".old"
+        if os.path.exists(lists_dir):
+            os.replace(lists_dir, old_dir)
+        os.replace(tmp_dir, lists_dir)
+        cls._fsync_dir(os.path.dirname(os.path.abspath(lists_dir)))
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+        snapshot = cls(lists_dir, manifest)
+        stats = {
+            "chunks_written": written,
+            "chunks_linked": linked,
+            "bytes": written_bytes,
+            "linked_bytes": linked_bytes,
+        }
+        return snapshot, stats
+
+    @staticmethod
+    def _fsync_dir(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def load(self):
+        """ The index of the snapshot, read into memory without a direct map. """
+        with open(os.path.join(self._lists_dir, self.skeleton), "rb") as f:
+            index = core.deserialize_index(np.frombuffer(f.read(), dtype="uint8"))
+        ivf = _extract_ivf(index)
+        invlists = ivf.invlists
+        code_size = self._manifest["code_size"]
+        for list_no, (name, size) in enumerate(self.lists):
+            if name is None:
+                continue
+            data = np.fromfile(os.path.join(self._lists_dir, name), dtype="uint8")
+            if len(data) != size * (8 + code_size):
+                raise ValueError("Chunk `{}` of list {} has {} bytes, expected {}.".format(
+                    name, list_no, len(data), size * (8 + code_size)))
+            ids = data[:size * 8].view("int64")
+            codes = data[size * 8:]
+            invlists.add_entries(list_no, size, core.swig_ptr(ids), core.swig_ptr(codes))
+        ivf.ntotal = index.ntotal = self.ntotal
+        return index
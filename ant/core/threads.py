@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import threading
+from contextlib import contextmanager
+
+import faiss as core
+
+
+class ThreadBudget(object):
+    """
+    Cores shared by the OpenMP parallel regions Faiss runs for all the instances of the process.
+
+    Every Faiss call asks for its thread count right before it runs and gets
+    it, or what is left of the budget but at least one thread, so concurrent
+    builds and searches together stay around `budget` cores instead of each
+    starting one thread per core.
+    """
+
+    def __init__(self, budget: int = None):
+        self._lock = threading.Lock()
+        self._budget = None
+        self._in_use = 0
+        self._calls = 0
+        self._shrunk = 0
+        self.resize(budget)
+
+    @property
+    def budget(self):
+        return self._budget
+
+    def resize(self, budget: int = None):
+        """ Set the budget, `None` for the cpu count. """
+        budget = budget or os.cpu_count() or 1
+        if not isinstance(budget, int) or budget < 1:
+            raise ValueError("`omp_budget` should be a positive integer, got `{}`.".format(budget))
+        self._budget = budget
+
+    @contextmanager
+    def threads(self, wanted: int):
+        """ Run the Faiss calls of the block on up to `wanted` threads, yields the granted count. """
+        wanted = max(1, min(wanted, self._budget))
+        with self._lock:
+            granted = max(1, min(wanted, self._budget - self._in_use))
+            self._in_use += granted
+            self._calls += 1
+            if granted < wanted:
+                self._shrunk += 1
+        try:
+            # The OpenMP thread count is per calling thread, it only sizes the regions this call starts.
+            core.omp_set_num_threads(granted)
+            yield granted
+        finally:
+            with self._lock:
+                self._in_use -= granted
+
+    def get_info(self):
+        with self._lock:
+            return {
+                "budget": self._budget,
+                "in_use": self._in_use,
+                "calls": self._calls,
+                # Calls that got fewer threads than they asked for, the budget was taken by others.
+                "shrunk": self._shrunk,
+            }
+
+
+# The budget of this process, sized by the service at startup.
+budget = ThreadBudget()
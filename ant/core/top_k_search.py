@@ -1,11 +1,30 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 import os
-import uuid
+import time
+import shutil
+import weakref
+import threading
 import datetime as dt
 from functools import wraps
+from contextlib import ExitStack, contextmanager
 
 import numpy as np
+import faiss as core
+
+from ant.core.aof import AppendOnlyFile
+from ant.core.rwlock import ReadWriteLock
+from ant.core.threads import budget
+from ant.core.profiling import mark
+from ant.core.batcher import SearchBatcher
+from ant.core.id_index import IdIndex
+from ant.core.result_cache import ResultCache
+from ant.core.snapshot import ListSnapshot
+from ant.core.ingest import NpyChunkReader, sample_rows
+
+
+# Faiss search counters are process wide, explained searches take turns resetting and reading them.
+_faiss_stats_lock = threading.Lock()
 
 
 def _warp_dtype_check(*dtypes):
@@ -38,39 +57,197 @@ def _wrap_not_build_error(func):
     return wrapper
 
 
+def _wrap_read_lock(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._rwlock.read_lock():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _wrap_write_lock(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._rwlock.write_lock():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _mapped_rss(path):
+    rss, in_mapping = 0, False
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            for line in f:
+                fields = line.split()
+                if "-" in fields[0] and len(fields) >= 5:
+                    in_mapping = len(fields) >= 6 and fields[5] == path
+                elif in_mapping and fields[0] == "Rss:":
+                    rss += int(fields[1]) * 1024
+    except OSError:
+        return None
+    return rss
+
+
+def _extract_ivf(index):
+    try:
+        return core.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
 class TopKSearch(object):
 
+    INDEX_LOAD_MEMORY = "memory"
+    INDEX_LOAD_MMAP = "mmap"
+
+    METRIC_IP = "IP"
+    METRIC_L2 = "L2"
+    METRIC_COSINE = "cosine"
+
+    DELETE_IMMEDIATE = "immediate"
+    DELETE_TOMBSTONE = "tombstone"
+
+    SNAPSHOT_FULL = "full"
+    SNAPSHOT_INCREMENTAL = "incremental"
+
+    OP_BUILD = "build"
+    OP_WRITE = "write"
+    OP_SEARCH = "search"
+
     __DEFAULT_FIF = "FIF"
     __DEFAULT_AOF = "AOF"
     __DEFAULT_BUFFER = "BUFFER"
+    __DEFAULT_IDS = "IDS.npy"
+    __DEFAULT_TOMBSTONES = "TOMBSTONES.npy"
+    __DEFAULT_TRAINED = "TRAINED"
+    __DEFAULT_LISTS = "LISTS"
     __DEFAULT_DUMPS_DIR = "data"
     __CMD_BUILD = "BUILD"
     __CMD_INSERT = "INSERT"
     __CMD_UPDATE = "UPDATE"
     __CMD_REMOVE = "REMOVE"
+    __CMD_TRAIN = "TRAIN"
+    # Id of the dead rows of a flat storage HNSW in its id map, searches skip them.
+    __DEAD_ID = -2
 
     def __init__(self,
                  data_dir: str,
                  version: str,
                  dim: int,
                  nlist: int = 128,
+                 index_factory: str = None,
+                 metric: str = METRIC_IP,
                  fif: str = None,
                  aof: str = None,
                  buffer: str = None,
-                 dumps_dir: str = None):
+                 dumps_dir: str = None,
+                 appendfsync: str = AppendOnlyFile.FSYNC_EVERYSEC,
+                 aof_segment_size: int = 64 * 1024 * 1024,
+                 auto_aof_rewrite_percentage: int = 100,
+                 auto_aof_rewrite_min_size: int = 64 * 1024 * 1024,
+                 index_load_mode: str = INDEX_LOAD_MEMORY,
+                 search_batch_window_ms: float = 0,
+                 search_batch_max_size: int = 256,
+                 delete_mode: str = DELETE_IMMEDIATE,
+                 tombstone_compact_ratio: float = 0.1,
+                 tombstone_oversample: float = 2.0,
+                 direct_map: bool = False,
+                 result_cache_size: int = 0,
+                 result_cache_ttl: float = 0,
+                 ingest_batch_size: int = 65536,
+                 train_size: int = 0,
+                 train_seed: int = 1234,
+                 trained_index: str = None,
+                 omp_threads: int = 0,
+                 search_omp_threads: int = 0,
+                 parallel_min_batch: int = 32,
+                 snapshot_mode: str = SNAPSHOT_FULL):
 
         self._d = dim
         self._nlist = nlist
+        self._index_factory = index_factory or "IVF{},Flat".format(nlist)
+        self._metric = metric
         self._data_dir = data_dir
         self._version = version
         self._dumps_dir = dumps_dir or self.__DEFAULT_DUMPS_DIR
         self._fif = fif or self.__DEFAULT_FIF
         self._aof = aof or self.__DEFAULT_AOF
         self._buffer = buffer or self.__DEFAULT_BUFFER
+        self._appendfsync = appendfsync
+        self._aof_segment_size = aof_segment_size
+        self._auto_aof_rewrite_percentage = auto_aof_rewrite_percentage
+        self._auto_aof_rewrite_min_size = auto_aof_rewrite_min_size
+        self._index_load_mode = index_load_mode
+        self._search_batch_window_ms = search_batch_window_ms
+        self._search_batch_max_size = search_batch_max_size
+        self._delete_mode = delete_mode
+        self._tombstone_compact_ratio = tombstone_compact_ratio
+        self._tombstone_oversample = tombstone_oversample
+        self._direct_map = direct_map
+        self._result_cache_size = result_cache_size
+        self._result_cache_ttl = result_cache_ttl
+        self._ingest_batch_size = ingest_batch_size
+        self._train_size = train_size
+        self._train_seed = train_seed
+        self._trained_index = trained_index
+        self._omp_threads = omp_threads
+        self._search_omp_threads = search_omp_threads
+        self._parallel_min_batch = parallel_min_batch
+        self._snapshot_mode = snapshot_mode
+
+        if self._index_load_mode not in (self.INDEX_LOAD_MEMORY, self.INDEX_LOAD_MMAP):
+            raise ValueError("`index_load_mode` should be in ('memory', 'mmap'), got `{}`.".format(index_load_mode))
+
+        if self._metric not in (self.METRIC_IP, self.METRIC_L2, self.METRIC_COSINE):
+            raise ValueError("`metric` should be in ('IP', 'L2', 'cosine'), got `{}`.".format(metric))
+
+        if self._delete_mode not in (self.DELETE_IMMEDIATE, self.DELETE_TOMBSTONE):
+            raise ValueError("`delete_mode` should be in ('immediate', 'tombstone'), got `{}`.".format(delete_mode))
+
+        if self._snapshot_mode not in (self.SNAPSHOT_FULL, self.SNAPSHOT_INCREMENTAL):
+            raise ValueError("`snapshot_mode` should be in ('full', 'incremental'), got `{}`.".format(snapshot_mode))
+
+        if self._snapshot_mode == self.SNAPSHOT_INCREMENTAL and self._index_load_mode == self.INDEX_LOAD_MMAP:
+            raise ValueError("`snapshot_mode` incremental needs `index_load_mode` memory, chunks can't be mapped.")
+
+        for name, value in (("omp_threads", omp_threads), ("search_omp_threads", search_omp_threads),
+                            ("parallel_min_batch", parallel_min_batch)):
+            if not isinstance(value, int) or value < 0:
+                raise ValueError("`{}` should be a non-negative integer, got `{}`.".format(name, value))
+
+        self._trained = self.load_trained(trained_index) if trained_index is not None else None
+        # Fail fast on an invalid factory string or an index ids can't be removed from.
+        self._check_removable(self.new_index())
 
         self._aof_lock = False
         self._memory_lock = False
         self._index = None
+        self._id_index = IdIndex()
+        self._tombstones = IdIndex()
+        self._compact_lock = threading.Lock()
+        self._compact_thread = None
+        self._compactions = 0
+        self._mapped_fif = None
+        self._aof_files = {}
+        self._rwlock = ReadWriteLock()
+        self._batcher = None
+        if self._search_batch_window_ms > 0:
+            self._batcher = SearchBatcher(self._search,
+                                          window_ms=self._search_batch_window_ms,
+                                          max_batch_size=self._search_batch_max_size)
+        self._result_cache = None
+        if self._result_cache_size > 0:
+            self._result_cache = ResultCache(self._result_cache_size, ttl=self._result_cache_ttl)
+        # Bumped by every write that can change search results, cached results of older generations are stale.
+        self._generation = 0
+        self._last_save = None
+        # Last incremental snapshot written or loaded, and the skeleton of the current index once serialized.
+        self._list_snapshot = None
+        self._skeleton = None
+        self._pending_save = None
+        self._rebuild_time = None
+        self._threads_lock = threading.Lock()
+        self._threads_stats = {op: {"calls": 0, "parallel": 0} for op in (self.OP_BUILD, self.OP_WRITE, self.OP_SEARCH)}
 
         if not os.path.exists(self._data_dir):
             raise FileNotFoundError(self._data_dir)
@@ -78,9 +255,6 @@ class TopKSearch(object):
         version_dir = os.path.join(self._data_dir, self._version)
         if not os.path.exists(version_dir):
             os.mkdir(version_dir)
-            _dumps_data_dir = os.path.join(version_dir, self._dumps_dir)
-            if not os.path.exists(_dumps_data_dir):
-                os.mkdir(_dumps_data_dir)
 
     @property
     def aof_lock(self):
@@ -104,24 +278,124 @@ class TopKSearch(object):
 
     @version.setter
     def version(self, value):
+        self.close_aof()
         self._version = value
 
     @property
     def num_total(self):
         if self._index is None:
             return 0
-        return self._index.ntotal
+        return len(self._id_index)
 
     @property
     def dim(self):
         return self._d
 
+    def new_index(self, trained=None):
+        trained = self._trained if trained is None else trained
+        if trained is not None:
+            return self._set_direct_map(core.deserialize_index(trained))
+        return self.new_untrained_index()
+
+    def new_untrained_index(self):
+        metric = core.METRIC_L2 if self._metric == self.METRIC_L2 else core.METRIC_INNER_PRODUCT
+        try:
+            index = core.index_factory(self._d, self._index_factory, metric)
+        except RuntimeError as e:
+            raise ValueError("Invalid `index_factory` `{}`: {}".format(self._index_factory, e))
+        # Only IVF indexes take external ids natively, the others are wrapped in an id map.
+        if _extract_ivf(index) is None and not isinstance(index, (core.IndexIDMap, core.IndexIDMap2)):
+            index = core.IndexIDMap2(index)
+        return self._set_direct_map(index)
+
+    def _set_direct_map(self, index):
+        # An id -> (list, offset) hashtable lets IVF indexes reconstruct and remove by id without a scan.
+        ivf = _extract_ivf(index)
+        if self._direct_map and ivf is not None and ivf.direct_map.type != core.DirectMap.Hashtable:
+            ivf.set_direct_map_type(core.DirectMap.Hashtable)
+        return index
+
+    def normalize(self, float32_vectors):
+        if self._metric != self.METRIC_COSINE:
+            return float32_vectors
+        float32_vectors = np.array(float32_vectors, dtype="float32", copy=True)
+        core.normalize_L2(float32_vectors)
+        return float32_vectors
+
+    def search_params(self, nprobe):
+        if isinstance(self._index, core.IndexIVF):
+            return core.SearchParametersIVF(nprobe=nprobe)
+        if isinstance(self._index, core.IndexPreTransform) and _extract_ivf(self._index) is not None:
+            return core.SearchParametersPreTransform(index_params=core.SearchParametersIVF(nprobe=nprobe))
+        return None
+
+    def _remove_ids(self, int64_ids):
+        int64_ids = np.ascontiguousarray(int64_ids, dtype="int64")
+        if self._marks_dead_rows(self._index):
+            return self._mark_dead_rows(int64_ids)
+        # The hashtable direct map only removes through an array selector.
+        self._index.remove_ids(core.IDSelectorArray(len(int64_ids), core.swig_ptr(int64_ids)))
+
+    @staticmethod
+    def _marks_dead_rows(index):
+        # Graph indexes can't remove in place, rows of a flat storage HNSW are marked dead until `compact`.
+        return isinstance(index, core.IndexIDMap2) and isinstance(core.downcast_index(index.index), core.IndexHNSWFlat)
+
+    def _mark_dead_rows(self, int64_ids):
+        if self._index.ntotal == 0:
+            return
+        id_map = core.rev_swig_ptr(self._index.id_map.data(), self._index.ntotal)
+        id_map[np.isin(id_map, int64_ids)] = self.__DEAD_ID
+
+    def _check_removable(self, index):
+        empty = np.empty(0, dtype="int64")
+        try:
+            index.remove_ids(core.IDSelectorArray(0, core.swig_ptr(empty)))
+        except RuntimeError:
+            if not self._marks_dead_rows(index):
+                raise ValueError("`index_factory` `{}` can't remove ids, use an IVF index or a flat storage HNSW "
+                                 "such as `HNSW32`.".format(self._index_factory))
+
     @property
     @_wrap_not_build_error
+    @_wrap_read_lock
     def ids(self):
-        index = core.extract_index_ivf(self._index)
+        return self._id_index.to_array()
+
+    @_wrap_not_build_error
+    @_warp_dtype_check("int64")
+    @_wrap_read_lock
+    def contains(self, int64_ids):
+        return self._id_index.contains(int64_ids)
+
+    @_wrap_not_build_error
+    @_warp_dtype_check("int64")
+    def reconstruct_batch(self, int64_ids):
+        """ Stored vectors of the alive ids among `int64_ids`, returned as `(vectors, ids)`. """
+        if not self._direct_map and _extract_ivf(self._index) is not None:
+            self._build_direct_map()
+        return self._reconstruct_batch(int64_ids)
+
+    @_wrap_write_lock
+    def _build_direct_map(self):
+        # Built on the first fetch, so only the IVF instances fetched from pay for the hashtable.
+        self._direct_map = True
+        self._set_direct_map(self._index)
+
+    @_wrap_read_lock
+    def _reconstruct_batch(self, int64_ids):
+        int64_ids = int64_ids[self._id_index.contains(int64_ids)]
+        if len(int64_ids) == 0:
+            return np.empty((0, self._d), dtype="float32"), int64_ids
+        return self._index.reconstruct_batch(int64_ids), int64_ids
+
+    def _scan_ids(self):
+        index = _extract_ivf(self._index)
+        if index is None:
+            ids = core.vector_to_array(self._index.id_map)
+            return ids[ids != self.__DEAD_ID]
         invlists = index.invlists
-        all_ids = []
+        all_ids = [np.empty(0, dtype="int64")]
         for listno in range(index.nlist):
             ls = invlists.list_size(listno)
             if ls == 0:
@@ -133,29 +407,197 @@ class TopKSearch(object):
         return all_ids
 
     @_warp_dtype_check("float32", "int64")
-    def build(self, float32_vectors, int64_ids):
+    def build(self, float32_vectors, int64_ids, trained=None):
+        """
+        Build the index from the vectors, trained on a sample of them unless
+        the instance has a trained template or `trained` (a serialized empty
+        trained index, see `train_index`) is given.
+        """
+        trained = self._trained if trained is None else trained
 
         if self._memory_lock is True and self._aof_lock is True:
-            return self.write_aof(self.__CMD_BUILD, float32_vectors, int64_ids, buffer=True)
-
-        if self._aof_lock is False:
-            self.write_aof(self.__CMD_BUILD, float32_vectors, int64_ids)
+            with self._rwlock.write_lock():
+                return self._write_build_aof(float32_vectors, int64_ids, trained, buffer=True)
 
+        float32_vectors = self.normalize(float32_vectors)
+        index = None
         if self._memory_lock is False:
-            quantizer = core.IndexFlatIP(self._d)
+            index = self.new_index(trained)
+            with self.omp_threads(self.OP_BUILD):
+                if not index.is_trained:
+                    index.train(self.training_sample(float32_vectors, index))
+                index.add_with_ids(float32_vectors, int64_ids)
 
-            self._index = core.IndexIVFFlat(quantizer,
-                                            self._d,
-                                            self._nlist,
-                                            core.METRIC_INNER_PRODUCT)
+            id_index = IdIndex(int64_ids)
 
-            self._index.train(float32_vectors)
-            self._index.add_with_ids(float32_vectors, int64_ids)
+        # The new index is built aside, searches keep using the old one until the swap.
+        with self._rwlock.write_lock():
+            if self._aof_lock is False:
+                self._write_build_aof(float32_vectors, int64_ids, trained)
+
+            if index is not None:
+                self._index = index
+                self._id_index = id_index
+                self._tombstones = IdIndex()
+                self._mapped_fif = None
+                self._generation += 1
+
+    def _write_build_aof(self, float32_vectors, int64_ids, trained, buffer=False):
+        if trained is None:
+            return self.write_aof(self.__CMD_BUILD, float32_vectors, int64_ids, buffer=buffer)
+        # Built from a trained index, replaying it as TRAIN + INSERT gives back the same index.
+        self.write_aof(self.__CMD_TRAIN, np.frombuffer(trained, dtype="uint8"), buffer=buffer)
+        if len(int64_ids) > 0:
+            self.write_aof(self.__CMD_INSERT, float32_vectors, int64_ids, buffer=buffer)
+
+    def train_size(self, index, num_vectors):
+        if self._train_size > 0:
+            return min(num_vectors, self._train_size)
+        # Faiss trains each k-means on at most 256 points per centroid, more rows are only subsampled.
+        ivf = _extract_ivf(index)
+        return min(num_vectors, max(256 * (ivf.nlist if ivf is not None else 1), 65536))
+
+    def training_sample(self, source, index):
+        """ Seeded random sample of `source` (an array or a `NpyChunkReader`) sized by `train_size`. """
+        size = self.train_size(index, len(source))
+        if isinstance(source, NpyChunkReader):
+            return source.sample(size, seed=self._train_seed)
+        if size < len(source):
+            return source[sample_rows(len(source), size, seed=self._train_seed)]
+        return source
+
+    def train(self, source, filename=None):
+        """
+        Train an empty index on a sample of `source` and keep it as the template of later builds.
+
+        The trained index is written to `filename` (default `TRAINED` in the
+        instance directory) so that new versions and sibling instances created
+        with `trained_index` pointing at it skip training.
+        """
+        index = self._new_trained_index(source)
+        filename = filename or os.path.join(self._data_dir, self.__DEFAULT_TRAINED)
+        core.write_index(index, filename + ".tmp")
+        os.replace(filename + ".tmp", filename)
+        return self.use_trained(filename)
+
+    def train_index(self, source):
+        """
+        Serialized empty trained index a build of `source` starts from: the
+        trained template if any, else one trained on a sample of `source`.
+        None when the index needs no training.
+        """
+        if self._trained is not None:
+            return self._trained
+        if self.new_untrained_index().is_trained:
+            return None
+        return core.serialize_index(self._new_trained_index(source))
+
+    def _new_trained_index(self, source):
+        if not isinstance(source, NpyChunkReader):
+            source = np.asarray(source, dtype="float32")
+        index = self.new_untrained_index()
+        if not index.is_trained:
+            with self.omp_threads(self.OP_BUILD):
+                index.train(self.normalize(self.training_sample(source, index)))
+        return index
+
+    def use_trained(self, filename):
+        """ Make the trained index at `filename` the template of later builds. """
+        self._trained = self.load_trained(filename)
+        self._trained_index = filename
+        return filename
+
+    def load_trained(self, filename):
+        if not os.path.exists(filename):
+            raise ValueError("`trained_index` `{}` is not exist.".format(filename))
+        index = core.read_index(filename)
+        metric = core.METRIC_L2 if self._metric == self.METRIC_L2 else core.METRIC_INNER_PRODUCT
+        if index.d != self._d or index.metric_type != metric or not index.is_trained or index.ntotal != 0:
+            raise ValueError("`trained_index` `{}` should be an empty trained index with dim = {} and metric `{}`."
+                             .format(filename, self._d, self._metric))
+        return core.serialize_index(index)
+
+    def bulk_build(self, reader):
+        """
+        Streaming `build` from a `NpyChunkReader`, peak memory is one batch plus the training sample.
+
+        The index is trained on a sample and filled batch by batch aside while
+        a `TRAIN` record holding the empty trained index and one `INSERT` per
+        batch are written to a staged AOF segment, then the segment is appended
+        and the index swapped in under the write lock. Searches keep running on
+        the old index meanwhile.
+        """
+        index = self.new_index()
+        if not index.is_trained:
+            with self.omp_threads(self.OP_BUILD):
+                index.train(self.normalize(self.training_sample(reader, index)))
+
+        buffer = self._memory_lock is True and self._aof_lock is True
+        aof_file = self.get_aof_file(buffer=buffer) if self._aof_lock is False or buffer else None
+        f, staged = aof_file.staging_file() if aof_file is not None else (None, None)
+        id_index = None
+        try:
+            if f is not None:
+                trained = np.frombuffer(core.serialize_index(index), dtype="uint8")
+                AppendOnlyFile.write_record(f, self.__CMD_TRAIN, np.empty(0, dtype="int64"), trained)
+            all_ids = []
+            for float32_vectors, int64_ids in reader.chunks(self._ingest_batch_size):
+                float32_vectors = self.normalize(float32_vectors)
+                if f is not None:
+                    AppendOnlyFile.write_record(f, self.__CMD_INSERT, int64_ids, float32_vectors)
+                if self._memory_lock is False:
+                    with self.omp_threads(self.OP_BUILD):
+                        index.add_with_ids(float32_vectors, int64_ids)
+                    all_ids.append(int64_ids)
+            if self._memory_lock is False:
+                id_index = IdIndex(np.hstack(all_ids) if all_ids else None)
+        except BaseException:
+            if staged is not None:
+                os.remove(staged)
+            raise
+        finally:
+            if f is not None:
+                f.close()
+
+        with self._rwlock.write_lock():
+            if staged is not None:
+                aof_file.append_staged(staged)
+
+            if id_index is not None:
+                self._index = index
+                self._id_index = id_index
+                self._tombstones = IdIndex()
+                self._mapped_fif = None
+                self._generation += 1
+
+    def bulk_insert(self, reader):
+        """ Streaming `insert` from a `NpyChunkReader`, one write and `INSERT` record per batch. """
+        for float32_vectors, int64_ids in reader.chunks(self._ingest_batch_size):
+            self.insert(float32_vectors, int64_ids)
+
+    @_wrap_write_lock
+    def reset_trained(self, uint8_index):
+        """ Replace the index with the serialized empty trained index of a `TRAIN` record. """
+        if self._memory_lock is True and self._aof_lock is True:
+            return self.write_aof(self.__CMD_TRAIN, uint8_index, buffer=True)
+
+        if self._aof_lock is False:
+            self.write_aof(self.__CMD_TRAIN, uint8_index)
+
+        if self._memory_lock is False:
+            self._index = self._set_direct_map(core.deserialize_index(np.ascontiguousarray(uint8_index).reshape(-1)))
+            self._id_index = IdIndex()
+            self._tombstones = IdIndex()
+            self._mapped_fif = None
+            self._generation += 1
 
     @_wrap_not_build_error
     @_warp_dtype_check("float32", "int64")
+    @_wrap_write_lock
     def insert(self, float32_vectors, int64_ids):
 
+        float32_vectors = self.normalize(float32_vectors)
+
         if self._memory_lock is True and self._aof_lock is True:
             return self.write_aof(self.__CMD_INSERT, float32_vectors, int64_ids, buffer=True)
 
@@ -163,12 +605,15 @@ class TopKSearch(object):
             self.write_aof(self.__CMD_INSERT, float32_vectors, int64_ids)
 
         if self._memory_lock is False:
-            self._index.add_with_ids(float32_vectors, int64_ids)
+            self._upsert(float32_vectors, int64_ids)
 
     @_wrap_not_build_error
     @_warp_dtype_check("float32", "int64")
+    @_wrap_write_lock
     def update(self, float32_vectors, int64_ids):
 
+        float32_vectors = self.normalize(float32_vectors)
+
         if self._memory_lock is True and self._aof_lock is True:
             return self.write_aof(self.__CMD_UPDATE, float32_vectors, int64_ids, buffer=True)
 
@@ -176,11 +621,29 @@ class TopKSearch(object):
             self.write_aof(self.__CMD_UPDATE, float32_vectors, int64_ids)
 
         if self._memory_lock is False:
-            self._index.remove_ids(int64_ids)
+            self._upsert(float32_vectors, int64_ids)
+
+    def _upsert(self, float32_vectors, int64_ids):
+        unique, last = np.unique(int64_ids[::-1], return_index=True)
+        if len(unique) < len(int64_ids):
+            # Of an id given twice the last vector wins, as if written one after the other.
+            rows = np.sort(len(int64_ids) - 1 - last)
+            float32_vectors, int64_ids = float32_vectors[rows], int64_ids[rows]
+        self._materialize()
+        self._purge_tombstones(int64_ids)
+        # Inserts are upserts too, the direct map keeps one entry per id and a second copy couldn't be removed.
+        existing = int64_ids[self._id_index.contains(int64_ids)]
+        if len(existing) > 0:
+            self._remove_ids(existing)
+        with self.omp_threads(self.OP_WRITE, len(int64_ids)):
             self._index.add_with_ids(float32_vectors, int64_ids)
+        self._id_index.add(int64_ids)
+        self._generation += 1
+        self._maybe_compact()
 
     @_wrap_not_build_error
     @_warp_dtype_check("int64")
+    @_wrap_write_lock
     def remove(self, int64_ids):
 
         if self._memory_lock is True and self._aof_lock is True:
@@ -190,71 +653,644 @@ class TopKSearch(object):
             self.write_aof(self.__CMD_REMOVE, int64_ids)
 
         if self._memory_lock is False:
-            self._index.remove_ids(int64_ids)
+            self._generation += 1
+            if self._delete_mode == self.DELETE_TOMBSTONE and not self._marks_dead_rows(self._index):
+                # The vectors stay in the index, searches filter them until the next compaction.
+                self._tombstones.add(int64_ids[self._id_index.contains(int64_ids)])
+                self._id_index.discard(int64_ids)
+                self._maybe_compact()
+                return
+            self._materialize()
+            self._remove_ids(int64_ids[self._id_index.contains(int64_ids)])
+            self._id_index.discard(int64_ids)
+            self._maybe_compact()
+
+    def _purge_tombstones(self, int64_ids):
+        # Re-inserted ids must not leave their tombstoned vectors behind.
+        dead = int64_ids[self._tombstones.contains(int64_ids)]
+        if len(dead) > 0:
+            self._remove_ids(dead)
+            self._tombstones.discard(dead)
+
+    @property
+    def num_tombstones(self):
+        """ Vectors still in the index that searches skip: tombstoned ids and dead HNSW rows. """
+        if self._index is None:
+            return 0
+        return self._index.ntotal - len(self._id_index)
+
+    @property
+    def compaction_in_progress(self):
+        return self._compact_thread is not None and self._compact_thread.is_alive()
+
+    def _should_compact(self):
+        if self._tombstone_compact_ratio <= 0 or self.compaction_in_progress:
+            return False
+        return self.num_tombstones >= self._tombstone_compact_ratio * max(self._index.ntotal, 1)
+
+    def _maybe_compact(self):
+        if self._should_compact():
+            self.bgcompact()
+
+    def bgcompact(self):
+        with self._compact_lock:
+            if self.compaction_in_progress:
+                return False
+            self._compact_thread = threading.Thread(target=self.compact, name="tombstone-compact", daemon=True)
+            self._compact_thread.start()
+            return True
+
+    @_wrap_not_build_error
+    def compact(self):
+        """
+        Physically remove the vectors searches skip, returns how many. Tombstoned
+        ids go in one pass over the inverted lists under the write lock, a flat
+        storage HNSW gets its graph rebuilt aside without its dead rows.
+        """
+        if self._marks_dead_rows(self._index):
+            return self._compact_graph()
+        return self._compact_tombstones()
+
+    @_wrap_write_lock
+    def _compact_tombstones(self):
+        dead = self._tombstones.to_array()
+        if len(dead) == 0:
+            return 0
+        self._materialize()
+        self._remove_ids(dead)
+        self._tombstones = IdIndex()
+        self._compactions += 1
+        return len(dead)
+
+    def _compact_graph(self):
+        with self._rwlock.read_lock():
+            index = self._index
+            num_rows = index.ntotal
+            ids = core.vector_to_array(index.id_map)
+            keep = ids != self.__DEAD_ID
+            if keep.all():
+                return 0
+            vectors = index.index.reconstruct_n(0, num_rows)[keep]
+
+        # The slow part, searches and writes go on with the old graph.
+        compacted = self.new_index()
+        with self.omp_threads(self.OP_BUILD):
+            compacted.add_with_ids(vectors, ids[keep])
+
+        with self._rwlock.write_lock():
+            if self._index is not index:
+                # Rebuilt or restored meanwhile.
+                return 0
+            # Rows written meanwhile are carried over, rows that died meanwhile are marked again.
+            id_map = core.rev_swig_ptr(index.id_map.data(), index.ntotal)
+            added = num_rows + np.flatnonzero(id_map[num_rows:] != self.__DEAD_ID)
+            if len(added) > 0:
+                compacted.add_with_ids(index.index.reconstruct_batch(added), id_map[added])
+            died = np.flatnonzero((id_map[:num_rows] == self.__DEAD_ID) & keep)
+            if len(died) > 0:
+                compacted_map = core.rev_swig_ptr(compacted.id_map.data(), compacted.ntotal)
+                compacted_map[(np.cumsum(keep) - 1)[died]] = self.__DEAD_ID
+            self._index = compacted
+            self._generation += 1
+            self._compactions += 1
+        return int(num_rows - keep.sum())
 
     @_wrap_not_build_error
     @_warp_dtype_check("float32")
     def search(self, float32_vectors, top_k: int = 10, nprobe: int = 10):
-        self._index.nprobe = nprobe
-        distances, ids = self._index.search(float32_vectors, top_k)
+        mark("dtype")
+        if self._result_cache is None:
+            return self._search_uncached(float32_vectors, top_k, nprobe)
+
+        generation = self._generation
+        keys = ResultCache.keys(float32_vectors, top_k, nprobe)
+        distances, ids, missing = self._result_cache.get(keys, generation, top_k)
+        mark("cache")
+        if len(missing) > 0:
+            distances[missing], ids[missing] = self._search_uncached(float32_vectors[missing], top_k, nprobe)
+            self._result_cache.put([keys[row] for row in missing], distances[missing], ids[missing], generation)
+            mark("cache")
         return distances, ids
 
+    def _search_uncached(self, float32_vectors, top_k, nprobe):
+        if self._batcher is not None:
+            result = self._batcher.search(float32_vectors, top_k, nprobe)
+            # A follower's whole wait for its batch, the leader's stages are marked in `_search`.
+            mark("batch")
+            return result
+        return self._search(float32_vectors, top_k, nprobe)
+
+    @_wrap_read_lock
+    def _search(self, float32_vectors, top_k, nprobe):
+        # Batching window and read lock.
+        mark("wait")
+        float32_vectors = self.normalize(float32_vectors)
+        mark("normalize")
+        with self.omp_threads(self.OP_SEARCH, len(float32_vectors)):
+            if self._index.ntotal > len(self._id_index):
+                distances, ids = self._search_alive(float32_vectors, top_k, self.search_params(nprobe))
+            else:
+                distances, ids = self._index.search(float32_vectors, top_k, params=self.search_params(nprobe))
+        mark("faiss")
+        return distances, ids
+
+    @_wrap_not_build_error
+    @_warp_dtype_check("float32")
+    def explain(self, float32_vectors, top_k: int = 10, nprobe: int = 10):
+        """
+        `search` past the result cache and batching, also returning the Faiss counters of the call.
+
+        The counters are process wide, searches running at the same time add to them.
+        """
+        mark("dtype")
+        with _faiss_stats_lock:
+            ivf_stats, hnsw_stats = core.cvar.indexIVF_stats, core.cvar.hnsw_stats
+            ivf_stats.reset()
+            hnsw_stats.reset()
+            distances, ids = self._search(float32_vectors, top_k, nprobe)
+            stats = {
+                "nq": len(float32_vectors),
+                "nprobe": nprobe,
+                "lists_probed": ivf_stats.nlist,
+                "ndis": ivf_stats.ndis + hnsw_stats.ndis,
+                "nheap_updates": ivf_stats.nheap_updates,
+                "hnsw_hops": hnsw_stats.nhops,
+                "quantization_time": round(ivf_stats.quantization_time, 3),
+                "search_time": round(ivf_stats.search_time, 3),
+                "tombstones": self.num_tombstones,
+            }
+        return distances, ids, stats
+
+    def wanted_threads(self, op, num_rows=0):
+        if op == self.OP_BUILD:
+            wanted = self._omp_threads or budget.budget
+        elif num_rows < self._parallel_min_batch:
+            wanted = 1
+        elif op == self.OP_SEARCH:
+            wanted = self._search_omp_threads or self._omp_threads or budget.budget
+        else:
+            wanted = self._omp_threads or budget.budget
+        return min(wanted, budget.budget)
+
+    def omp_threads(self, op, num_rows=0):
+        """
+        Budgeted OpenMP threads of one Faiss `op` call on `num_rows` rows.
+
+        Builds and training run on `omp_threads`. Searches and writes of fewer
+        than `parallel_min_batch` rows run single threaded, concurrent requests
+        are parallel across the executor workers instead (inter-query), larger
+        batches are split over `search_omp_threads` threads inside Faiss (intra-query).
+        """
+        wanted = self.wanted_threads(op, num_rows)
+        with self._threads_lock:
+            self._threads_stats[op]["calls"] += 1
+            if wanted > 1:
+                self._threads_stats[op]["parallel"] += 1
+        return budget.threads(wanted)
+
+    def get_threads_info(self):
+        with self._threads_lock:
+            stats = {op: dict(stats) for op, stats in self._threads_stats.items()}
+        for op, num_rows in ((self.OP_BUILD, 0), (self.OP_WRITE, self._parallel_min_batch),
+                             (self.OP_SEARCH, self._parallel_min_batch)):
+            # Threads of a batch of at least `parallel_min_batch` rows, smaller ones get one.
+            stats[op]["threads"] = self.wanted_threads(op, num_rows)
+        return dict(stats, parallel_min_batch=self._parallel_min_batch, budget=budget.get_info())
+
+    def _search_alive(self, float32_vectors, top_k, params):
+        # Oversample to make up for tombstoned hits, then retry the rows still short of `top_k`
+        # with a doubled `k`, at `top_k + num_tombstones` every alive hit is guaranteed.
+        n_dead = self.num_tombstones
+        k = top_k + min(n_dead, max(1, int(np.ceil(top_k * (self._tombstone_oversample - 1)))))
+        pad = -np.finfo("float32").max if self._index.metric_type == core.METRIC_INNER_PRODUCT \
+            else np.finfo("float32").max
+
+        result_distances = np.full((len(float32_vectors), top_k), pad, dtype="float32")
+        result_ids = np.full((len(float32_vectors), top_k), -1, dtype="int64")
+        rows = np.arange(len(float32_vectors))
+        while len(rows) > 0:
+            distances, ids = self._index.search(float32_vectors[rows], k, params=params)
+            keep = (ids != -1) & (ids != self.__DEAD_ID) & ~self._tombstones.contains(ids).reshape(ids.shape)
+            # A stable sort moves the kept hits to the front in their original order.
+            order = np.argsort(~keep, axis=1, kind="stable")[:, :top_k]
+            n_keep = keep.sum(axis=1)
+            filled = np.arange(top_k)[None, :] < n_keep[:, None]
+            result_distances[rows] = np.where(filled, np.take_along_axis(distances, order, axis=1), pad)
+            result_ids[rows] = np.where(filled, np.take_along_axis(ids, order, axis=1), -1)
+
+            if k >= top_k + n_dead:
+                break
+            rows = rows[(n_keep < top_k) & (ids[:, -1] != -1)]
+            k = min(k * 2, top_k + n_dead)
+        return result_distances, result_ids
+
     @_wrap_not_build_error
     def save(self):
         _version_dir = os.path.join(self._data_dir, self._version)
         if not os.path.exists(_version_dir):
             os.mkdir(_version_dir)
+        with self._snapshot_lock():
+            lists = self._capture_lists()
+            if lists is None:
+                return self._save_fif(_version_dir)
+            ids, tombstones = self._id_index.to_array(), self._tombstones.to_array()
+        self._save_ids(_version_dir, ids, tombstones)
+        self._write_lists(_version_dir, lists)
+
+    def _save_fif(self, _version_dir):
         _fn = os.path.join(_version_dir, self._fif)
+        self._remove_lists(_version_dir)
+        self._save_ids(_version_dir, self._id_index.to_array(), self._tombstones.to_array())
+        if self._mapped_fif is not None:
+            # A mapped index is unchanged since it was loaded, reuse its snapshot file.
+            if os.path.abspath(self._mapped_fif) != os.path.abspath(_fn):
+                os.link(self._mapped_fif, _fn)
+            self._mapped_fif = _fn
+            return
         core.write_index(self._index, _fn)
+        if self._index_load_mode == self.INDEX_LOAD_MMAP:
+            self.restore_from_fif()
+
+    @_wrap_not_build_error
+    def bgsave(self, version, on_switch=None):
+        """
+        Point-in-time snapshot into `version` while writes keep landing in memory.
+
+        The index is frozen into a serialized copy and the AOF rolled to a new
+        segment under the read lock, which excludes writers, the copy is
+        written without it, then the segments appended meanwhile are linked
+        into the new version and the instance switches over, calling
+        `on_switch` before releasing the lock. With `snapshot_mode` incremental
+        only the inverted lists changed since the last snapshot are copied and
+        written, see `ListSnapshot`.
+        """
+        self.bgsave_prepare(version)
+        return self.bgsave_switch(version, on_switch=on_switch)
+
+    @_wrap_not_build_error
+    def bgsave_prepare(self, version):
+        """ Write the snapshot of `bgsave`, the instance keeps serving its current version until the switch. """
+        started_at = time.time()
+        aof_file = self.get_aof_file()
+        paused = ExitStack()
+        paused.enter_context(aof_file.rewrite_paused())
+        try:
+            with self._snapshot_lock():
+                mapped_fif = self._mapped_fif
+                lists = self._capture_lists()
+                data = core.serialize_index(self._index) if mapped_fif is None and lists is None else None
+                ids = self._id_index.to_array()
+                tombstones = self._tombstones.to_array()
+                from_segment = aof_file.roll()
+
+            _version_dir = os.path.join(self._data_dir, version)
+            if not os.path.exists(_version_dir):
+                os.mkdir(_version_dir)
+            self._save_ids(_version_dir, ids, tombstones)
+            _fn = os.path.join(_version_dir, self._fif)
+            written = None
+            if lists is not None:
+                written = self._write_lists(_version_dir, lists)
+                _fn = os.path.join(_version_dir, self.__DEFAULT_LISTS)
+            elif mapped_fif is None:
+                with open(_fn + ".tmp", "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(_fn + ".tmp", _fn)
+            else:
+                os.link(mapped_fif, _fn)
+        except BaseException:
+            paused.close()
+            raise
+
+        self._pending_save = {
+            "version": version,
+            "started_at": started_at,
+            "aof_file": aof_file,
+            "from_segment": from_segment,
+            "mapped_fif": mapped_fif,
+            "fif": _fn,
+            "bytes": os.path.getsize(_fn) if written is None else written["bytes"],
+            "incremental": written,
+            "paused": paused,
+        }
+
+    def bgsave_switch(self, version, on_switch=None):
+        """ Link the AOF segments written since `bgsave_prepare` into `version` and switch over. """
+        pending = self._pending_save
+        if pending is None or pending["version"] != version:
+            raise ValueError("Exec bgsave_switch method, must run `bgsave_prepare` of version `{}` before."
+                             .format(version))
+        try:
+            with self._rwlock.read_lock():
+                pending["aof_file"].link_segments(os.path.join(self._data_dir, version, self._aof),
+                                                  pending["from_segment"])
+                self.version = version
+                if pending["mapped_fif"] is not None and self._mapped_fif == pending["mapped_fif"]:
+                    self._mapped_fif = pending["fif"]
+                if on_switch is not None:
+                    on_switch()
+        finally:
+            self._pending_save = None
+            pending["paused"].close()
+
+        self._last_save = {
+            "version": version,
+            "started_at": pending["started_at"],
+            "duration": round(time.time() - pending["started_at"], 4),
+            "bytes": pending["bytes"],
+        }
+        if pending["incremental"] is not None:
+            self._last_save.update(pending["incremental"])
+        return self._last_save
+
+    def bgsave_abort(self, version):
+        """ Drop the snapshot prepared for `version`, the instance stays on its current version. """
+        pending = self._pending_save
+        if pending is None or pending["version"] != version:
+            return
+        self._pending_save = None
+        pending["paused"].close()
+
+    @contextmanager
+    def _snapshot_lock(self):
+        """ The read lock, or the write lock while the skeleton of a new index is serialized. """
+        with self._rwlock.read_lock():
+            if not self._skeleton_outdated():
+                yield
+                return
+        with self._rwlock.write_lock():
+            if self._skeleton_outdated():
+                name, data = ListSnapshot.serialize_skeleton(self._index)
+                self._skeleton = {"index": weakref.ref(self._index), "name": name, "data": data}
+            yield
+
+    def _skeleton_outdated(self):
+        if self._snapshot_mode != self.SNAPSHOT_INCREMENTAL or not ListSnapshot.supports(self._index):
+            return False
+        skeleton = self._skeleton
+        if skeleton is None or skeleton["index"]() is not self._index:
+            return True
+        return skeleton["data"] is None and (self._list_snapshot is None or
+                                             not self._list_snapshot.has(skeleton["name"]))
+
+    def _lists_state(self):
+        # The lists are unchanged while neither the generation nor the count moved (compaction keeps the former).
+        return self._generation, self._index.ntotal
+
+    def _capture_lists(self):
+        """ Under `_snapshot_lock`, the inverted lists to write incrementally, None for a full snapshot. """
+        if self._snapshot_mode != self.SNAPSHOT_INCREMENTAL or not ListSnapshot.supports(self._index):
+            return None
+        previous, skeleton = self._list_snapshot, self._skeleton
+        if previous is not None and previous.generation == self._lists_state():
+            captured = ListSnapshot.reuse(previous, skeleton["name"])
+        else:
+            captured = ListSnapshot.capture(self._index, skeleton["name"], previous=previous)
+        return dict(captured, skeleton=skeleton, state=self._lists_state())
+
+    def _write_lists(self, version_dir, lists):
+        skeleton = lists["skeleton"]
+        snapshot, stats = ListSnapshot.write(os.path.join(version_dir, self.__DEFAULT_LISTS), lists,
+                                             previous=self._list_snapshot, skeleton_data=skeleton["data"])
+        snapshot.generation = lists["state"]
+        self._list_snapshot = snapshot
+        # Later snapshots of the same index link the skeleton.
+        skeleton["data"] = None
+        _fn = os.path.join(version_dir, self._fif)
+        if os.path.exists(_fn) and _fn != self._mapped_fif:
+            os.remove(_fn)
+        return stats
+
+    def _remove_lists(self, version_dir):
+        _lists = os.path.join(version_dir, self.__DEFAULT_LISTS)
+        if os.path.isdir(_lists):
+            shutil.rmtree(_lists)
+
+    def _save_ids(self, version_dir, ids, tombstones):
+        for filename, array in ((self.__DEFAULT_IDS, ids), (self.__DEFAULT_TOMBSTONES, tombstones)):
+            _fn = os.path.join(version_dir, filename)
+            if filename == self.__DEFAULT_TOMBSTONES and len(array) == 0:
+                if os.path.exists(_fn):
+                    os.remove(_fn)
+                continue
+            with open(_fn + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(_fn + ".tmp", _fn)
+
+    @property
+    def last_save(self):
+        return self._last_save
+
+    def get_memory_info(self):
+        resident_bytes, mapped_bytes, mapped_resident_bytes = 0, 0, 0
+        index = _extract_ivf(self._index) if self._index is not None else None
+        if index is None and self._index is not None:
+            try:
+                code_size = self._index.sa_code_size()
+            except RuntimeError:
+                code_size = self._d * 4
+            resident_bytes = self._index.ntotal * (code_size + 8)
+        elif index is not None:
+            resident_bytes = index.nlist * self._d * 4
+            if self._mapped_fif is None:
+                resident_bytes += index.ntotal * (index.code_size + 8)
+            else:
+                mapped_bytes = os.path.getsize(self._mapped_fif)
+                mapped_resident_bytes = _mapped_rss(os.path.abspath(self._mapped_fif))
+        return {
+            "index_load_mode": self._index_load_mode,
+            "mapped": self._mapped_fif is not None,
+            "resident_bytes": resident_bytes,
+            "mapped_bytes": mapped_bytes,
+            "mapped_resident_bytes": mapped_resident_bytes,
+        }
 
     def get_info(self):
         return {
             "num_total": self.num_total,
+            "memory": self.get_memory_info(),
+            "last_save": self._last_save,
+            # Seconds the last snapshot load plus AOF replay took, e.g. at startup.
+            "rebuild_time": self._rebuild_time,
+            "search_batching": self._batcher.get_stats() if self._batcher is not None else None,
+            "result_cache": self._result_cache.get_stats() if self._result_cache is not None else None,
+            "generation": self._generation,
+            "threads": self.get_threads_info(),
+            "aof": self.get_aof_file().get_info(),
+            "buffer": self.get_aof_file(buffer=True).get_info(),
+            "tombstones": {
+                "delete_mode": self._delete_mode,
+                "count": self.num_tombstones,
+                "ratio": round(self.num_tombstones / max(self._index.ntotal, 1), 4)
+                if self._index is not None else 0,
+                "compactions": self._compactions,
+                "compaction_in_progress": self.compaction_in_progress,
+            },
             "configs": {
                 "dim": self.dim,
                 "nlist": self._nlist,
+                "index_factory": self._index_factory,
+                "metric": self._metric,
                 "data_dir": self._data_dir,
                 "version": self._version,
                 "dumps_dir": self._dumps_dir,
                 "fif": self._fif,
                 "aof": self._aof,
                 "buffer": self._buffer,
+                "appendfsync": self._appendfsync,
+                "aof_segment_size": self._aof_segment_size,
+                "auto_aof_rewrite_percentage": self._auto_aof_rewrite_percentage,
+                "auto_aof_rewrite_min_size": self._auto_aof_rewrite_min_size,
+                "index_load_mode": self._index_load_mode,
+                "search_batch_window_ms": self._search_batch_window_ms,
+                "search_batch_max_size": self._search_batch_max_size,
+                "delete_mode": self._delete_mode,
+                "tombstone_compact_ratio": self._tombstone_compact_ratio,
+                "tombstone_oversample": self._tombstone_oversample,
+                "direct_map": self._direct_map,
+                "result_cache_size": self._result_cache_size,
+                "result_cache_ttl": self._result_cache_ttl,
+                "ingest_batch_size": self._ingest_batch_size,
+                "train_size": self._train_size,
+                "train_seed": self._train_seed,
+                "trained_index": self._trained_index,
+                "omp_threads": self._omp_threads,
+                "search_omp_threads": self._search_omp_threads,
+                "parallel_min_batch": self._parallel_min_batch,
+                "snapshot_mode": self._snapshot_mode,
             }
         }
 
     def rebuild(self):
+        started_at = time.time()
         self.restore_from_fif()
         self.aof_lock = True
         self.restore_from_aof()
         self.aof_lock = False
+        self._rebuild_time = round(time.time() - started_at, 4)
 
     def restore_from_fif(self):
         _fn = os.path.join(self._data_dir, self._version, self._fif)
-        if os.path.exists(_fn):
+        snapshot = ListSnapshot.open(os.path.join(self._data_dir, self._version, self.__DEFAULT_LISTS))
+        if snapshot is None and not os.path.exists(_fn):
+            return
+        if snapshot is not None:
+            # Incremental snapshots are assembled from their chunks in memory.
+            self._index = snapshot.load()
+            self._mapped_fif = None
+            self._list_snapshot = snapshot
+            self._skeleton = {"index": weakref.ref(self._index), "name": snapshot.skeleton, "data": None}
+        elif self._index_load_mode == self.INDEX_LOAD_MMAP:
+            self._index = core.read_index(_fn, core.IO_FLAG_MMAP)
+            # Only inverted lists are mapped, other index types are read into memory.
+            self._mapped_fif = _fn if _extract_ivf(self._index) is not None else None
+        else:
             self._index = core.read_index(_fn)
+            self._mapped_fif = None
+        self._generation += 1
+        if snapshot is not None:
+            snapshot.generation = self._lists_state()
+        # Snapshots written before the direct map existed get it rebuilt on load.
+        self._set_direct_map(self._index)
+
+        _tombstones = os.path.join(self._data_dir, self._version, self.__DEFAULT_TOMBSTONES)
+        self._tombstones = IdIndex.load(_tombstones) if os.path.exists(_tombstones) else IdIndex()
+        _ids = os.path.join(self._data_dir, self._version, self.__DEFAULT_IDS)
+        if os.path.exists(_ids):
+            self._id_index = IdIndex.load(_ids)
+        else:
+            self._id_index = IdIndex(self._scan_ids())
+            self._id_index.discard(self._tombstones.to_array())
+
+    def _materialize(self):
+        # Mapped inverted lists are read only, the first write loads a private copy.
+        if self._mapped_fif is not None:
+            self._index = core.read_index(self._mapped_fif)
+            self._mapped_fif = None
 
     def restore_from_aof(self, buffer=False):
+        self.migrate_legacy_aof(buffer=buffer)
+        for record in self.get_aof_file(buffer=buffer):
+            self.apply_record(record)
+
+    def apply_record(self, record):
+        """ Replay one AOF record. """
+        ops = self.get_ops(record.cmd)
+        if ops is None:
+            return
+        if record.cmd == self.__CMD_REMOVE:
+            ops(record.ids)
+        elif record.cmd == self.__CMD_TRAIN:
+            ops(record.vectors)
+        else:
+            ops(record.vectors, record.ids)
+
+    def migrate_legacy_aof(self, buffer=False):
+        """
+        Convert a single file AOF (or BUFFER) of older versions into a segmented
+        log in its place, the old file is kept as `<name>.legacy`.
+        """
         _aof = self._aof if buffer is False else self._buffer
         aof_path = os.path.join(self._data_dir, self._version, _aof)
-        if os.path.exists(aof_path):
-            with open(aof_path, "r") as f:
-                for line in f:
-                    args = line.strip("\n").split("\t")
-                    cmd, paths = args[1], args[2:]
-                    arrays = [self.loads_data(path) for path in paths]
-                    ops = self.get_ops(cmd)
-                    if ops is not None:
-                        ops(*arrays)
+        tmp_dir, legacy_path = aof_path + ".migrate", aof_path + ".legacy"
+        if not os.path.exists(aof_path) and os.path.isdir(tmp_dir) and os.path.isfile(legacy_path):
+            # Interrupted between the two renames, the converted log is complete.
+            os.rename(tmp_dir, aof_path)
+            return
+        if not os.path.isfile(aof_path):
+            return
+
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        aof_file = AppendOnlyFile(tmp_dir, appendfsync=self._appendfsync, segment_size=self._aof_segment_size,
+                                  auto_rewrite_percentage=0)
+        with open(aof_path, "r") as f:
+            for line in f:
+                args = line.strip("\n").split("\t")
+                cmd, paths = args[1], args[2:]
+                if self.get_ops(cmd) is None:
+                    continue
+                arrays = [self.loads_data(path) for path in paths]
+                aof_file.append(cmd, *self._record_arrays(cmd, arrays))
+        aof_file.close()
+        os.replace(aof_path, legacy_path)
+        os.rename(tmp_dir, aof_path)
+
+    def _record_arrays(self, cmd, arrays):
+        """ `(ids, vectors)` of a record from the arrays its command takes. """
+        if cmd == self.__CMD_REMOVE:
+            return arrays[0], None
+        if cmd == self.__CMD_TRAIN:
+            return np.empty(0, dtype="int64"), arrays[0]
+        vectors, ids = arrays
+        return ids, vectors
 
     def write_aof(self, cmd, *arrays, buffer=False):
-        _paths = []
-        for array in arrays:
-            fn = os.path.join(self._dumps_dir, self.get_random_filename() + ".npy")
-            self.dumps_data(array, fn)
-            _paths.append(fn)
+        self.get_aof_file(buffer=buffer).append(cmd, *self._record_arrays(cmd, arrays))
+
+    def get_aof_file(self, buffer=False):
         _aof = self._aof if buffer is False else self._buffer
-        with open(os.path.join(self._data_dir, self._version, _aof), "a+") as f:
-            f.write(self.get_strtime() + "\t" + cmd + "\t" + "\t".join(_paths) + "\n")
+        aof_dir = os.path.join(self._data_dir, self._version, _aof)
+        if aof_dir not in self._aof_files:
+            self._aof_files[aof_dir] = AppendOnlyFile(
+                aof_dir,
+                appendfsync=self._appendfsync,
+                segment_size=self._aof_segment_size,
+                auto_rewrite_percentage=self._auto_aof_rewrite_percentage if buffer is False else 0,
+                auto_rewrite_min_size=self._auto_aof_rewrite_min_size)
+        return self._aof_files[aof_dir]
+
+    def bgrewriteaof(self):
+        return self.get_aof_file().bgrewrite()
+
+    def close_aof(self):
+        for aof_file in self._aof_files.values():
+            aof_file.close()
+        self._aof_files = {}
+
+    def close(self):
+        self.close_aof()
 
     def get_ops(self, cmd: str):
 
@@ -262,28 +1298,20 @@ class TopKSearch(object):
             self.__CMD_BUILD: self.build,
             self.__CMD_INSERT: self.insert,
             self.__CMD_UPDATE: self.update,
-            self.__CMD_REMOVE: self.remove
+            self.__CMD_REMOVE: self.remove,
+            self.__CMD_TRAIN: self.reset_trained
         }
         return _ops_map.get(cmd)
 
-    def dumps_data(self, data, filename):
-        _dumps_dir = os.path.join(self._data_dir, self._version, self._dumps_dir)
-        if not os.path.exists(_dumps_dir):
-            os.mkdir(_dumps_dir)
-        np.save(os.path.join(self._data_dir, self._version, filename), data)
-
     def loads_data(self, filename):
         return np.load(os.path.join(self._data_dir, self._version, filename))
 
-    @staticmethod
-    def get_random_filename():
-        return str(uuid.uuid4())
-
     @staticmethod
     def get_strtime(tz=None, fmt="%Y-%m-%d %H:%M:%S.%f"):
         return dt.datetime.now(tz=tz).strftime(fmt)
 
     def clear_buffer(self):
         _buffer = os.path.join(self._data_dir, self._version, self._buffer)
-        if os.path.exists(_buffer):
+        if os.path.isfile(_buffer):
             os.remove(_buffer)
+        self.get_aof_file(buffer=True).clear()
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import queue
+import random
+import logging
+from logging import Formatter
+from logging.handlers import QueueHandler, QueueListener
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a `rates[api]` fraction (`default` for other APIs) of the INFO and
+    lower records of responses, warnings and errors are always kept.
+    """
+
+    def __init__(self, rates: dict = None, default: float = 1.0):
+        super(SamplingFilter, self).__init__()
+        self._rates = dict(rates or {})
+        self._default = default
+        self._sampled_out = 0
+
+    @property
+    def sampled_out(self):
+        return self._sampled_out
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._rates.get(getattr(record.msg, "api", None), self._default)
+        if rate >= 1 or random.random() < rate:
+            return True
+        self._sampled_out += 1
+        return False
+
+
+class AntFormatter(Formatter):
+    """
+    Formatter encoding the message only when the record is written, responses
+    (anything with `to_log`) with at most `max_items` entries per list or
+    dict attribute and messages cut at `max_length` chars, 0 for no limit.
+    """
+
+    def __init__(self, fmt: str = None, max_items: int = 0, max_length: int = 0):
+        super(AntFormatter, self).__init__(fmt)
+        self._max_items = max_items
+        self._max_length = max_length
+
+    def message(self, record):
+        if hasattr(record.msg, "to_log"):
+            message = record.msg.to_log(max_items=self._max_items)
+        else:
+            message = record.getMessage()
+        if 0 < self._max_length < len(message):
+            message = "{}...({} chars more)".format(message[:self._max_length], len(message) - self._max_length)
+        return message
+
+    def format(self, record):
+        if not getattr(record, "resolved", False):
+            # Resolved once for all the handlers, which also ship the record's fields as is (e.g. Elasticsearch).
+            record.msg, record.args, record.resolved = self.message(record), None, True
+        return super(AntFormatter, self).format(record)
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Hand records to the `LogWriter` thread through a bounded queue, untouched:
+    formatting happens in the writer. Records arriving while the queue is full
+    are dropped and counted, logging never blocks a request.
+    """
+
+    def __init__(self, queue_size: int = 10000):
+        super(AsyncHandler, self).__init__(queue.Queue(maxsize=queue_size))
+        self._dropped = 0
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+
+
+class LogWriter(QueueListener):
+    """ Background thread writing the records of an `AsyncHandler` to the real handlers. """
+
+    def __init__(self, handler: AsyncHandler, *handlers):
+        super(LogWriter, self).__init__(handler.queue, *handlers, respect_handler_level=True)
+
+    def enqueue_sentinel(self):
+        # Wait for room, the records queued before stopping are still written.
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super(LogWriter, self).stop()
+        for handler in self.handlers:
+            handler.flush()
@@ -6,7 +6,8 @@ from ant.logger.handler import LoggerHandler
 
 class ElasticsearchHandler(LoggerHandler):
 
-    def __init__(self, host, port, user, password, index_name, env: str = "default", level: str = "DEBUG"):
+    def __init__(self, host, port, user, password, index_name, env: str = "default", level: str = "DEBUG",
+                 buffer_size: int = 1000, flush_frequency_in_sec: float = 1):
         super(ElasticsearchHandler, self).__init__()
 
         self._host = host
@@ -16,11 +17,16 @@ class ElasticsearchHandler(LoggerHandler):
         self._index_name = index_name
         self._env = env
         self._level = level
+        self._buffer_size = buffer_size
+        self._flush_frequency_in_sec = flush_frequency_in_sec
 
     def build(self, formatter):
         es_handler = CMRESHandler(hosts=[{"host": self._host, "port": self._port}],
                                   auth_type=CMRESHandler.AuthType.BASIC_AUTH,
                                   auth_details=(self._user, self._password),
+                                  # Records are shipped in one bulk request per `buffer_size` or per interval.
+                                  buffer_size=self._buffer_size,
+                                  flush_frequency_in_sec=self._flush_frequency_in_sec,
                                   es_index_name=self._index_name,
                                   index_name_frequency=CMRESHandler.IndexNameFrequency.MONTHLY,
                                   es_additional_fields={"environment": self._env})
@@ -3,10 +3,11 @@
 import os
 import sys
 import time
+import atexit
 import logging
-from logging import Formatter
 from ant.logger.handlers import FileHandler
 from ant.logger.handlers import ElasticsearchHandler
+from ant.logger.async_logging import SamplingFilter, AntFormatter, AsyncHandler, LogWriter
 
 
 class AntLogger(object):
@@ -19,7 +20,12 @@ class AntLogger(object):
                  log_to_console: bool = True,
                  log_to_file: bool = False,
                  log_to_elasticsearch: bool = False,
-                 tz="Asia/Shanghai"):
+                 tz="Asia/Shanghai",
+                 async_logging: bool = True,
+                 queue_size: int = 10000,
+                 sampling: dict = None,
+                 max_items: int = 0,
+                 max_length: int = 0):
 
         self._name = name
         self._fmt = fmt
@@ -29,6 +35,14 @@ class AntLogger(object):
         self._log_to_file = log_to_file
         self._log_to_elasticsearch = log_to_elasticsearch
         self._tz = tz
+        self._async_logging = async_logging
+        self._queue_size = queue_size
+        self._sampling = dict(sampling or {})
+        self._max_items = max_items
+        self._max_length = max_length
+        self._filter = None
+        self._async_handler = None
+        self._writer = None
 
         os.environ['TZ'] = self._tz
         time.tzset()
@@ -42,13 +56,14 @@ class AntLogger(object):
     def __call__(self, configs: dict, *args, **kwargs):
         logger = logging.getLogger(self._name)
         logger.setLevel(self._level)
-        formatter = Formatter(self._fmt)
+        formatter = AntFormatter(self._fmt, max_items=self._max_items, max_length=self._max_length)
+        handlers = []
 
         if self._log_enable and self._log_to_console:
             stream_handler = logging.StreamHandler(sys.stdout)
             stream_handler.setLevel(level=self._level)
             stream_handler.setFormatter(formatter)
-            logger.addHandler(stream_handler)
+            handlers.append(stream_handler)
 
         if self._log_enable and self._log_to_file:
             conf_obj = configs.get("file")
@@ -59,7 +74,7 @@ class AntLogger(object):
                 raise ValueError("`logger_dir` is missing.")
 
             file_handler = FileHandler(**conf_obj).build(formatter)
-            logger.addHandler(file_handler)
+            handlers.append(file_handler)
 
         if self._log_enable and self._log_to_elasticsearch:
             conf_obj = configs.get("elasticsearch")
@@ -72,6 +87,28 @@ class AntLogger(object):
                     raise ValueError("`{}` is missing.".format(param_key))
 
             es_handler = ElasticsearchHandler(**conf_obj).build(formatter)
-            logger.addHandler(es_handler)
+            handlers.append(es_handler)
+
+        sampling = dict(self._sampling)
+        self._filter = SamplingFilter(sampling, default=sampling.pop("default", 1.0))
+        logger.addFilter(self._filter)
+
+        if self._async_logging and handlers:
+            # Requests only enqueue the record, encoding and I/O happen in the writer thread.
+            self._async_handler = AsyncHandler(self._queue_size)
+            self._writer = LogWriter(self._async_handler, *handlers)
+            self._writer.start()
+            atexit.register(self._writer.stop)
+            logger.addHandler(self._async_handler)
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
 
         return logger
+
+    def get_stats(self):
+        return {
+            "queued": self._async_handler.queue.qsize() if self._async_handler is not None else 0,
+            "dropped": self._async_handler.dropped if self._async_handler is not None else 0,
+            "sampled_out": self._filter.sampled_out if self._filter is not None else 0,
+        }
@@ -3,11 +3,25 @@
 from functools import wraps
 
 import time
+import inspect
+from starlette.responses import JSONResponse
+from ant.core import profiling
 from ant.service import AntResponse, Status
+from ant.service.pipeline import Overloaded
 
 
 def timing():
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start_time = time.time()
+                resp = await func(*args, **kwargs)
+                stop_time = time.time()
+                resp.add_attrs(time=round(stop_time - start_time, 4)*1000)
+                return resp
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             start_time = time.time()
@@ -19,18 +33,66 @@ def timing():
     return decorator
 
 
-def catch_exception(api, logger=None):
+def instance_name(kwargs):
+    """ Instance of a handler call, from its `params` body or `instance_name` query parameter. """
+    params = kwargs.get("params")
+    return kwargs.get("instance_name", getattr(params, "instance_name", None))
+
+
+def catch_exception(api, logger=None, metrics=None):
+    def handle(e):
+        resp = AntResponse(Status.ERROR, api=api, error=repr(e))
+        if logger is not None:
+            logger.error(resp)
+        if isinstance(e, Overloaded):
+            return JSONResponse(dict(resp), status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
+        return resp
+
+    def enter(kwargs):
+        # Routing, reading the body and validating the params happen before the handler runs.
+        profile = profiling.current()
+        if profile is not None:
+            profile.mark("parse")
+            profile.attrs["instance"] = instance_name(kwargs)
+        return time.time()
+
+    def observe(kwargs, start_time, resp=None, error=None):
+        if metrics is not None:
+            metrics.observe(api, instance_name(kwargs), time.time() - start_time,
+                            error=resp is None, vectors=getattr(resp, "count", None))
+        profile = profiling.current()
+        if profile is not None and error is not None:
+            profile.attrs["error"] = repr(error)
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start_time = enter(kwargs)
+                try:
+                    resp = await func(*args, **kwargs)
+                    observe(kwargs, start_time, resp)
+                    if logger is not None:
+                        logger.info(resp)
+                except Exception as e:
+                    observe(kwargs, start_time, error=e)
+                    resp = handle(e)
+                profiling.mark("log")
+                return resp
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
+            start_time = enter(kwargs)
             try:
                 resp = func(*args, **kwargs)
+                observe(kwargs, start_time, resp)
                 if logger is not None:
                     logger.info(resp)
             except Exception as e:
-                resp = AntResponse(Status.ERROR, api=api, error=repr(e))
-                if logger is not None:
-                    logger.error(resp)
+                observe(kwargs, start_time, error=e)
+                resp = handle(e)
+            profiling.mark("log")
             return resp
         return wrapper
     return decorator
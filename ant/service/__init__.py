@@ -4,4 +4,9 @@
 from ant.service.config_flags import ConfigFlags
 from ant.service.response import AntResponse
 from ant.service.response import Status
+from ant.service.response import ResultFormat
+from ant.service.response import AntSearchResponse
+from ant.service.response import AntFetchResponse
 from ant.service.apis import AntAPIs
+from ant.service.payloads import ContentType
+from ant.service.payloads import decode_payload
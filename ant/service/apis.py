@@ -6,9 +6,11 @@ from pydantic import BaseModel
 
 class API(object):
 
-    def __init__(self, path: str, params=None):
+    def __init__(self, path: str, params=None, read_only: bool = False, local: bool = False):
         self._path = path
         self._params = params
+        self._read_only = read_only
+        self._local = local
 
     @property
     def path(self):
@@ -26,6 +28,15 @@ class API(object):
     def params(self, params):
         self._params = params
 
+    @property
+    def read_only(self):
+        return self._read_only
+
+    @property
+    def local(self):
+        """ About the serving process itself, never forwarded to the writer. """
+        return self._local
+
 
 class CreateInstance(BaseModel):
     instance_name: str
@@ -72,16 +83,65 @@ class SearchInstance(BaseModel):
     vectors: list
     top_k: int
     nprobe: int = 10
+    format: str = "dict"
+    explain: bool = False
+
+
+class ExistsInstance(BaseModel):
+    instance_name: str
+    ids: list
+
+
+class FetchInstance(BaseModel):
+    instance_name: str
+    ids: list
+    format: str = "dict"
+
+
+class TrainInstance(BaseModel):
+    instance_name: str
+    vectors: Union[str, list]
+    mode: str
+    name: str = None
+
+
+class CommitUpload(BaseModel):
+    instance_name: str
+    upload_id: str
+    op: str = "BUILD"
 
 
 class AntAPIs(object):
-    LIST = API("/ant/list")
-    INFO = API("/ant/info", GetInstanceInfo)
+    LIST = API("/ant/list", read_only=True)
+    INFO = API("/ant/info", GetInstanceInfo, read_only=True)
     CREATE = API("/ant/create", CreateInstance)
     DELETE = API("/ant/delete", DeleteInstance)
     BUILD = API("/ant/build", BuildInstance)
     INSERT = API("/ant/insert", InsertInstance)
     UPDATE = API("/ant/update", UpdateInstance)
     REMOVE = API("/ant/remove", RemoveInstance)
-    SEARCH = API("/ant/search", SearchInstance)
+    SEARCH = API("/ant/search", SearchInstance, read_only=True)
+    EXISTS = API("/ant/exists", ExistsInstance, read_only=True)
+    FETCH = API("/ant/fetch", FetchInstance, read_only=True)
+    BUILD_BINARY = API("/ant/build/binary")
+    INSERT_BINARY = API("/ant/insert/binary")
+    UPDATE_BINARY = API("/ant/update/binary")
+    REMOVE_BINARY = API("/ant/remove/binary")
+    SEARCH_BINARY = API("/ant/search/binary", read_only=True)
+    FETCH_BINARY = API("/ant/fetch/binary", read_only=True)
+    TRAIN = API("/ant/train", TrainInstance)
+    UPLOAD_BINARY = API("/ant/upload/binary")
+    UPLOAD_COMMIT = API("/ant/upload/commit", CommitUpload)
     BGSAVE = API("/ant/bgsave")
+    BGREWRITEAOF = API("/ant/bgrewriteaof")
+    METRICS = API("/metrics", local=True)
+    SLOWLOG = API("/ant/slowlog", local=True)
+    SLOWLOG_RESET = API("/ant/slowlog/reset", local=True)
+
+    @classmethod
+    def read_only_paths(cls):
+        return [api.path for api in vars(cls).values() if isinstance(api, API) and api.read_only]
+
+    @classmethod
+    def local_paths(cls):
+        return [api.path for api in vars(cls).values() if isinstance(api, API) and api.local]
@@ -1,31 +1,100 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 import os
+import re
+import functools
 import shutil
 import uvicorn
 import requests
 import numpy as np
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, Body, Request
+from starlette.responses import Response
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from ant.core import TopKSearch
 from ant.core import MultiInstances
 from ant.core import OPS
+from ant.core import NpyChunkReader
+from ant.core.threads import budget
 from ant.service import ConfigFlags
 from ant.service import Status
 from ant.service import AntAPIs
 from ant.service import AntResponse
+from ant.service import AntSearchResponse
+from ant.service import AntFetchResponse
+from ant.service import ResultFormat
+from ant.service import ContentType
+from ant.service import decode_payload
+from ant.service.replication import Replication, Role, ForwardToWriter
+from ant.service.pipeline import Pipeline, Lane
+from ant.service.metrics import Metrics, RequestMetrics, instance_families
+from ant.service.slowlog import SlowLog, ProfileRequests
+from ant.core import profiling
 from ant.logger import AntLogger
+from ant.logger import wrappers
 from ant.logger.wrappers import timing
-from ant.logger.wrappers import catch_exception
 
 
 config_flags = ConfigFlags()
 app = FastAPI()
 scheduler = BackgroundScheduler(timezone=config_flags.logger.meta.tz)
-mis = MultiInstances(config_flags.service.multi_instances.data_dir)
-
-logger = AntLogger(**config_flags.logger.meta.dict)(config_flags.logger.handlers.dict)
+replication = Replication(config_flags.service.multi_instances.data_dir)
+# Running `__main__` only starts uvicorn, which imports this module again in the processes that serve it.
+serving = __name__ != "__main__"
+# With several workers one of them is elected the writer.
+if config_flags.service.uvicorn.workers > 1 and serving:
+    replication.elect()
+# Every worker process runs its own Faiss calls, the cores are split between them.
+budget.resize(max(1, (config_flags.service.threads.omp_budget or os.cpu_count() or 1)
+                  // config_flags.service.uvicorn.workers))
+# The process running `__main__` loads no instances.
+mis = None
+if serving:
+    mis = MultiInstances(config_flags.service.multi_instances.data_dir,
+                         load_mode=config_flags.service.multi_instances.load_mode,
+                         load_workers=config_flags.service.multi_instances.load_workers,
+                         load_timeout=config_flags.service.multi_instances.load_timeout,
+                         replica=replication.role == Role.READER)
+if replication.role == Role.READER:
+    mis.start_replica_sync(config_flags.service.replication.sync_interval_ms / 1000.)
+# Faiss work of every instance runs on its own bounded executors, one for reads and one for writes.
+pipeline = Pipeline(**config_flags.service.pipeline.dict)
+pipelined = functools.partial(pipeline.pipelined, exists=lambda instance_name: instance_name in mis.list_instances())
+# Every handler's count, errors and latency are recorded by `catch_exception`, scraped at `/metrics`.
+metrics = Metrics()
+catch_exception = functools.partial(wrappers.catch_exception, metrics=RequestMetrics(
+    metrics, exists=lambda instance_name: instance_name in mis.list_instances()))
+# Requests slower than the threshold are kept with their stage timings, see `/ant/slowlog`.
+slowlog = SlowLog(**config_flags.service.slowlog.dict)
+app.add_middleware(ProfileRequests, slowlog=slowlog)
+app.add_middleware(ForwardToWriter, replication=replication, read_paths=AntAPIs.read_only_paths(),
+                   is_local=lambda instance_name: instance_name in mis.list_instances(),
+                   local_paths=AntAPIs.local_paths())
+
+uploads_dir = os.path.join(config_flags.service.multi_instances.data_dir, "uploads")
+trained_dir = os.path.join(config_flags.service.multi_instances.data_dir, "trained")
+
+ant_logger = AntLogger(**config_flags.logger.meta.dict)
+logger = ant_logger(config_flags.logger.handlers.dict)
+
+
+@app.on_event("startup")
+def serve_replicas():
+    if replication.role == Role.WRITER:
+        replication.serve(app)
+
+
+@app.on_event("startup")
+def start_scheduler():
+    # Backups run in the writer (or the only worker), the process whose instances see every write.
+    if replication.role != Role.READER:
+        scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
 
 
 @app.get(AntAPIs.LIST.path)
@@ -33,7 +102,8 @@ logger = AntLogger(**config_flags.logger.meta.dict)(config_flags.logger.handlers
 @timing()
 def list_instances():
     resp = mis.list_instances()
-    return AntResponse(Status.SUCCESS, api=AntAPIs.LIST.path, ops=OPS.LIST, result=resp)
+    states = mis.list_instances_state()
+    return AntResponse(Status.SUCCESS, api=AntAPIs.LIST.path, ops=OPS.LIST, result=resp, states=states)
 
 
 @app.post(AntAPIs.CREATE.path)
@@ -54,12 +124,15 @@ def delete(params: AntAPIs.DELETE.params):
     if instance_name not in mis.list_instances():
         raise ValueError("Instance `{}` is not exist.".format(instance_name))
     mis.delete_instance(instance_name)
+    pipeline.discard(instance_name)
+    shutil.rmtree(os.path.join(uploads_dir, instance_name), ignore_errors=True)
     return AntResponse(Status.SUCCESS, api=AntAPIs.DELETE.path, ops=OPS.DELETE, instance=instance_name)
 
 
 @app.post(AntAPIs.BUILD.path)
 @catch_exception(AntAPIs.BUILD.path, logger=logger)
 @timing()
+@pipelined(Lane.WRITE)
 def build(params: AntAPIs.BUILD.params):
     instance_name = params.instance_name
     vectors = params.vectors
@@ -81,22 +154,32 @@ def build(params: AntAPIs.BUILD.params):
         msg = "When `mode` = `npy`, the `vectors` and `ids` must be string."
         raise ValueError(msg)
 
-    if mode == "npy":
-        vectors = np.load(vectors)
-        ids = np.load(ids)
     instance = mis.get_instance(instance_name)
 
+    if mode == "npy":
+        # Files (or directories of `.npy` shards) are memory mapped and streamed in batches.
+        reader = NpyChunkReader(vectors, ids)
+        if instance.dim != reader.dim:
+            raise ValueError("Faiss instance's dim = {}, vectors's dim = {}, not match!".format(
+                instance.dim, reader.dim))
+        instance.bulk_build(reader)
+        return AntResponse(Status.SUCCESS, api=AntAPIs.BUILD.path, ops=OPS.BUILD, instance=instance_name,
+                           count=len(reader))
+
+    vectors = np.asarray(vectors, dtype="float32")
     if instance.dim != vectors.shape[-1]:
         raise ValueError("Faiss instance's dim = {}, vectors's dim = {}, not match!".format(
             instance.dim, vectors.shape[-1]))
 
     instance.build(vectors, ids)
-    return AntResponse(Status.SUCCESS, api=AntAPIs.BUILD.path, ops=OPS.BUILD, instance=instance_name)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.BUILD.path, ops=OPS.BUILD, instance=instance_name,
+                       count=len(ids))
 
 
 @app.post(AntAPIs.INSERT.path)
 @catch_exception(AntAPIs.INSERT.path, logger=logger)
 @timing()
+@pipelined(Lane.WRITE)
 def insert(params: AntAPIs.INSERT.params):
     instance_name = params.instance_name
     vectors = params.vectors
@@ -118,22 +201,31 @@ def insert(params: AntAPIs.INSERT.params):
         msg = "When `mode` = `npy`, the `vectors` and `ids` must be string."
         raise ValueError(msg)
 
-    if mode == "npy":
-        vectors = np.load(vectors)
-        ids = np.load(ids)
     instance = mis.get_instance(instance_name)
 
+    if mode == "npy":
+        reader = NpyChunkReader(vectors, ids)
+        if instance.dim != reader.dim:
+            raise ValueError("Faiss instance's dim = {}, vectors's dim = {}, not match!".format(
+                instance.dim, reader.dim))
+        instance.bulk_insert(reader)
+        return AntResponse(Status.SUCCESS, api=AntAPIs.INSERT.path, ops=OPS.INSERT, instance=instance_name,
+                           count=len(reader))
+
+    vectors = np.asarray(vectors, dtype="float32")
     if instance.dim != vectors.shape[-1]:
         raise ValueError("Faiss instance's dim = {}, vectors's dim = {}, not match!".format(
             instance.dim, vectors.shape[-1]))
 
     instance.insert(vectors, ids)
-    return AntResponse(Status.SUCCESS, api=AntAPIs.INSERT.path, ops=OPS.INSERT, instance=instance_name)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.INSERT.path, ops=OPS.INSERT, instance=instance_name,
+                       count=len(ids))
 
 
 @app.post(AntAPIs.UPDATE.path)
 @catch_exception(AntAPIs.UPDATE.path, logger=logger)
 @timing()
+@pipelined(Lane.WRITE)
 def update(params: AntAPIs.UPDATE.params):
     instance_name = params.instance_name
     vectors = params.vectors
@@ -165,12 +257,14 @@ def update(params: AntAPIs.UPDATE.params):
             instance.dim, vectors.shape[-1]))
 
     instance.update(vectors, ids)
-    return AntResponse(Status.SUCCESS, api=AntAPIs.UPDATE.path, ops=OPS.UPDATE, instance=instance_name)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.UPDATE.path, ops=OPS.UPDATE, instance=instance_name,
+                       count=len(ids))
 
 
 @app.post(AntAPIs.REMOVE.path)
 @catch_exception(AntAPIs.REMOVE.path, logger=logger)
 @timing()
+@pipelined(Lane.WRITE)
 def remove(params: AntAPIs.REMOVE.params):
     instance_name = params.instance_name
     ids = params.ids
@@ -195,18 +289,18 @@ def remove(params: AntAPIs.REMOVE.params):
         ids = np.load(ids)
     instance = mis.get_instance(instance_name)
 
-    if isinstance(ids, np.ndarray):
-        ids = ids.tolist()
-
-    remove_ids = list(set(ids) & set(instance.ids))
+    ids = np.asarray(ids, dtype="int64")
+    remove_ids = np.unique(ids[instance.contains(ids)])
 
     instance.remove(remove_ids)
-    return AntResponse(Status.SUCCESS, api=AntAPIs.REMOVE.path, ops=OPS.REMOVE, instance=instance_name)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.REMOVE.path, ops=OPS.REMOVE, instance=instance_name,
+                       count=len(remove_ids))
 
 
 @app.post(AntAPIs.SEARCH.path)
 @catch_exception(AntAPIs.SEARCH.path, logger=logger)
 @timing()
+@pipelined(Lane.READ)
 def search(params: AntAPIs.SEARCH.params):
     instance_name = params.instance_name
     vectors = params.vectors
@@ -218,14 +312,276 @@ def search(params: AntAPIs.SEARCH.params):
 
     instance = mis.get_instance(instance_name)
 
-    if instance.dim != np.asarray(vectors).shape[-1]:
+    vectors = np.asarray(vectors, dtype="float32")
+    if instance.dim != vectors.shape[-1]:
         raise ValueError("Faiss instance's dim = {}, vectors's dim = {}, not match!".format(
-            instance.dim, np.asarray(vectors).shape[-1]))
+            instance.dim, vectors.shape[-1]))
+    profiling.mark("decode")
+
+    return search_with_profile(AntAPIs.SEARCH.path, instance_name, instance, vectors, top_k, nprobe,
+                               params.format, params.explain)
+
+
+@app.post(AntAPIs.EXISTS.path)
+@catch_exception(AntAPIs.EXISTS.path, logger=logger)
+@timing()
+@pipelined(Lane.READ)
+def exists(params: AntAPIs.EXISTS.params):
+    instance_name = params.instance_name
+
+    if instance_name not in mis.list_instances():
+        raise ValueError("Instance `{}` is not exist.".format(instance_name))
+
+    instance = mis.get_instance(instance_name)
+    result = instance.contains(np.asarray(params.ids, dtype="int64")).tolist()
+    return AntResponse(Status.SUCCESS, api=AntAPIs.EXISTS.path, ops=OPS.EXISTS, instance=instance_name, result=result,
+                       count=len(result))
+
+
+@app.post(AntAPIs.FETCH.path)
+@catch_exception(AntAPIs.FETCH.path, logger=logger)
+@timing()
+@pipelined(Lane.READ)
+def fetch(params: AntAPIs.FETCH.params):
+    instance_name = params.instance_name
+
+    if instance_name not in mis.list_instances():
+        raise ValueError("Instance `{}` is not exist.".format(instance_name))
+
+    instance = mis.get_instance(instance_name)
+    vectors, ids = instance.reconstruct_batch(params.ids)
+    return fetch_response(AntAPIs.FETCH.path, instance_name, vectors, ids, params.format)
 
-    distances, ids = instance.search(vectors, top_k=top_k, nprobe=nprobe)
+
+def fetch_response(api, instance_name, vectors, ids, result_format):
+    if result_format not in ResultFormat.ALL:
+        raise ValueError("`{}` not supported, `format` param should be in {}".format(result_format, ResultFormat.ALL))
+
+    if result_format != ResultFormat.DICT:
+        return AntFetchResponse(vectors, ids, result_format=result_format,
+                                api=api, ops=OPS.FETCH, instance=instance_name)
+
+    result = dict(zip(ids.tolist(), vectors.tolist()))
+    resp = AntResponse(Status.SUCCESS, api=api, ops=OPS.FETCH, instance=instance_name, result=result, count=len(ids))
+    resp.exclude_from_log("result")
+    return resp
+
+
+def search_with_profile(api, instance_name, instance, vectors, top_k, nprobe, result_format, explain):
+    """ Search and build the response, with the stage timings and Faiss counters of the call if `explain`. """
+    if not explain:
+        distances, ids = instance.search(vectors, top_k=top_k, nprobe=nprobe)
+        resp = search_response(api, instance_name, distances, ids, result_format)
+        profiling.mark("result")
+        return resp
+
+    distances, ids, faiss_stats = instance.explain(vectors, top_k=top_k, nprobe=nprobe)
+    resp = search_response(api, instance_name, distances, ids, result_format)
+    profiling.mark("result")
+    profile = profiling.current()
+    resp.add_attrs(explain={"stages": profile.get_stages() if profile is not None else None, "faiss": faiss_stats})
+    return resp
+
+
+def search_response(api, instance_name, distances, ids, result_format):
+    if result_format not in ResultFormat.ALL:
+        raise ValueError("`{}` not supported, `format` param should be in {}".format(result_format, ResultFormat.ALL))
+
+    if result_format != ResultFormat.DICT:
+        return AntSearchResponse(distances, ids, result_format=result_format,
+                                 api=api, ops=OPS.SEARCH, instance=instance_name)
 
     result = [dict(zip(_ids, _distances)) for _ids, _distances in zip(ids.tolist(), distances.tolist())]
-    return AntResponse(Status.SUCCESS, api=AntAPIs.SEARCH.path, ops=OPS.SEARCH, instance=instance_name, result=result)
+    resp = AntResponse(Status.SUCCESS, api=api, ops=OPS.SEARCH, instance=instance_name, result=result, count=len(ids))
+    resp.exclude_from_log("result")
+    return resp
+
+
+def decode_binary_request(instance_name, request, body, with_vectors=True, with_ids=True,
+                          count=None, dim=None, dtype="float32"):
+    if instance_name not in mis.list_instances():
+        raise ValueError("Instance `{}` is not exist.".format(instance_name))
+
+    instance = mis.get_instance(instance_name)
+    vectors, ids = decode_payload(body, request.headers.get("content-type"),
+                                  with_vectors=with_vectors, with_ids=with_ids,
+                                  count=count, dim=dim or instance.dim, dtype=dtype)
+
+    if vectors is not None and instance.dim != vectors.shape[-1]:
+        raise ValueError("Faiss instance's dim = {}, vectors's dim = {}, not match!".format(
+            instance.dim, vectors.shape[-1]))
+    return instance, vectors, ids
+
+
+@app.post(AntAPIs.BUILD_BINARY.path)
+@catch_exception(AntAPIs.BUILD_BINARY.path, logger=logger)
+@timing()
+@pipelined(Lane.WRITE)
+def build_binary(request: Request, instance_name: str, count: int = None, dim: int = None, dtype: str = "float32",
+                 body: bytes = Body(..., media_type=ContentType.RAW)):
+    instance, vectors, ids = decode_binary_request(instance_name, request, body, count=count, dim=dim, dtype=dtype)
+    instance.build(vectors, ids)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.BUILD_BINARY.path, ops=OPS.BUILD, instance=instance_name,
+                       count=len(ids))
+
+
+@app.post(AntAPIs.INSERT_BINARY.path)
+@catch_exception(AntAPIs.INSERT_BINARY.path, logger=logger)
+@timing()
+@pipelined(Lane.WRITE)
+def insert_binary(request: Request, instance_name: str, count: int = None, dim: int = None, dtype: str = "float32",
+                  body: bytes = Body(..., media_type=ContentType.RAW)):
+    instance, vectors, ids = decode_binary_request(instance_name, request, body, count=count, dim=dim, dtype=dtype)
+    instance.insert(vectors, ids)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.INSERT_BINARY.path, ops=OPS.INSERT, instance=instance_name,
+                       count=len(ids))
+
+
+@app.post(AntAPIs.UPDATE_BINARY.path)
+@catch_exception(AntAPIs.UPDATE_BINARY.path, logger=logger)
+@timing()
+@pipelined(Lane.WRITE)
+def update_binary(request: Request, instance_name: str, count: int = None, dim: int = None, dtype: str = "float32",
+                  body: bytes = Body(..., media_type=ContentType.RAW)):
+    instance, vectors, ids = decode_binary_request(instance_name, request, body, count=count, dim=dim, dtype=dtype)
+    instance.update(vectors, ids)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.UPDATE_BINARY.path, ops=OPS.UPDATE, instance=instance_name,
+                       count=len(ids))
+
+
+@app.post(AntAPIs.REMOVE_BINARY.path)
+@catch_exception(AntAPIs.REMOVE_BINARY.path, logger=logger)
+@timing()
+@pipelined(Lane.WRITE)
+def remove_binary(request: Request, instance_name: str, count: int = None,
+                  body: bytes = Body(..., media_type=ContentType.RAW)):
+    instance, _, ids = decode_binary_request(instance_name, request, body, with_vectors=False, count=count)
+    remove_ids = np.unique(ids[instance.contains(ids)])
+    instance.remove(remove_ids)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.REMOVE_BINARY.path, ops=OPS.REMOVE, instance=instance_name,
+                       count=len(remove_ids))
+
+
+@app.post(AntAPIs.SEARCH_BINARY.path)
+@catch_exception(AntAPIs.SEARCH_BINARY.path, logger=logger)
+@timing()
+@pipelined(Lane.READ)
+def search_binary(request: Request, instance_name: str, top_k: int, nprobe: int = 10, count: int = None,
+                  dim: int = None, dtype: str = "float32", format: str = ResultFormat.DICT, explain: bool = False,
+                  body: bytes = Body(..., media_type=ContentType.RAW)):
+    instance, vectors, _ = decode_binary_request(instance_name, request, body, with_ids=False,
+                                                 count=count, dim=dim, dtype=dtype)
+    profiling.mark("decode")
+    return search_with_profile(AntAPIs.SEARCH_BINARY.path, instance_name, instance, vectors, top_k, nprobe,
+                               format, explain)
+
+
+@app.post(AntAPIs.FETCH_BINARY.path)
+@catch_exception(AntAPIs.FETCH_BINARY.path, logger=logger)
+@timing()
+@pipelined(Lane.READ)
+def fetch_binary(request: Request, instance_name: str, count: int = None, format: str = ResultFormat.DICT,
+                 body: bytes = Body(..., media_type=ContentType.RAW)):
+    instance, _, ids = decode_binary_request(instance_name, request, body, with_vectors=False, count=count)
+    vectors, ids = instance.reconstruct_batch(ids)
+    return fetch_response(AntAPIs.FETCH_BINARY.path, instance_name, vectors, ids, format)
+
+
+@app.post(AntAPIs.TRAIN.path)
+@catch_exception(AntAPIs.TRAIN.path, logger=logger)
+@timing()
+@pipelined(Lane.WRITE)
+def train(params: AntAPIs.TRAIN.params):
+    instance_name = params.instance_name
+    vectors = params.vectors
+    mode = params.mode
+
+    if instance_name not in mis.list_instances():
+        raise ValueError("Instance `{}` is not exist.".format(instance_name))
+
+    if mode not in ("list", "npy"):
+        msg = "`{}` not supported, `mode` param should be in ('list', 'npy')".format(mode)
+        raise ValueError(msg)
+
+    if (mode == "list") != isinstance(vectors, list):
+        msg = "When `mode` = `list`, the `vectors` must be list, when `mode` = `npy`, string."
+        raise ValueError(msg)
+
+    filename = None
+    if params.name is not None:
+        # Named trained indexes are shared, other instances reference them with `trained_index`.
+        if re.fullmatch(r"[A-Za-z0-9_\-]+", params.name) is None:
+            raise ValueError("`name` should only contain letters, digits, `_` and `-`.")
+        os.makedirs(trained_dir, exist_ok=True)
+        filename = os.path.join(trained_dir, params.name + ".index")
+
+    instance = mis.get_instance(instance_name)
+    if mode == "npy":
+        source = NpyChunkReader(vectors)
+        dim = source.dim
+    else:
+        source = np.asarray(vectors, dtype="float32")
+        dim = source.shape[-1]
+    if instance.dim != dim:
+        raise ValueError("Faiss instance's dim = {}, vectors's dim = {}, not match!".format(instance.dim, dim))
+
+    trained_index = instance.train(source, filename=filename)
+    mis.update_instance_configs(instance_name, trained_index=trained_index)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.TRAIN.path, ops=OPS.TRAIN, instance=instance_name,
+                       result={"trained_index": trained_index})
+
+
+def get_upload_dir(instance_name, upload_id):
+    if instance_name not in mis.list_instances():
+        raise ValueError("Instance `{}` is not exist.".format(instance_name))
+    if re.fullmatch(r"[A-Za-z0-9_\-]+", upload_id) is None:
+        raise ValueError("`upload_id` should only contain letters, digits, `_` and `-`.")
+    return os.path.join(uploads_dir, instance_name, upload_id)
+
+
+@app.post(AntAPIs.UPLOAD_BINARY.path)
+@catch_exception(AntAPIs.UPLOAD_BINARY.path, logger=logger)
+@timing()
+def upload_binary(request: Request, instance_name: str, upload_id: str, part: int = None, count: int = None,
+                  dim: int = None, dtype: str = "float32", body: bytes = Body(..., media_type=ContentType.RAW)):
+    upload_dir = get_upload_dir(instance_name, upload_id)
+    _, vectors, ids = decode_binary_request(instance_name, request, body, count=count, dim=dim, dtype=dtype)
+
+    for sub_dir in ("vectors", "ids"):
+        os.makedirs(os.path.join(upload_dir, sub_dir), exist_ok=True)
+    if part is None:
+        part = len(os.listdir(os.path.join(upload_dir, "ids")))
+    filename = "{:08d}.npy".format(part)
+    np.save(os.path.join(upload_dir, "vectors", filename), vectors)
+    np.save(os.path.join(upload_dir, "ids", filename), ids)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.UPLOAD_BINARY.path, ops=OPS.UPLOAD, instance=instance_name,
+                       result={"upload_id": upload_id, "part": part, "count": len(ids)})
+
+
+@app.post(AntAPIs.UPLOAD_COMMIT.path)
+@catch_exception(AntAPIs.UPLOAD_COMMIT.path, logger=logger)
+@timing()
+@pipelined(Lane.WRITE)
+def upload_commit(params: AntAPIs.UPLOAD_COMMIT.params):
+    instance_name = params.instance_name
+    upload_dir = get_upload_dir(instance_name, params.upload_id)
+
+    if params.op not in (OPS.BUILD, OPS.INSERT):
+        raise ValueError("`{}` not supported, `op` param should be in ('BUILD', 'INSERT')".format(params.op))
+    if not os.path.exists(upload_dir):
+        raise ValueError("Upload `{}` is not exist.".format(params.upload_id))
+
+    instance = mis.get_instance(instance_name)
+    reader = NpyChunkReader(os.path.join(upload_dir, "vectors"), os.path.join(upload_dir, "ids"))
+    if params.op == OPS.BUILD:
+        instance.bulk_build(reader)
+    else:
+        instance.bulk_insert(reader)
+    num_vectors = len(reader)
+    del reader
+    shutil.rmtree(upload_dir)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.UPLOAD_COMMIT.path, ops=params.op, instance=instance_name,
+                       result={"upload_id": params.upload_id, "count": num_vectors}, count=num_vectors)
 
 
 @app.post(AntAPIs.INFO.path)
@@ -235,26 +591,70 @@ def get_instance_info(params: AntAPIs.INFO.params):
     instance_name = params.instance_name
     if instance_name not in mis.list_instances():
         raise ValueError("Instance `{}` is not exist.".format(instance_name))
-    instance = mis.get_instance(instance_name)
-    info = instance.get_info()
+    info = mis.get_instance_info(instance_name)
+    info["pipeline"] = pipeline.get_stats(instance_name)
+    if replication.role != Role.STANDALONE:
+        info["replication"] = dict(info.get("replication") or {}, role=replication.role)
     return AntResponse(Status.SUCCESS, api=AntAPIs.INFO.path, ops=OPS.INFO, instance=instance_name, result=info)
 
 
+@app.get(AntAPIs.SLOWLOG.path)
+@catch_exception(AntAPIs.SLOWLOG.path, logger=logger)
+@timing()
+def get_slowlog(count: int = 10):
+    return AntResponse(Status.SUCCESS, api=AntAPIs.SLOWLOG.path, result=slowlog.get(count), len=len(slowlog))
+
+
+@app.post(AntAPIs.SLOWLOG_RESET.path)
+@catch_exception(AntAPIs.SLOWLOG_RESET.path, logger=logger)
+@timing()
+def reset_slowlog():
+    slowlog.reset()
+    return AntResponse(Status.SUCCESS, api=AntAPIs.SLOWLOG_RESET.path)
+
+
+@metrics.collector
+def collect_instances():
+    infos = {}
+    for instance_name in mis.list_instances():
+        try:
+            info = mis.get_instance_info(instance_name)
+        except ValueError:
+            # Not built yet.
+            continue
+        if "num_total" in info:
+            infos[instance_name] = info
+    return instance_families(infos)
+
+
+@metrics.collector
+def collect_logging():
+    stats = ant_logger.get_stats()
+    return [
+        ("ant_log_queued", "gauge", "Log records waiting for the writer thread.", [({}, stats["queued"])]),
+        ("ant_log_dropped_total", "counter", "Log records dropped on a full queue.", [({}, stats["dropped"])]),
+        ("ant_log_sampled_out_total", "counter", "Responses left out of the log by sampling.",
+         [({}, stats["sampled_out"])]),
+    ]
+
+
+@app.get(AntAPIs.METRICS.path)
+def get_metrics():
+    return Response(metrics.render(), media_type=Metrics.CONTENT_TYPE)
+
+
 @catch_exception("backup", logger=logger)
 def instance_backup(instance_name):
     instance = mis.get_instance(instance_name)
-    instance.memory_lock = True
-    instance.aof_lock = True
-    instance.version = TopKSearch.get_strtime(fmt="%Y%m%d%H%M%S%f")
-    instance.save()
-    instance.memory_lock = False
-    instance.aof_lock = False
-    instance.restore_from_aof(buffer=True)
-    instance.clear_buffer()
-    mis.update_instance_version(instance_name, instance.version)
-    mis.save_instance_conf(instance_name)
+    version = TopKSearch.get_strtime(fmt="%Y%m%d%H%M%S%f")
+
+    def on_switch():
+        mis.update_instance_version(instance_name, version)
+        mis.save_instance_conf(instance_name)
+
+    save_info = instance.bgsave(version, on_switch=on_switch)
     msg = "`{}` backup completed.".format(instance_name)
-    return AntResponse(Status.SUCCESS, api=AntAPIs.BGSAVE.path, instance=instance_name, msg=msg)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.BGSAVE.path, instance=instance_name, msg=msg, result=save_info)
 
 
 @app.post(AntAPIs.BGSAVE.path + "/{instance_name}")
@@ -267,6 +667,18 @@ def bgsave(instance_name: str, background_tasks: BackgroundTasks):
     return AntResponse(Status.SUCCESS, api=AntAPIs.BGSAVE.path, instance=instance_name, msg=msg)
 
 
+@app.post(AntAPIs.BGREWRITEAOF.path + "/{instance_name}")
+@catch_exception(AntAPIs.BGREWRITEAOF.path, logger=logger)
+def bgrewriteaof(instance_name: str):
+    if instance_name not in mis.list_instances():
+        raise ValueError("Instance `{}` is not exist.".format(instance_name))
+    instance = mis.get_instance(instance_name)
+    if instance.bgrewriteaof() is False:
+        raise ValueError("Instance `{}` AOF rewrite already in progress.".format(instance_name))
+    msg = "Instance `{}` background AOF rewrite.".format(instance_name)
+    return AntResponse(Status.SUCCESS, api=AntAPIs.BGREWRITEAOF.path, instance=instance_name, msg=msg)
+
+
 @scheduler.scheduled_job("interval", hours=config_flags.service.scheduler.backup.hours)
 def scheduler_backup():
     for instance in mis.list_instances():
@@ -282,13 +694,15 @@ def scheduler_clear_backup(max_keep_backups=config_flags.service.scheduler.clear
         objs = os.listdir(backup_dir)
         versions = []
         for obj in objs:
-            if os.path.isfile(obj):
+            # Only version directories count, files such as the default `TRAINED` index stay.
+            if not os.path.isdir(os.path.join(backup_dir, obj)):
                 continue
             versions.append(obj)
 
         remove_versions = sorted(versions, reverse=True)[max_keep_backups:]
 
         for version in remove_versions:
+            # Chunks of incremental snapshots are hard links, those later versions share stay on disk.
             version_dir = os.path.join(backup_dir, version)
             shutil.rmtree(version_dir)
 
@@ -296,7 +710,6 @@ def scheduler_clear_backup(max_keep_backups=config_flags.service.scheduler.clear
 
 
 if __name__ == "__main__":
-    scheduler.start()
     uvicorn.run(app="main:app",
                 host=config_flags.service.uvicorn.host,
                 port=config_flags.service.uvicorn.port,
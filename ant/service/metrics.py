@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+
+
+class _Metric(object):
+    """
+    Labeled metric with one cell of values per writing thread.
+
+    A thread only ever updates its own cell, so the hot path takes no lock,
+    scrapes sum the cells of every thread (including exited ones).
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._cells = {}
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def documentation(self):
+        return self._documentation
+
+    def _new_values(self):
+        raise NotImplementedError
+
+    def _values(self, labelvalues):
+        if len(labelvalues) != len(self._labelnames):
+            raise ValueError("`{}` takes labels {}, got {}.".format(self._name, self._labelnames, labelvalues))
+        ident = threading.get_ident()
+        cell = self._cells.get(ident)
+        if cell is None:
+            cell = self._cells.setdefault(ident, {})
+        values = cell.get(labelvalues)
+        if values is None:
+            values = cell[labelvalues] = self._new_values()
+        return values
+
+    def merged(self):
+        """ `{labelvalues: values}` summed over the threads. """
+        merged = {}
+        # `list` copies in one step under the GIL, other threads may be adding cells meanwhile.
+        for cell in list(self._cells.values()):
+            for labelvalues, values in list(cell.items()):
+                total = merged.setdefault(labelvalues, self._new_values())
+                for i, value in enumerate(list(values)):
+                    total[i] += value
+        return merged
+
+    def samples(self):
+        raise NotImplementedError
+
+    def labels(self, labelvalues, **extra):
+        return dict(zip(self._labelnames, labelvalues), **extra)
+
+
+class Counter(_Metric):
+
+    type = "counter"
+
+    def _new_values(self):
+        return [0.]
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self._values(labelvalues)[0] += amount
+
+    def samples(self):
+        for labelvalues, values in sorted(self.merged().items()):
+            yield self._name, self.labels(labelvalues), values[0]
+
+
+class Histogram(_Metric):
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=()):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self._buckets = sorted(buckets)
+
+    def _new_values(self):
+        # Count per bucket, the `+Inf` one last, then the sum.
+        return [0.] * (len(self._buckets) + 2)
+
+    def observe(self, value: float, *labelvalues):
+        values = self._values(labelvalues)
+        values[bisect.bisect_left(self._buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self):
+        for labelvalues, values in sorted(self.merged().items()):
+            cumulative = 0.
+            for bound, count in zip(self._buckets + ["+Inf"], values[:-1]):
+                cumulative += count
+                yield self._name + "_bucket", self.labels(labelvalues, le=str(bound)), cumulative
+            yield self._name + "_count", self.labels(labelvalues), cumulative
+            yield self._name + "_sum", self.labels(labelvalues), values[-1]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value))
+
+
+class Metrics(object):
+    """
+    Registry of the metrics rendered in the Prometheus text format.
+
+    Besides the registered counters and histograms, `collectors` are called at
+    every scrape and return `(name, type, documentation, samples)` families,
+    with `samples` a list of `(labels, value)`, for values read from state
+    (e.g. index sizes) instead of counted.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=()):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    @staticmethod
+    def _render_family(lines, name, metric_type, documentation, samples):
+        lines.append("# HELP {} {}".format(name, documentation))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        for sample_name, labels, value in samples:
+            if labels:
+                sample_name += "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels.items()) + "}"
+            lines.append("{} {}".format(sample_name, _format_value(value)))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            self._render_family(lines, metric.name, metric.type, metric.documentation, metric.samples())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                self._render_family(lines, name, metric_type, documentation,
+                                    ((name, labels, value) for labels, value in samples))
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetrics(object):
+    """
+    Count, errors, latency and vectors of the requests of every API and instance.
+
+    Names `exists` says are no instance are recorded under an empty `instance`
+    label, so that requests for made up names don't each add a series.
+    """
+
+    LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+    VECTORS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 100000, 1000000)
+
+    def __init__(self, metrics: Metrics, exists=None):
+        self._exists = exists
+        labelnames = ("api", "instance")
+        self._requests = metrics.counter("ant_requests_total", "Requests handled.", labelnames)
+        self._errors = metrics.counter("ant_request_errors_total", "Requests answered with an error.", labelnames)
+        self._latency = metrics.histogram("ant_request_duration_seconds", "Request handling time.", labelnames,
+                                          buckets=self.LATENCY_BUCKETS)
+        self._vectors = metrics.histogram("ant_request_vectors", "Vectors or ids per request.", labelnames,
+                                          buckets=self.VECTORS_BUCKETS)
+
+    def observe(self, api, instance, duration, error=False, vectors=None):
+        if instance is not None and self._exists is not None and not self._exists(instance):
+            instance = None
+        labelvalues = (api, instance or "")
+        self._requests.inc(*labelvalues)
+        if error:
+            self._errors.inc(*labelvalues)
+        self._latency.observe(duration, *labelvalues)
+        if vectors is not None:
+            self._vectors.observe(vectors, *labelvalues)
+
+
+def instance_families(infos: dict):
+    """ Gauge and counter families of the instances' `get_info`s, by instance name. """
+    def family(name, metric_type, documentation, value):
+        samples = []
+        for instance_name, info in sorted(infos.items()):
+            _value = value(info)
+            if _value is not None:
+                samples.append(({"instance": instance_name}, _value))
+        return name, metric_type, documentation, samples
+
+    def last_save(key):
+        return lambda info: (info.get("last_save") or {}).get(key)
+
+    return [
+        family("ant_index_vectors", "gauge", "Vectors in the index.", lambda info: info["num_total"]),
+        family("ant_aof_bytes", "gauge", "Size of the AOF segments.", lambda info: info["aof"]["size"]),
+        family("ant_buffer_bytes", "gauge", "Size of the write buffer AOF.", lambda info: info["buffer"]["size"]),
+        family("ant_aof_appends_total", "counter", "Records appended to the AOF.",
+               lambda info: info["aof"]["appends"]),
+        family("ant_aof_append_seconds_total", "counter", "Time spent appending to the AOF.",
+               lambda info: info["aof"]["append_time"]),
+        family("ant_rebuild_seconds", "gauge", "Snapshot load and AOF replay time of the last rebuild.",
+               lambda info: info.get("rebuild_time")),
+        family("ant_last_save_timestamp_seconds", "gauge", "End of the last snapshot.",
+               lambda info: last_save("started_at")(info) + last_save("duration")(info)
+               if info.get("last_save") else None),
+        family("ant_last_save_duration_seconds", "gauge", "Duration of the last snapshot.", last_save("duration")),
+        family("ant_last_save_bytes", "gauge", "Size of the last snapshot.", last_save("bytes")),
+    ]
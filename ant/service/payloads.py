@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import ast
+import struct
+
+import numpy as np
+
+
+class ContentType:
+    RAW = "application/octet-stream"
+    NPY = "application/x-npy"
+
+
+_NPY_MAGIC = b"\x93NUMPY"
+
+
+def decode_npy(buffer, offset: int = 0):
+    """ Read one `.npy` array at `offset` of `buffer` without copying, return it and the next offset. """
+    if bytes(buffer[offset:offset + 6]) != _NPY_MAGIC:
+        raise ValueError("Payload at offset {} is not a `.npy` array.".format(offset))
+    major = buffer[offset + 6]
+    if major == 1:
+        header_len, = struct.unpack_from("<H", buffer, offset + 8)
+        start = offset + 10
+    else:
+        header_len, = struct.unpack_from("<I", buffer, offset + 8)
+        start = offset + 12
+    header = ast.literal_eval(bytes(buffer[start:start + header_len]).decode("latin1"))
+    dtype = np.dtype(header["descr"])
+    shape = header["shape"]
+    count = int(np.prod(shape))
+    array = np.frombuffer(buffer, dtype=dtype, count=count, offset=start + header_len)
+    array = array.reshape(shape, order="F" if header["fortran_order"] else "C")
+    return array, start + header_len + array.nbytes
+
+
+def decode_raw(buffer, offset: int, count: int, dtype: str, dim: int = None):
+    """ Read `count` (x `dim`) little-endian values of `dtype` at `offset` without copying. """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    size = count * (dim or 1)
+    if offset + size * dtype.itemsize > len(buffer):
+        raise ValueError("Payload too short, expected {} values of `{}`.".format(size, dtype))
+    array = np.frombuffer(buffer, dtype=dtype, count=size, offset=offset)
+    if dim is not None:
+        array = array.reshape(count, dim)
+    return array, offset + array.nbytes
+
+
+def decode_payload(body: bytes,
+                   content_type: str,
+                   with_vectors: bool = True,
+                   with_ids: bool = True,
+                   count: int = None,
+                   dim: int = None,
+                   dtype: str = "float32"):
+    """
+    Decode a binary request body into `(vectors, ids)`.
+
+    `application/x-npy`: the `.npy` of the vectors followed by the `.npy` of the ids.
+    `application/octet-stream`: `count` int64 ids followed by `count` x `dim` values of `dtype`,
+    `count` is inferred from the body length when omitted.
+    """
+    vectors, ids = None, None
+    content_type = (content_type or ContentType.RAW).split(";")[0].strip()
+
+    if content_type == ContentType.NPY:
+        offset = 0
+        if with_vectors:
+            vectors, offset = decode_npy(body, offset)
+        if with_ids:
+            ids, offset = decode_npy(body, offset)
+        if vectors is not None and vectors.dtype != np.dtype(dtype):
+            raise ValueError("Vectors of `{}` do not match dtype `{}`.".format(vectors.dtype, np.dtype(dtype)))
+        if ids is not None and ids.dtype != np.dtype("int64"):
+            raise ValueError("Ids of `{}` do not match dtype `int64`.".format(ids.dtype))
+    elif content_type == ContentType.RAW:
+        if with_vectors and dim is None:
+            raise ValueError("`dim` is required for `{}` payloads.".format(ContentType.RAW))
+        if count is None:
+            row_size = (8 if with_ids else 0) + (dim * np.dtype(dtype).itemsize if with_vectors else 0)
+            if len(body) % row_size != 0:
+                raise ValueError("Payload of {} bytes is not a multiple of the row size {}.".format(len(body), row_size))
+            count = len(body) // row_size
+        offset = 0
+        if with_ids:
+            ids, offset = decode_raw(body, offset, count, "int64")
+        if with_vectors:
+            vectors, offset = decode_raw(body, offset, count, dtype, dim)
+    else:
+        raise ValueError("`{}` not supported, content type should be in ('{}', '{}')".format(
+            content_type, ContentType.RAW, ContentType.NPY))
+
+    if offset != len(body):
+        raise ValueError("Payload of {} bytes has {} trailing bytes.".format(len(body), len(body) - offset))
+
+    if vectors is not None and ids is not None and len(vectors) != len(ids):
+        raise ValueError("len(vectors) = {}, len(ids) = {}, not match!".format(len(vectors), len(ids)))
+    return vectors, ids
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import math
+import time
+import asyncio
+import threading
+import contextvars
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+
+from ant.core import profiling
+
+
+class Lane:
+    READ = "read"
+    WRITE = "write"
+
+
+class Overloaded(Exception):
+    """ Shed request, answered with `status_code` and a `Retry-After` of `retry_after` seconds. """
+
+    TOO_MANY_REQUESTS = 429
+    SERVICE_UNAVAILABLE = 503
+
+    def __init__(self, msg, status_code, retry_after):
+        super().__init__(msg)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class InstanceExecutor(object):
+    """
+    Bounded queue in front of `workers` threads running one instance's Faiss work.
+
+    At most `queue_size` calls wait for a free worker, more are rejected right
+    away with a 429. A call that waited longer than `max_wait_ms` (0 for no
+    limit) is dropped with a 503 instead of run, its caller has likely given up.
+    """
+
+    # Weight of the latest sample in the moving averages.
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, name: str, workers: int, queue_size: int, max_wait_ms: float = 0):
+        self._name = name
+        self._workers = workers
+        self._queue_size = queue_size
+        self._max_wait = max_wait_ms / 1000.
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ant-" + name)
+
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._expired = 0
+        self._completed = 0
+        self._wait_time = 0.
+        self._max_wait_time = 0.
+        self._avg_wait_time = 0.
+        self._avg_run_time = 0.
+
+    def retry_after(self):
+        # Time for the workers to drain the queue at the recent pace, in whole seconds as the header wants.
+        return max(1, math.ceil(self._queued * self._avg_run_time / self._workers))
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._queued >= self._queue_size:
+                self._rejected += 1
+                raise Overloaded("`{}` queue is full ({} waiting).".format(self._name, self._queued),
+                                 Overloaded.TOO_MANY_REQUESTS, self.retry_after())
+            self._queued += 1
+            self._submitted += 1
+        return self._executor.submit(self._run, time.time(), fn, args, kwargs)
+
+    def _run(self, submitted_at, fn, args, kwargs):
+        started_at = time.time()
+        wait_time = started_at - submitted_at
+        with self._lock:
+            self._queued -= 1
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            self._avg_wait_time += self.EWMA_ALPHA * (wait_time - self._avg_wait_time)
+            if 0 < self._max_wait < wait_time:
+                self._expired += 1
+                raise Overloaded("`{}` request waited {:.3f}s in queue.".format(self._name, wait_time),
+                                 Overloaded.SERVICE_UNAVAILABLE, self.retry_after())
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            run_time = time.time() - started_at
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._avg_run_time += self.EWMA_ALPHA * (run_time - self._avg_run_time)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self):
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "workers": self._workers,
+                "queue_size": self._queue_size,
+                "queued": self._queued,
+                "running": self._running,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "expired": self._expired,
+                "wait_time_avg": round(self._wait_time / started, 6) if started else 0.,
+                "wait_time_recent": round(self._avg_wait_time, 6),
+                "wait_time_max": round(self._max_wait_time, 6),
+                "run_time_recent": round(self._avg_run_time, 6),
+            }
+
+
+class Pipeline(object):
+    """
+    Per-instance executors of the Faiss work behind the API, one per lane, so
+    that builds and other writes queue apart from searches and never starve them.
+    """
+
+    def __init__(self, read_workers: int = 4, read_queue_size: int = 256,
+                 write_workers: int = 1, write_queue_size: int = 16, max_wait_ms: float = 0):
+        self._configs = {
+            Lane.READ: (read_workers, read_queue_size),
+            Lane.WRITE: (write_workers, write_queue_size),
+        }
+        self._max_wait_ms = max_wait_ms
+        self._lock = threading.Lock()
+        self._executors = {}
+
+    def executor(self, instance_name, lane):
+        key = (instance_name, lane)
+        with self._lock:
+            if key not in self._executors:
+                workers, queue_size = self._configs[lane]
+                self._executors[key] = InstanceExecutor("{}-{}".format(instance_name, lane),
+                                                        workers, queue_size, self._max_wait_ms)
+            return self._executors[key]
+
+    def discard(self, instance_name):
+        with self._lock:
+            for lane in self._configs:
+                executor = self._executors.pop((instance_name, lane), None)
+                if executor is not None:
+                    executor.shutdown()
+
+    def get_stats(self, instance_name):
+        with self._lock:
+            executors = {lane: self._executors.get((instance_name, lane)) for lane in self._configs}
+        return {lane: executor.get_stats() if executor is not None else None for lane, executor in executors.items()}
+
+    def pipelined(self, lane, exists):
+        """
+        Run a sync handler on the `lane` executor of its instance, awaited by an async endpoint.
+
+        The instance name comes from the `params` body or the `instance_name`
+        query parameter. Unknown instances (`exists` is false) skip the queue,
+        the handler only rejects them.
+        """
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                params = kwargs.get("params")
+                instance_name = kwargs.get("instance_name", getattr(params, "instance_name", None))
+                if not exists(instance_name):
+                    return func(*args, **kwargs)
+
+                def run():
+                    profiling.mark("queue")
+                    return func(*args, **kwargs)
+
+                # The worker runs in a copy of the request's context, e.g. its active profile.
+                future = self.executor(instance_name, lane).submit(contextvars.copy_context().run, run)
+                return await asyncio.wrap_future(future)
+            return wrapper
+        return decorator
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import queue
+import fcntl
+import asyncio
+import threading
+from urllib.parse import parse_qs
+from multiprocessing.connection import Listener, Client
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from ant.service.response import AntResponse, Status
+
+
+class Role:
+    STANDALONE = "standalone"
+    WRITER = "writer"
+    READER = "reader"
+
+
+class Replication(object):
+    """
+    Single writer, many readers among the service processes sharing `data_dir`.
+
+    The first process to lock `WRITER.lock` is the writer: it owns every
+    mutation and the AOF, and serves the requests readers forward to it on the
+    `writer.sock` unix socket. Readers serve reads from their own copies of the
+    instances, kept up to date by replaying the writer's AOF (see
+    `MultiInstances.sync_replica`), and forward everything else.
+    """
+
+    LOCK_FILE = "WRITER.lock"
+    KEY_FILE = "WRITER.key"
+    SOCKET_FILE = "writer.sock"
+
+    def __init__(self, data_dir: str):
+        self._data_dir = data_dir
+        self._lock_file = None
+        self._role = Role.STANDALONE
+        self._listener = None
+        self._idle = queue.LifoQueue()
+
+    @property
+    def role(self):
+        return self._role
+
+    @property
+    def address(self):
+        return os.path.join(self._data_dir, self.SOCKET_FILE)
+
+    def elect(self):
+        """ Become the writer when no other process is, a reader otherwise. """
+        self._lock_file = open(os.path.join(self._data_dir, self.LOCK_FILE), "a")
+        try:
+            # Held for the life of the process, the kernel releases it if the writer dies.
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._role = Role.READER
+        else:
+            self._role = Role.WRITER
+        return self._role
+
+    def _authkey(self):
+        with open(os.path.join(self._data_dir, self.KEY_FILE), "rb") as f:
+            return f.read()
+
+    def serve(self, app):
+        """ Writer side, run forwarded requests through `app` in a daemon thread per reader connection. """
+        _key = os.path.join(self._data_dir, self.KEY_FILE)
+        fd = os.open(_key + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+        os.replace(_key + ".tmp", _key)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=self._authkey())
+
+        def accept():
+            while True:
+                try:
+                    conn = self._listener.accept()
+                except Exception:
+                    if self._listener is None:
+                        return
+                    # A failed handshake only drops that connection.
+                    continue
+                threading.Thread(target=self._serve_connection, args=(app, conn),
+                                 name="ant-writer", daemon=True).start()
+
+        threading.Thread(target=accept, name="ant-writer-accept", daemon=True).start()
+
+    def close(self):
+        """ Writer side, stop accepting reader connections. """
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+
+    def _serve_connection(self, app, conn):
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    loop.run_until_complete(self._call(app, conn, *request))
+                except Exception:
+                    # The reader already got the response, a 500 if the app failed before sending one.
+                    continue
+        finally:
+            conn.close()
+            loop.close()
+
+    @staticmethod
+    async def _call(app, conn, method, path, query_string, headers, body):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode("utf-8"),
+            "root_path": "",
+            "query_string": query_string,
+            "headers": headers,
+            "client": ("replica", 0),
+            "server": None,
+        }
+        response = {"status": 500, "headers": [], "body": []}
+        replied = False
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal replied
+            if message["type"] == "http.response.start":
+                response["status"], response["headers"] = message["status"], message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+                if not message.get("more_body", False) and not replied:
+                    # Reply before background tasks (e.g. `bgsave`) run, as uvicorn does.
+                    replied = True
+                    conn.send((response["status"], response["headers"], b"".join(response["body"])))
+
+        try:
+            await app(scope, receive, send)
+        finally:
+            if not replied:
+                conn.send((response["status"], response["headers"], b"".join(response["body"])))
+
+    def forward(self, method, path, query_string, headers, body):
+        """ Reader side, run a request on the writer and return its `(status, headers, body)`. """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = Client(self.address, family="AF_UNIX", authkey=self._authkey())
+        try:
+            conn.send((method, path, query_string, headers, body))
+            response = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        self._idle.put(conn)
+        return response
+
+
+class ForwardToWriter(object):
+    """
+    ASGI middleware of a reader, forwarding to the writer every request but the
+    reads (`read_paths`) of instances `is_local` says it serves itself and the
+    requests about the reader process itself (`local_paths`, e.g. `/metrics`).
+    """
+
+    def __init__(self, app, replication: Replication, read_paths, is_local, local_paths=()):
+        self.app = app
+        self._replication = replication
+        self._read_paths = set(read_paths)
+        self._is_local = is_local
+        self._local_paths = set(local_paths)
+
+    @staticmethod
+    def instance_name(scope, body):
+        values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("instance_name")
+        if values:
+            return values[0]
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        return payload.get("instance_name") if isinstance(payload, dict) else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._replication.role != Role.READER:
+            return await self.app(scope, receive, send)
+
+        chunks, more_body = [], True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        if scope["path"] in self._local_paths or (
+                scope["path"] in self._read_paths and self._is_local(self.instance_name(scope, body))):
+            async def replay():
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await self.app(scope, replay, send)
+
+        try:
+            status, headers, body = await run_in_threadpool(
+                self._replication.forward, scope["method"], scope["path"], scope.get("query_string", b""),
+                list(scope["headers"]), body)
+        except Exception as e:
+            resp = AntResponse(Status.ERROR, api=scope["path"], error="Writer unavailable: {!r}".format(e))
+            response = JSONResponse(dict(resp), status_code=503)
+            return await response(scope, receive, send)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
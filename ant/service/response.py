@@ -1,13 +1,40 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+import io
 import json
 
+import numpy as np
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class Status:
     ERROR = "ERROR"
     SUCCESS = "SUCCESS"
 
 
+class ResultFormat:
+    DICT = "dict"
+    COLUMNAR = "columnar"
+    NPY = "npy"
+    RAW = "raw"
+
+    ALL = (DICT, COLUMNAR, NPY, RAW)
+
+
+def _truncate(value, max_items):
+    if isinstance(value, list) and len(value) > max_items:
+        return value[:max_items] + ["...({} more)".format(len(value) - max_items)]
+    if isinstance(value, dict) and len(value) > max_items:
+        items = list(value.items())
+        return dict(items[:max_items] + [("...", "({} more)".format(len(items) - max_items))])
+    return value
+
+
 class AntResponse(object):
 
     def __init__(self, status, instance=None, api=None, ops=None, msg=None, result=None, error=None, **kwargs):
@@ -19,6 +46,7 @@ class AntResponse(object):
         self.msg = msg
         self.result = result
         self.error = error
+        self._log_excludes = set()
 
         for k, v in kwargs.items():
             if not hasattr(self, k):
@@ -29,5 +57,124 @@ class AntResponse(object):
             if not hasattr(self, k):
                 setattr(self, k, v)
 
+    def exclude_from_log(self, *attrs):
+        self._log_excludes.update(attrs)
+
+    def __iter__(self):
+        for k, v in self.__dict__.items():
+            if not k.startswith("_"):
+                yield k, v
+
+    def to_log(self, max_items: int = 0):
+        """ JSON of the logged attributes, lists and dicts longer than `max_items` (if > 0) cut down to it. """
+        content = {k: v for k, v in self if k not in self._log_excludes}
+        if max_items > 0:
+            content = {k: _truncate(v, max_items) for k, v in content.items()}
+        return json.dumps(content)
+
+    def __str__(self):
+        return self.to_log()
+
+
+class AntArrayResponse(Response):
+    """
+    Result kept as an `ids` array plus a `values` array and encoded only when sent.
+
+    `columnar` renders `{"ids": [...], "<values_key>": [...]}` as JSON (orjson when
+    installed), `npy` the ids `.npy` followed by the values `.npy`, and `raw` the
+    little-endian int64 ids followed by the float32 values. The binary formats
+    carry the response attributes in `X-Ant-*` headers. Results never reach the log.
+    """
+
+    values_key = "values"
+
+    def __init__(self, values, ids, result_format=ResultFormat.COLUMNAR, **kwargs):
+        self.meta = AntResponse(Status.SUCCESS, **kwargs)
+        self.values = values
+        self.ids = ids
+        self.result_format = result_format
+        media_type = "application/json" if result_format == ResultFormat.COLUMNAR else "application/octet-stream"
+        super(AntArrayResponse, self).__init__(media_type=media_type)
+
+    def add_attrs(self, **kwargs):
+        self.meta.add_attrs(**kwargs)
+
+    @property
+    def api(self):
+        return self.meta.api
+
+    @property
+    def count(self):
+        return self.ids.shape[0]
+
+    def to_log(self, max_items: int = 0):
+        return self.meta.to_log(max_items=max_items)
+
     def __str__(self):
-        return json.dumps(self.__dict__)
+        return str(self.meta)
+
+    def render_result(self):
+        if self.result_format == ResultFormat.COLUMNAR:
+            content = dict(self.meta)
+            if orjson is not None:
+                content["result"] = {"ids": self.ids, self.values_key: self.values}
+                return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+            content["result"] = {"ids": self.ids.tolist(), self.values_key: self.values.tolist()}
+            return json.dumps(content).encode("utf-8")
+
+        if self.result_format == ResultFormat.NPY:
+            buffer = io.BytesIO()
+            np.save(buffer, self.ids)
+            np.save(buffer, self.values)
+            return buffer.getvalue()
+
+        return (np.ascontiguousarray(self.ids, dtype="<i8").tobytes() +
+                np.ascontiguousarray(self.values, dtype="<f4").tobytes())
+
+    def shape_headers(self):
+        return {"X-Ant-Count": str(self.ids.shape[0])}
+
+    def render_headers(self):
+        headers = self.shape_headers()
+        if self.result_format != ResultFormat.COLUMNAR:
+            for k, v in self.meta:
+                if v is not None and k != "result":
+                    headers["X-Ant-" + k.replace("_", "-").title()] = str(v)
+        return headers
+
+    async def __call__(self, scope, receive, send):
+        self.body = self.render_result()
+        self.init_headers(self.render_headers())
+        await super(AntArrayResponse, self).__call__(scope, receive, send)
+
+
+class AntSearchResponse(AntArrayResponse):
+    """ Search result as `(distances, ids)`, both shaped `(count, top_k)`. """
+
+    values_key = "distances"
+
+    def __init__(self, distances, ids, result_format=ResultFormat.COLUMNAR, **kwargs):
+        super(AntSearchResponse, self).__init__(distances, ids, result_format=result_format, **kwargs)
+
+    @property
+    def distances(self):
+        return self.values
+
+    def shape_headers(self):
+        return {"X-Ant-Count": str(self.ids.shape[0]), "X-Ant-Top-K": str(self.ids.shape[-1])}
+
+
+class AntFetchResponse(AntArrayResponse):
+    """ Fetched vectors shaped `(count, dim)` with their ids, missing ids are left out. """
+
+    values_key = "vectors"
+
+    def __init__(self, vectors, ids, result_format=ResultFormat.COLUMNAR, **kwargs):
+        super(AntFetchResponse, self).__init__(vectors, ids, result_format=result_format, **kwargs)
+
+    @property
+    def vectors(self):
+        return self.values
+
+    def shape_headers(self):
+        return {"X-Ant-Count": str(self.ids.shape[0]), "X-Ant-Dim": str(self.values.shape[-1])}
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import itertools
+from collections import deque
+
+from ant.core.profiling import Profile
+
+
+class SlowLog(object):
+    """
+    Redis style SLOWLOG: the last `max_len` requests that took at least
+    `log_slower_than_ms`, each with its stage timings. A negative threshold
+    turns it off, 0 keeps every request.
+    """
+
+    def __init__(self, log_slower_than_ms: float = 100, max_len: int = 128):
+        self._log_slower_than = log_slower_than_ms / 1000.
+        self._entries = deque(maxlen=max_len)
+        self._ids = itertools.count()
+
+    def add(self, profile: Profile):
+        if self._log_slower_than < 0 or profile.duration < self._log_slower_than:
+            return False
+        self._entries.append(dict(
+            profile.attrs,
+            id=next(self._ids),
+            timestamp=round(profile.started_at, 6),
+            api=profile.name,
+            duration=round(profile.duration * 1000, 3),
+            stages=profile.get_stages(),
+        ))
+        return True
+
+    def get(self, count: int = 10):
+        """ The latest `count` entries, newest first. """
+        entries = list(self._entries)
+        return entries[::-1][:count]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reset(self):
+        self._entries.clear()
+
+
+class ProfileRequests(object):
+    """
+    ASGI middleware timing every request in a `Profile` active while the app
+    handles it. Handlers mark their stages, `send` is the rest of the time
+    until the last body message, background tasks after it don't count.
+    """
+
+    def __init__(self, app, slowlog: SlowLog):
+        self.app = app
+        self._slowlog = slowlog
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope["path"])
+        finished = False
+
+        async def timed_send(message):
+            nonlocal finished
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not finished:
+                finished = True
+                profile.mark("send")
+                self._slowlog.add(profile)
+
+        token = profile.activate()
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            Profile.deactivate(token)
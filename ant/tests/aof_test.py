@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import os
+import tempfile
+import numpy as np
+from ant.core import AppendOnlyFile
+
+
+class AppendOnlyFileTest(parameterized.TestCase):
+
+    d = 8
+    np.random.seed(1234)
+    xb = np.random.random((100, d)).astype('float32')
+    xb_ids = np.arange(0, 100)
+
+    @parameterized.parameters("always", "everysec", "no")
+    def test_append_and_read(self, appendfsync):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), appendfsync=appendfsync)
+            aof.append("BUILD", self.xb_ids, self.xb)
+            aof.append("REMOVE", self.xb_ids[:10])
+            aof.close()
+
+            records = list(aof)
+            self.assertEqual([r.cmd for r in records], ["BUILD", "REMOVE"])
+            np.testing.assert_array_equal(records[0].vectors, self.xb)
+            np.testing.assert_array_equal(records[0].ids, self.xb_ids)
+            np.testing.assert_array_equal(records[1].ids, self.xb_ids[:10])
+            self.assertEqual(records[1].vectors.shape, (0, 0))
+
+    def test_invalid_appendfsync(self):
+        self.assertRaisesRegex(ValueError, "`appendfsync`", AppendOnlyFile, "/tmp", appendfsync="sometimes")
+
+    def test_rolling_segments(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), segment_size=1024)
+            for i in range(10):
+                aof.append("INSERT", self.xb_ids[i * 10:(i + 1) * 10], self.xb[i * 10:(i + 1) * 10])
+            self.assertGreater(len(aof.segments()), 1)
+            ids = np.hstack([r.ids for r in aof])
+            np.testing.assert_array_equal(ids, self.xb_ids)
+
+    def test_append_staged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"))
+            aof.append("INSERT", self.xb_ids[:10], self.xb[:10])
+            f, staged = aof.staging_file()
+            with f:
+                AppendOnlyFile.write_record(f, "INSERT", self.xb_ids[10:20], self.xb[10:20])
+            self.assertEqual(len(aof.segments()), 1)
+            aof.append_staged(staged)
+            aof.append("REMOVE", self.xb_ids[:5])
+
+            self.assertFalse(os.path.exists(staged))
+            self.assertEqual(len(aof.segments()), 3)
+            self.assertEqual([r.cmd for r in aof], ["INSERT", "INSERT", "REMOVE"])
+            np.testing.assert_array_equal(np.hstack([r.ids for r in aof]),
+                                          np.hstack([self.xb_ids[:20], self.xb_ids[:5]]))
+
+    def test_torn_tail(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"))
+            aof.append("INSERT", self.xb_ids[:10], self.xb[:10])
+            aof.append("INSERT", self.xb_ids[10:20], self.xb[10:20])
+            aof.close()
+            segment = aof.segments()[-1]
+            with open(segment, "r+b") as f:
+                f.truncate(os.path.getsize(segment) - 5)
+
+            records = list(aof)
+            self.assertEqual(len(records), 1)
+            np.testing.assert_array_equal(records[0].ids, self.xb_ids[:10])
+
+            aof.append("REMOVE", self.xb_ids[:5])
+            self.assertEqual([r.cmd for r in aof], ["INSERT", "REMOVE"])
+
+    def test_rewrite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), auto_rewrite_percentage=0)
+            aof.append("INSERT", self.xb_ids[:50], self.xb[:50])
+            aof.append("UPDATE", self.xb_ids[:10], self.xb[50:60])
+            aof.append("REMOVE", self.xb_ids[40:50])
+            aof.append("INSERT", self.xb_ids[45:50], self.xb[45:50])
+            aof.rewrite()
+            aof.append("REMOVE", self.xb_ids[:1])
+
+            records = list(aof)
+            self.assertEqual([r.cmd for r in records], ["REMOVE", "INSERT", "INSERT", "INSERT", "REMOVE"])
+            np.testing.assert_array_equal(records[0].ids, np.hstack([self.xb_ids[:10], self.xb_ids[40:50]]))
+            live = dict(zip(np.hstack([r.ids for r in records[1:4]]), np.vstack([r.vectors for r in records[1:4]])))
+            self.assertEqual(sorted(live), list(range(0, 40)) + list(range(45, 50)))
+            np.testing.assert_array_equal(live[0], self.xb[50])
+            np.testing.assert_array_equal(live[45], self.xb[45])
+
+    def test_rewrite_build(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), auto_rewrite_percentage=0)
+            aof.append("INSERT", self.xb_ids[:50], self.xb[:50])
+            aof.append("BUILD", self.xb_ids, self.xb)
+            aof.append("REMOVE", self.xb_ids[:90])
+            aof.close()
+            aof.rewrite()
+
+            records = list(aof)
+            self.assertEqual([r.cmd for r in records], ["BUILD"])
+            np.testing.assert_array_equal(records[0].ids, self.xb_ids[90:])
+            np.testing.assert_array_equal(records[0].vectors, self.xb[90:])
+            self.assertEqual(len(aof.segments()), 1)
+
+    def test_rewrite_train(self):
+        trained = np.arange(64, dtype="uint8").reshape(1, -1)
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), auto_rewrite_percentage=0)
+            aof.append("BUILD", self.xb_ids, self.xb)
+            aof.append("TRAIN", self.xb_ids[:0], trained)
+            aof.append("INSERT", self.xb_ids[:50], self.xb[:50])
+            aof.append("INSERT", self.xb_ids[50:], self.xb[50:])
+            aof.append("REMOVE", self.xb_ids[40:60])
+            aof.close()
+            aof.rewrite()
+
+            # Live rows after a TRAIN stay as one insert per source record.
+            records = list(aof)
+            self.assertEqual([r.cmd for r in records], ["TRAIN", "INSERT", "INSERT"])
+            np.testing.assert_array_equal(records[0].vectors, trained)
+            np.testing.assert_array_equal(records[1].ids, self.xb_ids[:40])
+            np.testing.assert_array_equal(records[2].vectors, self.xb[60:])
+
+    def test_auto_rewrite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), auto_rewrite_min_size=1024)
+            for _ in range(10):
+                aof.append("UPDATE", self.xb_ids[:10], self.xb[:10])
+            aof._rewrite_thread.join()
+            self.assertLess(len(list(aof)), 10)
+
+
+if __name__ == '__main__':
+    absltest.main()
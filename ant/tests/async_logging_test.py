@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import logging
+import threading
+from ant.service import AntResponse, Status
+from ant.logger.async_logging import SamplingFilter, AntFormatter, AsyncHandler, LogWriter
+
+
+class _ListHandler(logging.Handler):
+
+    def __init__(self, release=None):
+        super(_ListHandler, self).__init__()
+        self.messages = []
+        self._release = release
+
+    def emit(self, record):
+        if self._release is not None:
+            self._release.wait()
+        self.messages.append(self.format(record))
+
+
+class AsyncLoggingTest(parameterized.TestCase):
+
+    def _logger(self, name, handler):
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(handler)
+        return logger
+
+    def test_writer(self):
+        target = _ListHandler()
+        target.setFormatter(AntFormatter("%(levelname)s:%(message)s", max_items=2, max_length=150))
+        handler = AsyncHandler(queue_size=10)
+        writer = LogWriter(handler, target)
+        writer.start()
+        logger = self._logger("ant-test-writer", handler)
+
+        logger.info(AntResponse(Status.SUCCESS, api="/ant/exists", result=[True] * 5))
+        logger.error("x" * 200)
+        writer.stop()
+        self.assertEqual(target.messages[0], 'INFO:{"status": "SUCCESS", "instance": null, "api": "/ant/exists", '
+                                             '"ops": null, "msg": null, "result": [true, true, "...(3 more)"], '
+                                             '"error": null}')
+        self.assertEqual(target.messages[1], "ERROR:" + "x" * 150 + "...(50 chars more)")
+
+    def test_dropped(self):
+        release = threading.Event()
+        target = _ListHandler(release)
+        handler = AsyncHandler(queue_size=2)
+        writer = LogWriter(handler, target)
+        writer.start()
+        logger = self._logger("ant-test-dropped", handler)
+        for i in range(10):
+            logger.info("message %d", i)
+        # The writer holds one record, two wait in the queue, the rest never block the caller.
+        self.assertBetween(handler.dropped, 7, 8)
+        release.set()
+        writer.stop()
+        self.assertLen(target.messages, 10 - handler.dropped)
+
+    def test_sampling(self):
+        sampling = SamplingFilter({"/ant/search": 0.}, default=1.)
+        target = _ListHandler()
+        logger = self._logger("ant-test-sampling", target)
+        logger.addFilter(sampling)
+        logger.info(AntResponse(Status.SUCCESS, api="/ant/search"))
+        logger.info(AntResponse(Status.SUCCESS, api="/ant/insert"))
+        logger.error(AntResponse(Status.ERROR, api="/ant/search"))
+        self.assertLen(target.messages, 2)
+        self.assertEqual(sampling.sampled_out, 1)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import os
+import tempfile
+import numpy as np
+from ant.core import IdIndex
+
+
+class IdIndexTest(parameterized.TestCase):
+
+    @parameterized.parameters(0.02, 10.)
+    def test_add_discard(self, merge_ratio):
+        id_index = IdIndex(np.arange(0, 2000, 2), merge_ratio=merge_ratio)
+        expected = set(range(0, 2000, 2))
+        np.random.seed(1234)
+        for _ in range(50):
+            add = np.random.randint(0, 3000, 20)
+            discard = np.random.randint(0, 3000, 20)
+            id_index.add(add)
+            expected |= set(add.tolist())
+            id_index.discard(discard)
+            expected -= set(discard.tolist())
+            self.assertEqual(len(id_index), len(expected))
+
+        np.testing.assert_array_equal(id_index.to_array(), sorted(expected))
+        queries = np.arange(-10, 3010)
+        np.testing.assert_array_equal(id_index.contains(queries), [q in expected for q in queries])
+
+    def test_empty(self):
+        id_index = IdIndex()
+        self.assertEqual(len(id_index), 0)
+        self.assertFalse(id_index.contains([1]).any())
+        id_index.discard([1])
+        id_index.add([1, 1])
+        self.assertEqual(len(id_index), 1)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            id_index = IdIndex(np.arange(100))
+            id_index.add([200])
+            id_index.discard([5])
+            id_index.save(os.path.join(tmp, "IDS.npy"))
+            loaded = IdIndex.load(os.path.join(tmp, "IDS.npy"))
+            np.testing.assert_array_equal(loaded.to_array(), id_index.to_array())
+
+
+if __name__ == '__main__':
+    absltest.main()
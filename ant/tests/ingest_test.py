@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import os
+import pickle
+import tempfile
+import numpy as np
+from ant.core import NpyChunkReader
+from ant.core.ingest import hash_partition
+
+
+class NpyChunkReaderTest(parameterized.TestCase):
+
+    d = 8
+    np.random.seed(1234)
+    xb = np.random.random((1000, d)).astype('float32')
+    xb_ids = np.arange(0, 1000)
+
+    def save_shards(self, tmp, bounds):
+        for sub_dir in ("vectors", "ids"):
+            os.mkdir(os.path.join(tmp, sub_dir))
+        for no, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            np.save(os.path.join(tmp, "vectors", "{:08d}.npy".format(no)), self.xb[lo:hi])
+            np.save(os.path.join(tmp, "ids", "{:08d}.npy".format(no)), self.xb_ids[lo:hi])
+        return os.path.join(tmp, "vectors"), os.path.join(tmp, "ids")
+
+    @parameterized.parameters(64, 300, 5000)
+    def test_chunks(self, chunk_size):
+        with tempfile.TemporaryDirectory() as tmp:
+            reader = NpyChunkReader(*self.save_shards(tmp, [0, 100, 550, 1000]))
+            self.assertEqual((len(reader), reader.dim, reader.num_shards), (1000, self.d, 3))
+            chunks = list(reader.chunks(chunk_size))
+            self.assertLessEqual(max(len(ids) for _, ids in chunks), chunk_size)
+            np.testing.assert_array_equal(np.vstack([vectors for vectors, _ in chunks]), self.xb)
+            np.testing.assert_array_equal(np.hstack([ids for _, ids in chunks]), self.xb_ids)
+
+    def test_single_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            np.save(os.path.join(tmp, "xb.npy"), self.xb)
+            np.save(os.path.join(tmp, "ids.npy"), self.xb_ids)
+            reader = NpyChunkReader(os.path.join(tmp, "xb.npy"), os.path.join(tmp, "ids.npy"))
+            self.assertIsInstance(reader._shards[0][0], np.memmap)
+            np.testing.assert_array_equal(next(reader.chunks(10))[1], self.xb_ids[:10])
+
+    def test_sample(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            reader = NpyChunkReader(*self.save_shards(tmp, [0, 100, 550, 1000]))
+            np.testing.assert_array_equal(reader.take([5, 99, 100, 999]), self.xb[[5, 99, 100, 999]])
+            self.assertEqual(reader.sample(100, seed=1).shape, (100, self.d))
+            np.testing.assert_array_equal(reader.sample(100, seed=1), reader.sample(100, seed=1))
+            np.testing.assert_array_equal(reader.sample(5000), self.xb)
+            np.testing.assert_array_equal(NpyChunkReader(self.xb).sample(100, seed=1), reader.sample(100, seed=1))
+
+    def test_partition(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            reader = NpyChunkReader(*self.save_shards(tmp, [0, 100, 550, 1000]))
+            parts = [pickle.loads(pickle.dumps(reader.partition(part, 3))) for part in range(3)]
+            part_ids = [np.hstack([ids for _, ids in part.chunks(64)]) for part in parts]
+            np.testing.assert_array_equal(np.sort(np.hstack(part_ids)), self.xb_ids)
+            for part, ids in enumerate(part_ids):
+                self.assertTrue((hash_partition(ids, 3) == part).all())
+                self.assertGreater(len(ids), 250)
+            vectors, ids = next(parts[1].chunks(1000))
+            np.testing.assert_array_equal(vectors, self.xb[ids])
+
+    def test_shape_mismatch(self):
+        self.assertRaisesRegex(ValueError, "not match", NpyChunkReader, self.xb, self.xb_ids[:10])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import threading
+from ant.service.metrics import Metrics, RequestMetrics, instance_families
+
+
+class MetricsTest(parameterized.TestCase):
+
+    def test_counter_threads(self):
+        metrics = Metrics()
+        counter = metrics.counter("test_total", "Test.", ("api",))
+
+        def run():
+            for _ in range(1000):
+                counter.inc("a")
+            counter.inc("b", amount=2)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.merged(), {("a",): [8000.], ("b",): [16.]})
+        self.assertRaises(ValueError, counter.inc)
+
+    def test_histogram(self):
+        metrics = Metrics()
+        histogram = metrics.histogram("test_seconds", "Test.", ("api",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value, "a")
+        lines = metrics.render().splitlines()
+        self.assertEqual(lines, [
+            "# HELP test_seconds Test.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{api="a",le="0.1"} 2.0',
+            'test_seconds_bucket{api="a",le="1"} 3.0',
+            'test_seconds_bucket{api="a",le="+Inf"} 4.0',
+            'test_seconds_count{api="a"} 4.0',
+            'test_seconds_sum{api="a"} 2.65',
+        ])
+
+    def test_request_metrics(self):
+        metrics = Metrics()
+        requests = RequestMetrics(metrics, exists=lambda instance_name: instance_name == "a")
+        requests.observe("/ant/search", "a", 0.01, vectors=10)
+        requests.observe("/ant/search", "b", 0.01, error=True)
+        text = metrics.render()
+        self.assertIn('ant_requests_total{api="/ant/search",instance="a"} 1.0', text)
+        # Unknown instances share the empty label.
+        self.assertIn('ant_request_errors_total{api="/ant/search",instance=""} 1.0', text)
+        self.assertIn('ant_request_vectors_sum{api="/ant/search",instance="a"} 10.0', text)
+
+    def test_instance_families(self):
+        info = {
+            "num_total": 100,
+            "aof": {"size": 10, "appends": 2, "append_time": 0.5},
+            "buffer": {"size": 0, "appends": 0, "append_time": 0.},
+            "rebuild_time": None,
+            "last_save": {"started_at": 100., "duration": 2., "bytes": 30},
+        }
+        metrics = Metrics()
+        metrics.collector(lambda: instance_families({"a\"": info}))
+        text = metrics.render()
+        self.assertIn('ant_index_vectors{instance="a\\""} 100.0', text)
+        self.assertIn('ant_last_save_timestamp_seconds{instance="a\\""} 102.0', text)
+        self.assertNotIn("ant_rebuild_seconds{", text)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -3,10 +3,16 @@
 
 from absl.testing import parameterized, absltest
 
+import time
 import tempfile
+import threading
 import numpy as np
+from unittest import mock
 from ant.core import TopKSearch
+from ant.core import ShardedTopKSearch
 from ant.core import MultiInstances
+from ant.core import InstanceState
+from ant.core import multi_instances
 
 
 class MultiInstancesTest(parameterized.TestCase):
@@ -22,6 +28,81 @@ class MultiInstancesTest(parameterized.TestCase):
             mis.delete_instance("tests")
             self.assertEqual(mis.list_instances(), [])
 
+    @parameterized.parameters("eager", "lazy")
+    def test_load_mode(self, load_mode):
+        xb = np.random.random((1000, 10)).astype('float32')
+        with tempfile.TemporaryDirectory() as tmp:
+            mis = MultiInstances(tmp)
+            for name in ("a", "b"):
+                mis.create_instance(name, {"dim": 10, "nlist": 4})
+                mis.get_instance(name).build(xb, np.arange(1000))
+
+            mis = MultiInstances(tmp, load_mode=load_mode)
+            mis.wait_loaded()
+            expected = InstanceState.LOADED if load_mode == "eager" else InstanceState.UNLOADED
+            self.assertEqual(mis.list_instances_state(), {"a": expected, "b": expected})
+            self.assertEqual(mis.get_instance_info("a")["state"], expected)
+
+            self.assertEqual(mis.get_instance("a").num_total, 1000)
+            self.assertEqual(mis.get_instance_state("a"), InstanceState.LOADED)
+            self.assertEqual(mis.get_instance_state("b"), expected)
+            for name in ("a", "b"):
+                mis.delete_instance(name)
+
+    def test_lazy_concurrent_load(self):
+        xb = np.random.random((1000, 10)).astype('float32')
+        with tempfile.TemporaryDirectory() as tmp:
+            mis = MultiInstances(tmp)
+            for name in ("a", "b"):
+                mis.create_instance(name, {"dim": 10, "nlist": 4})
+                mis.get_instance(name).build(xb, np.arange(1000))
+
+            loaded = threading.Event()
+            rebuild = TopKSearch.rebuild
+
+            def slow_rebuild(instance):
+                loaded.wait()
+                rebuild(instance)
+
+            with mock.patch.object(TopKSearch, "rebuild", slow_rebuild):
+                mis = MultiInstances(tmp, load_mode="lazy", load_timeout=0.5)
+                loader = threading.Thread(target=mis.get_instance, args=("b",))
+                loader.start()
+                while mis.get_instance_state("b") != InstanceState.LOADING:
+                    time.sleep(0.01)
+                self.assertRaisesRegex(ValueError, "still loading", mis.get_instance, "b")
+
+                # Concurrent first requests wait for the one loading the instance within `load_timeout`.
+                results = []
+                threads = [threading.Thread(target=lambda: results.append(mis.get_instance("a").num_total))
+                           for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                time.sleep(0.05)
+                loaded.set()
+                for thread in threads + [loader]:
+                    thread.join()
+                self.assertEqual(results, [1000] * 4)
+                self.assertEqual(mis.list_instances_state(), {"a": InstanceState.LOADED, "b": InstanceState.LOADED})
+            for name in ("a", "b"):
+                mis.delete_instance(name)
+
+    def test_lazy_sharded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            mis = MultiInstances(tmp)
+            mis.create_instance("a", {"dim": 10, "num_shards": 2, "index_factory": "Flat"})
+            mis.get_instance("a").build(np.random.random((100, 10)).astype('float32'), np.arange(100))
+            mis.get_instance("a").close()
+
+            with mock.patch.object(multi_instances, "ShardedTopKSearch", wraps=ShardedTopKSearch) as sharded:
+                mis = MultiInstances(tmp, load_mode="lazy")
+                # No shard process runs until the first request loads the instance.
+                self.assertEqual(mis.get_instance_info("a")["state"], InstanceState.UNLOADED)
+                sharded.assert_not_called()
+                self.assertEqual(mis.get_instance("a").num_total, 100)
+                sharded.assert_called_once()
+            mis.delete_instance("a")
+
 
 if __name__ == '__main__':
     absltest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import io
+import numpy as np
+from ant.service import ContentType, decode_payload
+
+
+class PayloadsTest(parameterized.TestCase):
+
+    d = 8
+    np.random.seed(1234)
+    xb = np.random.random((10, d)).astype('float32')
+    xb_ids = np.arange(100, 110)
+
+    @staticmethod
+    def raw_body(ids=None, vectors=None):
+        body = b""
+        if ids is not None:
+            body += np.ascontiguousarray(ids, dtype="<i8").tobytes()
+        if vectors is not None:
+            body += np.ascontiguousarray(vectors).tobytes()
+        return body
+
+    @staticmethod
+    def npy_body(*arrays):
+        body = io.BytesIO()
+        for array in arrays:
+            np.save(body, array)
+        return body.getvalue()
+
+    @parameterized.parameters((True, True), (True, False), (False, True))
+    def test_raw_infers_count(self, with_vectors, with_ids):
+        body = self.raw_body(self.xb_ids if with_ids else None, self.xb if with_vectors else None)
+        vectors, ids = decode_payload(body, ContentType.RAW, with_vectors=with_vectors, with_ids=with_ids, dim=self.d)
+        if with_vectors:
+            np.testing.assert_array_equal(vectors, self.xb)
+        else:
+            self.assertIsNone(vectors)
+        if with_ids:
+            np.testing.assert_array_equal(ids, self.xb_ids)
+        else:
+            self.assertIsNone(ids)
+
+    def test_raw_dtype(self):
+        body = self.raw_body(self.xb_ids, self.xb.astype("float16"))
+        vectors, _ = decode_payload(body, ContentType.RAW, dim=self.d, dtype="float16")
+        self.assertEqual(vectors.dtype, np.float16)
+        np.testing.assert_array_equal(vectors, self.xb.astype("float16"))
+
+    def test_raw_requires_dim(self):
+        self.assertRaisesRegex(ValueError, "`dim` is required",
+                               decode_payload, self.raw_body(self.xb_ids, self.xb), ContentType.RAW)
+
+    def test_raw_misaligned(self):
+        body = self.raw_body(self.xb_ids, self.xb)
+        self.assertRaisesRegex(ValueError, "not a multiple of the row size",
+                               decode_payload, body[:-3], ContentType.RAW, dim=self.d)
+        # Rows of another dim don't line up with the body either.
+        self.assertRaisesRegex(ValueError, "not a multiple of the row size",
+                               decode_payload, body, ContentType.RAW, dim=self.d + 1)
+
+    def test_raw_truncated(self):
+        body = self.raw_body(self.xb_ids, self.xb)
+        self.assertRaisesRegex(ValueError, "Payload too short",
+                               decode_payload, body[:-4], ContentType.RAW, count=10, dim=self.d)
+        self.assertRaisesRegex(ValueError, "trailing bytes",
+                               decode_payload, body, ContentType.RAW, count=9, dim=self.d)
+
+    def test_raw_dtype_mismatch(self):
+        body = self.raw_body(self.xb_ids, self.xb.astype("float64"))
+        self.assertRaisesRegex(ValueError, "trailing bytes",
+                               decode_payload, body, ContentType.RAW, count=10, dim=self.d)
+
+    def test_npy(self):
+        vectors, ids = decode_payload(self.npy_body(self.xb, self.xb_ids), ContentType.NPY)
+        np.testing.assert_array_equal(vectors, self.xb)
+        np.testing.assert_array_equal(ids, self.xb_ids)
+
+        _, ids = decode_payload(self.npy_body(self.xb_ids), ContentType.NPY + "; charset=binary", with_vectors=False)
+        np.testing.assert_array_equal(ids, self.xb_ids)
+
+        vectors, ids = decode_payload(self.npy_body(self.xb), ContentType.NPY, with_ids=False)
+        np.testing.assert_array_equal(vectors, self.xb)
+        self.assertIsNone(ids)
+
+    def test_npy_fortran_order(self):
+        vectors, _ = decode_payload(self.npy_body(np.asfortranarray(self.xb), self.xb_ids), ContentType.NPY)
+        np.testing.assert_array_equal(vectors, self.xb)
+
+    def test_npy_dtype_mismatch(self):
+        self.assertRaisesRegex(ValueError, "Vectors of `float64` do not match dtype `float32`",
+                               decode_payload, self.npy_body(self.xb.astype("float64"), self.xb_ids), ContentType.NPY)
+        self.assertRaisesRegex(ValueError, "Ids of `int32` do not match dtype `int64`",
+                               decode_payload, self.npy_body(self.xb, self.xb_ids.astype("int32")), ContentType.NPY)
+
+    def test_npy_invalid(self):
+        body = self.npy_body(self.xb, self.xb_ids)
+        self.assertRaisesRegex(ValueError, "not a `.npy` array",
+                               decode_payload, self.raw_body(self.xb_ids, self.xb), ContentType.NPY)
+        self.assertRaises(ValueError, decode_payload, body[:-8], ContentType.NPY)
+        self.assertRaisesRegex(ValueError, "trailing bytes",
+                               decode_payload, body + b"\0", ContentType.NPY)
+        self.assertRaisesRegex(ValueError, "not match",
+                               decode_payload, self.npy_body(self.xb, self.xb_ids[:5]), ContentType.NPY)
+
+    def test_unsupported_content_type(self):
+        self.assertRaisesRegex(ValueError, "`application/json` not supported",
+                               decode_payload, b"{}", "application/json")
+
+
+if __name__ == '__main__':
+    absltest.main()
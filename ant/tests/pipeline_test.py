@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import time
+import threading
+from ant.service.pipeline import InstanceExecutor, Overloaded
+
+
+class InstanceExecutorTest(parameterized.TestCase):
+
+    def test_queue_full(self):
+        executor = InstanceExecutor("test", workers=2, queue_size=3)
+        release = threading.Event()
+        futures = [executor.submit(release.wait) for _ in range(5)]
+        time.sleep(0.05)
+        with self.assertRaises(Overloaded) as ctx:
+            executor.submit(release.wait)
+        self.assertEqual(ctx.exception.status_code, Overloaded.TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+        stats = executor.get_stats()
+        self.assertEqual((stats["running"], stats["queued"], stats["rejected"]), (2, 3, 1))
+        release.set()
+        for future in futures:
+            future.result()
+        stats = executor.get_stats()
+        self.assertEqual((stats["running"], stats["queued"], stats["completed"]), (0, 0, 5))
+        self.assertGreater(stats["wait_time_max"], 0)
+        executor.shutdown()
+
+    def test_expired(self):
+        executor = InstanceExecutor("test", workers=1, queue_size=10, max_wait_ms=20)
+        first = executor.submit(time.sleep, 0.1)
+        second = executor.submit(time.sleep, 0)
+        first.result()
+        with self.assertRaises(Overloaded) as ctx:
+            second.result()
+        self.assertEqual(ctx.exception.status_code, Overloaded.SERVICE_UNAVAILABLE)
+        self.assertEqual(executor.get_stats()["expired"], 1)
+        executor.shutdown()
+
+    def test_result_and_error(self):
+        executor = InstanceExecutor("test", workers=1, queue_size=1)
+        self.assertEqual(executor.submit(sum, [1, 2]).result(), 3)
+        self.assertRaises(ValueError, executor.submit(int, "a").result)
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    absltest.main()
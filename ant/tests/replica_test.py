@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import os
+import tempfile
+import numpy as np
+from ant.core import AppendOnlyFile
+from ant.core import TopKSearch
+from ant.core.replica import AofTailer
+
+
+class AofTailerTest(parameterized.TestCase):
+
+    d = 8
+    np.random.seed(1234)
+    xb = np.random.random((1000, d)).astype('float32')
+    xb_ids = np.arange(0, 1000)
+
+    def test_tail_segments(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), segment_size=1024)
+            tailer = AofTailer(os.path.join(tmp, "AOF"))
+            self.assertEqual(list(tailer.poll()), [])
+            ids = []
+            for i in range(0, 100, 10):
+                aof.append("INSERT", self.xb_ids[i:i + 10], self.xb[i:i + 10])
+                if i % 30 == 0:
+                    ids.extend(record.ids for record in tailer.poll())
+            ids.extend(record.ids for record in tailer.poll())
+            np.testing.assert_array_equal(np.hstack(ids), self.xb_ids[:100])
+            self.assertGreater(len(aof.segments()), 3)
+            self.assertEqual(list(tailer.poll()), [])
+            self.assertFalse(tailer.lost)
+
+    def test_torn_tail(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"))
+            aof.append("INSERT", self.xb_ids[:10], self.xb[:10])
+            aof.close()
+            segment = aof.segments()[0]
+            with open(segment, "rb") as f:
+                record = f.read()
+            with open(segment, "ab") as f:
+                f.write(record[:20])
+            tailer = AofTailer(os.path.join(tmp, "AOF"))
+            self.assertEqual(len(list(tailer.poll())), 1)
+            with open(segment, "ab") as f:
+                f.write(record[20:])
+            np.testing.assert_array_equal([r.ids for r in tailer.poll()], [self.xb_ids[:10]])
+
+    def test_lost_after_rewrite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            aof = AppendOnlyFile(os.path.join(tmp, "AOF"), segment_size=256)
+            tailer = AofTailer(os.path.join(tmp, "AOF"))
+            aof.append("INSERT", self.xb_ids[:10], self.xb[:10])
+            self.assertEqual(len(list(tailer.poll())), 1)
+            for i in range(10, 50, 10):
+                aof.append("INSERT", self.xb_ids[i:i + 10], self.xb[i:i + 10])
+            aof.rewrite()
+            aof.append("INSERT", self.xb_ids[50:60], self.xb[50:60])
+            list(tailer.poll())
+            self.assertTrue(tailer.lost)
+
+            # A new tailer starts at the rewritten base.
+            tailer = AofTailer(os.path.join(tmp, "AOF"))
+            np.testing.assert_array_equal(np.hstack([r.ids for r in tailer.poll()]), self.xb_ids[:60])
+
+    def test_follow_instance(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = TopKSearch(tmp, "1", self.d, nlist=4)
+            writer.build(self.xb[:500], self.xb_ids[:500])
+            writer.insert(self.xb[500:], self.xb_ids[500:])
+
+            reader = TopKSearch(tmp, "1", self.d, nlist=4)
+            reader.restore_from_fif()
+            reader.aof_lock = True
+            tailer = AofTailer(reader.get_aof_file().aof_dir)
+            self.assertEqual(tailer.apply(reader), 2)
+            self.assertEqual(reader.num_total, 1000)
+
+            writer.remove(self.xb_ids[:10])
+            self.assertEqual(tailer.apply(reader), 1)
+            self.assertFalse(reader.contains(self.xb_ids[:10]).any())
+            info = tailer.get_info()
+            self.assertEqual(info["records"], 3)
+            self.assertGreaterEqual(info["lag"], 0)
+            self.assertLess(info["staleness"], 1)
+
+
+if __name__ == '__main__':
+    absltest.main()
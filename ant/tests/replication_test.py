@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import tempfile
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from ant.service.apis import AntAPIs
+from ant.service.replication import Replication, Role, ForwardToWriter
+
+
+def process_app(name, replication=None, instances=()):
+    app = FastAPI()
+
+    @app.get(AntAPIs.METRICS.path)
+    def metrics():
+        return PlainTextResponse(name)
+
+    @app.get(AntAPIs.SLOWLOG.path)
+    def slowlog():
+        return PlainTextResponse(name)
+
+    @app.post(AntAPIs.SLOWLOG_RESET.path)
+    def slowlog_reset():
+        return PlainTextResponse(name)
+
+    @app.post(AntAPIs.SEARCH.path)
+    def search():
+        return PlainTextResponse(name)
+
+    @app.post(AntAPIs.INSERT.path)
+    def insert():
+        return PlainTextResponse(name)
+
+    if replication is not None:
+        app.add_middleware(ForwardToWriter, replication=replication, read_paths=AntAPIs.read_only_paths(),
+                           is_local=lambda instance_name: instance_name in instances,
+                           local_paths=AntAPIs.local_paths())
+    return app
+
+
+class ForwardToWriterTest(parameterized.TestCase):
+
+    def test_reader_serves_local_paths(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            writer, reader = Replication(tmp), Replication(tmp)
+            self.assertEqual(writer.elect(), Role.WRITER)
+            self.assertEqual(reader.elect(), Role.READER)
+            writer.serve(process_app("writer"))
+            try:
+                client = TestClient(process_app("reader", reader, instances=("1",)))
+                # `/metrics` carries no instance name, the scraped reader answers with its own.
+                self.assertEqual(client.get(AntAPIs.METRICS.path).text, "reader")
+                self.assertEqual(client.get(AntAPIs.SLOWLOG.path).text, "reader")
+                self.assertEqual(client.post(AntAPIs.SLOWLOG_RESET.path).text, "reader")
+                self.assertEqual(client.post(AntAPIs.SEARCH.path, json={"instance_name": "1"}).text, "reader")
+                self.assertEqual(client.post(AntAPIs.SEARCH.path, json={"instance_name": "2"}).text, "writer")
+                self.assertEqual(client.post(AntAPIs.INSERT.path, json={"instance_name": "1"}).text, "writer")
+            finally:
+                writer.close()
+
+
+if __name__ == '__main__':
+    absltest.main()
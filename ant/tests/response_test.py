@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import io
+import json
+import asyncio
+from unittest import mock
+import numpy as np
+from ant.service import ResultFormat, AntSearchResponse, AntFetchResponse
+from ant.service import response
+
+
+def send(resp):
+    """ Run the ASGI response, return its headers and body. """
+    messages = []
+
+    async def _send(message):
+        messages.append(message)
+
+    asyncio.run(resp({"type": "http"}, None, _send))
+    headers = {k.decode("latin1").lower(): v.decode("latin1") for k, v in messages[0]["headers"]}
+    return headers, b"".join(message.get("body", b"") for message in messages[1:])
+
+
+class ResponseTest(parameterized.TestCase):
+
+    np.random.seed(1234)
+    distances = np.random.random((4, 5)).astype("float32")
+    ids = np.arange(20).reshape(4, 5)
+    vectors = np.random.random((3, 8)).astype("float32")
+    vector_ids = np.array([7, 3, 11])
+
+    def decode(self, body, result_format, values_key, count, values_shape):
+        if result_format == ResultFormat.COLUMNAR:
+            result = json.loads(body)["result"]
+            return np.array(result["ids"]), np.array(result[values_key], dtype="float32")
+        if result_format == ResultFormat.NPY:
+            buffer = io.BytesIO(body)
+            return np.load(buffer), np.load(buffer)
+        ids = np.frombuffer(body, dtype="<i8", count=count)
+        return ids, np.frombuffer(body, dtype="<f4", offset=ids.nbytes).reshape(values_shape)
+
+    @parameterized.parameters((ResultFormat.COLUMNAR, True), (ResultFormat.COLUMNAR, False),
+                              (ResultFormat.NPY, True), (ResultFormat.RAW, True))
+    def test_search_response(self, result_format, with_orjson):
+        resp = AntSearchResponse(self.distances, self.ids, result_format=result_format,
+                                 api="/ant/search", instance="test", ops="search")
+        with mock.patch.object(response, "orjson", response.orjson if with_orjson else None):
+            headers, body = send(resp)
+
+        ids, distances = self.decode(body, result_format, "distances", self.ids.size, self.distances.shape)
+        np.testing.assert_array_equal(ids.reshape(self.ids.shape), self.ids)
+        np.testing.assert_array_equal(distances, self.distances)
+        self.assertEqual(headers["x-ant-count"], "4")
+        self.assertEqual(headers["x-ant-top-k"], "5")
+        self.assertNotIn("x-ant-dim", headers)
+        if result_format == ResultFormat.COLUMNAR:
+            self.assertEqual(headers["content-type"], "application/json")
+            content = json.loads(body)
+            self.assertEqual((content["status"], content["api"], content["instance"]),
+                             ("SUCCESS", "/ant/search", "test"))
+            self.assertNotIn("x-ant-status", headers)
+        else:
+            self.assertEqual(headers["content-type"], "application/octet-stream")
+            self.assertEqual(headers["x-ant-status"], "SUCCESS")
+            self.assertEqual(headers["x-ant-instance"], "test")
+            self.assertEqual(headers["content-length"], str(len(body)))
+
+    @parameterized.parameters(ResultFormat.COLUMNAR, ResultFormat.NPY, ResultFormat.RAW)
+    def test_fetch_response(self, result_format):
+        resp = AntFetchResponse(self.vectors, self.vector_ids, result_format=result_format,
+                                api="/ant/fetch", instance="test")
+        headers, body = send(resp)
+
+        ids, vectors = self.decode(body, result_format, "vectors", len(self.vector_ids), self.vectors.shape)
+        np.testing.assert_array_equal(ids, self.vector_ids)
+        np.testing.assert_array_equal(vectors, self.vectors)
+        self.assertEqual(headers["x-ant-count"], "3")
+        self.assertEqual(headers["x-ant-dim"], "8")
+        self.assertNotIn("x-ant-top-k", headers)
+
+    def test_empty_fetch_response(self):
+        resp = AntFetchResponse(np.empty((0, 8), dtype="float32"), np.empty(0, dtype="int64"),
+                                result_format=ResultFormat.RAW)
+        headers, body = send(resp)
+        self.assertEqual(body, b"")
+        self.assertEqual((headers["x-ant-count"], headers["x-ant-dim"]), ("0", "8"))
+
+    def test_result_not_logged(self):
+        resp = AntSearchResponse(self.distances, self.ids, api="/ant/search", instance="test")
+        self.assertEqual(json.loads(resp.to_log())["api"], "/ant/search")
+        self.assertNotIn("distances", resp.to_log())
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import time
+import numpy as np
+from ant.core import ResultCache
+
+
+class ResultCacheTest(parameterized.TestCase):
+
+    np.random.seed(1234)
+    vectors = np.random.random((8, 16)).astype("float32")
+    distances = np.random.random((8, 4)).astype("float32")
+    ids = np.arange(32).reshape(8, 4)
+
+    def test_get_put(self):
+        cache = ResultCache(1 << 20)
+        keys = ResultCache.keys(self.vectors, 4, 10)
+        _, _, missing = cache.get(keys, 0, 4)
+        np.testing.assert_array_equal(missing, np.arange(8))
+        cache.put(keys[:5], self.distances[:5], self.ids[:5], 0)
+
+        distances, ids, missing = cache.get(keys, 0, 4)
+        np.testing.assert_array_equal(missing, [5, 6, 7])
+        np.testing.assert_array_equal(distances[:5], self.distances[:5])
+        np.testing.assert_array_equal(ids[:5], self.ids[:5])
+
+        # Same vectors with another `top_k` or `nprobe` are different keys.
+        self.assertLen(cache.get(ResultCache.keys(self.vectors, 4, 20), 0, 4)[2], 8)
+        stats = cache.get_stats()
+        self.assertEqual(stats["hits"], 5)
+        self.assertEqual(stats["misses"], 8 + 3 + 8)
+
+    def test_generation(self):
+        cache = ResultCache(1 << 20)
+        keys = ResultCache.keys(self.vectors, 4, 10)
+        cache.put(keys, self.distances, self.ids, 1)
+        self.assertLen(cache.get(keys, 2, 4)[2], 8)
+        self.assertEqual(cache.get_stats()["entries"], 0)
+        # Results computed before the last write are dropped.
+        cache.put(keys, self.distances, self.ids, 1)
+        self.assertLen(cache.get(keys, 2, 4)[2], 8)
+
+    def test_max_bytes(self):
+        entry_bytes = 4 * 4 + 4 * 8 + ResultCache.ENTRY_OVERHEAD
+        cache = ResultCache(entry_bytes * 3)
+        keys = ResultCache.keys(self.vectors, 4, 10)
+        cache.put(keys[:3], self.distances[:3], self.ids[:3], 0)
+        cache.get(keys[:1], 0, 4)
+        cache.put(keys[3:4], self.distances[3:4], self.ids[3:4], 0)
+        # The least recently used entry goes first.
+        np.testing.assert_array_equal(cache.get(keys[:4], 0, 4)[2], [1])
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertLessEqual(cache.get_stats()["bytes"], entry_bytes * 3)
+
+    def test_ttl(self):
+        cache = ResultCache(1 << 20, ttl=0.05)
+        keys = ResultCache.keys(self.vectors, 4, 10)
+        cache.put(keys, self.distances, self.ids, 0)
+        self.assertLen(cache.get(keys, 0, 4)[2], 0)
+        time.sleep(0.1)
+        self.assertLen(cache.get(keys, 0, 4)[2], 8)
+
+
+if __name__ == '__main__':
+    absltest.main()
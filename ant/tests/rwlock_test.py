@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import time
+import threading
+from ant.core.rwlock import ReadWriteLock
+
+
+class ReadWriteLockTest(parameterized.TestCase):
+
+    def test_concurrent_readers(self):
+        lock = ReadWriteLock()
+        barrier = threading.Barrier(4, timeout=5)
+
+        def reader():
+            with lock.read_lock():
+                barrier.wait()
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertFalse(barrier.broken)
+
+    def test_writer_exclusive(self):
+        lock = ReadWriteLock()
+        events = []
+
+        def writer():
+            with lock.write_lock():
+                events.append("write")
+
+        with lock.read_lock():
+            t = threading.Thread(target=writer)
+            t.start()
+            time.sleep(0.1)
+            events.append("read")
+        t.join()
+        self.assertEqual(events, ["read", "write"])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import os
+import tempfile
+import numpy as np
+from ant.core import TopKSearch
+from ant.core import ShardedTopKSearch
+from ant.core import NpyChunkReader
+from ant.core.ingest import hash_partition
+
+
+class ShardedTopKSearchTest(parameterized.TestCase):
+
+    d = 32
+    nb = 20000
+    nq = 100
+    np.random.seed(1234)
+    xb = np.random.random((nb, d)).astype('float32')
+    xq = np.random.random((nq, d)).astype('float32')
+    xb_ids = np.arange(0, nb) * 3
+    version = "1"
+
+    @parameterized.parameters("IP", "L2")
+    def test_search_merge(self, metric):
+        with tempfile.TemporaryDirectory() as tmp:
+            sks = ShardedTopKSearch(tmp, self.version, self.d, num_shards=3, index_factory="Flat", metric=metric)
+            try:
+                sks.build(self.xb, self.xb_ids)
+                tks = TopKSearch(tmp, "flat", self.d, index_factory="Flat", metric=metric)
+                tks.build(self.xb, self.xb_ids)
+                self.assertEqual(sks.num_total, self.nb)
+                distances, ids = sks.search(self.xq, top_k=10)
+                expected_distances, expected_ids = tks.search(self.xq, top_k=10)
+                np.testing.assert_array_equal(ids, expected_ids)
+                np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+                _, explained_ids, stats = sks.explain(self.xq, top_k=10)
+                np.testing.assert_array_equal(explained_ids, ids)
+                self.assertLen(stats["shards"], 3)
+                self.assertEqual(stats["nq"], len(self.xq))
+            finally:
+                sks.close()
+
+    def test_routed_writes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sks = ShardedTopKSearch(tmp, self.version, self.d, num_shards=3, nlist=16)
+            try:
+                sks.build(self.xb, self.xb_ids)
+                shard_totals = [info["num_total"] for info in sks.get_info()["shards"]]
+                self.assertEqual(sum(shard_totals), self.nb)
+                self.assertGreater(min(shard_totals), self.nb // 4)
+
+                sks.remove(self.xb_ids[:10])
+                np.testing.assert_array_equal(sks.contains(self.xb_ids[:20]), np.arange(20) >= 10)
+                sks.insert(self.xb[:10], self.xb_ids[:10])
+                self.assertEqual(sks.num_total, self.nb)
+
+                vectors, ids = sks.reconstruct_batch(self.xb_ids[[30, 2, 17, -1]])
+                np.testing.assert_array_equal(ids, self.xb_ids[[30, 2, 17, -1]])
+                np.testing.assert_array_equal(vectors, self.xb[[30, 2, 17, -1]])
+            finally:
+                sks.close()
+
+    def test_bgsave_restore(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sks = ShardedTopKSearch(tmp, self.version, self.d, num_shards=2, nlist=16)
+            try:
+                sks.build(self.xb, self.xb_ids)
+                switched = []
+                save = sks.bgsave("2", on_switch=lambda: switched.append(True))
+                self.assertEqual((save["version"], sks.version, switched), ("2", "2", [True]))
+                self.assertEqual(sorted(os.listdir(os.path.join(tmp, "2"))), ["shard-00", "shard-01"])
+                sks.remove(self.xb_ids[:100])
+            finally:
+                sks.close()
+
+            sks = ShardedTopKSearch(tmp, "2", self.d, num_shards=2, nlist=16)
+            try:
+                sks.rebuild()
+                self.assertEqual(sks.num_total, self.nb - 100)
+                self.assertFalse(sks.contains(self.xb_ids[:100]).any())
+            finally:
+                sks.close()
+
+    def test_bulk_build_train(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            np.save(os.path.join(tmp, "xb.npy"), self.xb)
+            np.save(os.path.join(tmp, "ids.npy"), self.xb_ids)
+            sks = ShardedTopKSearch(tmp, self.version, self.d, num_shards=2, nlist=16)
+            try:
+                filename = sks.train(self.xb)
+                self.assertEqual(filename, os.path.join(tmp, "TRAINED"))
+                self.assertTrue(all(info["configs"]["trained_index"] == filename
+                                    for info in sks.get_info()["shards"]))
+                sks.bulk_build(NpyChunkReader(os.path.join(tmp, "xb.npy"), os.path.join(tmp, "ids.npy")))
+                self.assertEqual(sks.num_total, self.nb)
+                np.testing.assert_array_equal(np.sort(sks.ids), self.xb_ids)
+            finally:
+                sks.close()
+
+    def test_build_empty_shard(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # Every id owned by the first shard, the others have nothing to train on.
+            ids = np.arange(10 * self.nb)
+            ids = ids[hash_partition(ids, 3) == 0][:2000]
+            sks = ShardedTopKSearch(tmp, self.version, self.d, num_shards=3, nlist=16)
+            try:
+                sks.build(self.xb[:2000], ids)
+                self.assertEqual([info["num_total"] for info in sks.get_info()["shards"]], [2000, 0, 0])
+                self.assertTrue(np.isin(sks.search(self.xq, top_k=10)[1], ids).all())
+                sks.insert(self.xb[2000:2010], 10 * self.nb + np.arange(10))
+                self.assertEqual(sks.num_total, 2010)
+                distances, found = sks.search(self.xq, top_k=10)
+            finally:
+                sks.close()
+
+            sks = ShardedTopKSearch(tmp, self.version, self.d, num_shards=3, nlist=16)
+            try:
+                sks.rebuild()
+                self.assertEqual(sks.num_total, 2010)
+                new_distances, new_found = sks.search(self.xq, top_k=10)
+                np.testing.assert_array_equal(new_found, found)
+                np.testing.assert_allclose(new_distances, distances, rtol=1e-5)
+            finally:
+                sks.close()
+
+    def test_shard_error(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertRaisesRegex(ValueError, "`metric` should be in",
+                                   ShardedTopKSearch, tmp, self.version, self.d, num_shards=2, metric="abc")
+            self.assertRaisesRegex(ValueError, "`num_shards` should be a positive integer",
+                                   ShardedTopKSearch, tmp, self.version, self.d, num_shards=0)
+
+
+if __name__ == '__main__':
+    absltest.main()
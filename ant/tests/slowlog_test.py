@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import time
+import contextvars
+from ant.core import profiling
+from ant.core.profiling import Profile
+from ant.service.slowlog import SlowLog
+
+
+class SlowLogTest(parameterized.TestCase):
+
+    def test_profile(self):
+        profile = Profile("/ant/search")
+        token = profile.activate()
+        time.sleep(0.01)
+        profiling.mark("parse")
+        # Marks from a copy of the context, e.g. an executor worker, land in the same profile.
+        contextvars.copy_context().run(profiling.mark, "faiss")
+        profiling.mark("parse")
+        Profile.deactivate(token)
+        profiling.mark("ignored")
+
+        stages = profile.get_stages()
+        self.assertEqual(list(stages), ["parse", "faiss"])
+        self.assertGreaterEqual(stages["parse"], 10)
+        self.assertAlmostEqual(profile.duration * 1000, sum(stages.values()), places=2)
+
+    def test_slowlog(self):
+        slowlog = SlowLog(log_slower_than_ms=5, max_len=2)
+        fast = Profile("/ant/search")
+        fast.mark("faiss")
+        self.assertFalse(slowlog.add(fast))
+
+        for name in ("/ant/search", "/ant/insert", "/ant/build"):
+            profile = Profile(name)
+            profile.attrs["instance"] = "a"
+            time.sleep(0.006)
+            profile.mark("faiss")
+            self.assertTrue(slowlog.add(profile))
+
+        entries = slowlog.get()
+        self.assertLen(slowlog, 2)
+        self.assertEqual([entry["api"] for entry in entries], ["/ant/build", "/ant/insert"])
+        self.assertEqual([entry["id"] for entry in entries], [2, 1])
+        self.assertEqual(entries[0]["instance"], "a")
+        self.assertIn("faiss", entries[0]["stages"])
+        self.assertLen(slowlog.get(1), 1)
+        slowlog.reset()
+        self.assertEmpty(slowlog.get())
+
+    def test_disabled(self):
+        slowlog = SlowLog(log_slower_than_ms=-1)
+        profile = Profile("/ant/search")
+        time.sleep(0.001)
+        profile.mark("faiss")
+        self.assertFalse(slowlog.add(profile))
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from absl.testing import parameterized, absltest
+
+import tempfile
+import numpy as np
+import faiss as core
+from ant.core import ThreadBudget, TopKSearch
+from ant.core.threads import budget
+
+
+class ThreadBudgetTest(parameterized.TestCase):
+
+    def test_grant(self):
+        thread_budget = ThreadBudget(4)
+        with thread_budget.threads(3) as first:
+            self.assertEqual(first, 3)
+            self.assertEqual(core.omp_get_max_threads(), 3)
+            # Only one core left, then none but a call always gets one thread.
+            with thread_budget.threads(4) as second, thread_budget.threads(2) as third:
+                self.assertEqual((second, third), (1, 1))
+                self.assertEqual(thread_budget.get_info()["in_use"], 5)
+        info = thread_budget.get_info()
+        self.assertEqual((info["in_use"], info["calls"], info["shrunk"]), (0, 3, 2))
+
+        with thread_budget.threads(16) as granted:
+            self.assertEqual(granted, 4)
+
+    @parameterized.parameters(0, -1, 1.5)
+    def test_invalid_budget(self, value):
+        if value == 0:
+            # Falls back to the cpu count.
+            self.assertGreaterEqual(ThreadBudget(value).budget, 1)
+        else:
+            self.assertRaises(ValueError, ThreadBudget, value)
+
+
+class TopKSearchThreadsTest(parameterized.TestCase):
+
+    np.random.seed(1234)
+    vectors = np.random.random((1000, 16)).astype("float32")
+    ids = np.arange(1000)
+
+    def setUp(self):
+        super().setUp()
+        self._budget = budget.budget
+        budget.resize(8)
+
+    def tearDown(self):
+        budget.resize(self._budget)
+        super().tearDown()
+
+    def test_wanted_threads(self):
+        instance = TopKSearch(tempfile.mkdtemp(), "v1", 16, nlist=8, omp_threads=6, search_omp_threads=2,
+                              parallel_min_batch=10)
+        self.assertEqual(instance.wanted_threads(TopKSearch.OP_BUILD), 6)
+        self.assertEqual(instance.wanted_threads(TopKSearch.OP_SEARCH, 9), 1)
+        self.assertEqual(instance.wanted_threads(TopKSearch.OP_SEARCH, 10), 2)
+        self.assertEqual(instance.wanted_threads(TopKSearch.OP_WRITE, 1), 1)
+        self.assertEqual(instance.wanted_threads(TopKSearch.OP_WRITE, 100), 6)
+
+        # Unset counts take the whole budget.
+        instance = TopKSearch(tempfile.mkdtemp(), "v1", 16, nlist=8)
+        self.assertEqual(instance.wanted_threads(TopKSearch.OP_BUILD), 8)
+        self.assertEqual(instance.wanted_threads(TopKSearch.OP_SEARCH, 1000), 8)
+
+    def test_threads_info(self):
+        instance = TopKSearch(tempfile.mkdtemp(), "v1", 16, nlist=8, parallel_min_batch=10)
+        instance.build(self.vectors, self.ids)
+        instance.search(self.vectors[:1], top_k=5)
+        instance.search(self.vectors[:100], top_k=5)
+        threads = instance.get_info()["threads"]
+        self.assertEqual(threads["build"], {"calls": 1, "parallel": 1, "threads": 8})
+        self.assertEqual(threads["search"], {"calls": 2, "parallel": 1, "threads": 8})
+        self.assertEqual(threads["budget"]["budget"], 8)
+
+    def test_invalid_configs(self):
+        self.assertRaises(ValueError, TopKSearch, tempfile.mkdtemp(), "v1", 16, omp_threads=-1)
+
+
+if __name__ == '__main__':
+    absltest.main()
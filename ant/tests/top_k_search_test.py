@@ -3,9 +3,14 @@
 
 from absl.testing import parameterized, absltest
 
+import os
+import shutil
 import tempfile
+import time
+import threading
 import numpy as np
 from ant.core import TopKSearch
+from ant.core import NpyChunkReader
 
 
 class TopKSearchTest(parameterized.TestCase):
@@ -70,6 +75,20 @@ class TopKSearchTest(parameterized.TestCase):
             self.assertEqual(tks.num_total, self.nb)
             self.assertNotIn(100001, tks.ids)
 
+    def test_insert_existing_id(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, metric="L2")
+            tks.build(self.xb, self.xb_ids)
+            tks.insert(self.xq[:1], self.xb_ids[5:6])
+            self.assertEqual(tks.num_total, self.nb)
+            self.assertEqual(tks.search(self.xq[:1], top_k=1)[1][0, 0], 5)
+            self.assertNotEqual(tks.search(self.xb[5:6], top_k=1)[1][0, 0], 5)
+
+            tks.remove(self.xb_ids[5:6])
+            self.assertEqual(tks.num_total, self.nb - 1)
+            self.assertFalse(tks.contains(self.xb_ids[5:6]).any())
+            self.assertNotIn(5, tks.search(np.concatenate([self.xq[:1], self.xb[5:6]]), top_k=10)[1])
+
     def test_search(self):
         with tempfile.TemporaryDirectory() as tmp:
             tks = TopKSearch(tmp, self.version, self.d)
@@ -78,6 +97,119 @@ class TopKSearchTest(parameterized.TestCase):
             self.assertEqual(len(ids), 2)
             self.assertEqual(len(ids[0]), 10)
 
+    def test_explain(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, nlist=64)
+            tks.build(self.xb[:10000], self.xb_ids[:10000])
+            distances, ids, stats = tks.explain(self.xq[:4], top_k=10, nprobe=8)
+            np.testing.assert_array_equal(ids, tks.search(self.xq[:4], top_k=10, nprobe=8)[1])
+            self.assertEqual((stats["nq"], stats["nprobe"], stats["lists_probed"]), (4, 8, 32))
+            self.assertGreater(stats["ndis"], 0)
+
+    @parameterized.parameters(
+        ("IVF64,Flat", "IP"),
+        ("IVF64,PQ8x4", "L2"),
+        ("IVF64,SQ8", "cosine"),
+        ("Flat", "L2"),
+        ("HNSW16", "IP"),
+    )
+    def test_index_factory(self, index_factory, metric):
+        xb, xb_ids = self.xb[:5000], self.xb_ids[:5000]
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, index_factory=index_factory, metric=metric)
+            tks.build(xb, xb_ids)
+            tks.insert(self.xq[:100], self.xq_ids[:100])
+            tks.update(self.xq[:10], self.xq_ids[:10])
+            tks.remove(self.xq_ids[10:20])
+            self.assertEqual(tks.num_total, 5090)
+            self.assertNotIn(self.xq_ids[10], tks.ids)
+            distances, ids = tks.search(self.xq[:2], top_k=5, nprobe=64)
+            self.assertEqual(ids.shape, (2, 5))
+            tks.close_aof()
+
+            replayed = TopKSearch(tmp, self.version, self.d, index_factory=index_factory, metric=metric)
+            replayed.rebuild()
+            self.assertEqual(replayed.num_total, 5090)
+
+            tks.save()
+            restored = TopKSearch(tmp, self.version, self.d, index_factory=index_factory, metric=metric)
+            restored.restore_from_fif()
+            self.assertEqual(sorted(restored.ids), sorted(tks.ids))
+
+    def test_hnsw_dead_rows(self):
+        xb, xb_ids = self.xb[:5000], self.xb_ids[:5000]
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, index_factory="HNSW16", metric="L2",
+                             tombstone_compact_ratio=0)
+            tks.build(xb, xb_ids)
+            graph = tks._index
+            tks.update(self.xq[:1], self.xq_ids[:1])
+            tks.remove(xb_ids[:10])
+            tks.insert(self.xq[1:3], xb_ids[10:12])
+            # Removed and overwritten rows are only marked dead, the graph isn't rebuilt.
+            self.assertIs(tks._index, graph)
+            self.assertEqual((tks.num_total, tks.num_tombstones), (4991, 12))
+            _, ids = tks.search(xb[:20], top_k=10)
+            self.assertFalse(np.isin(ids, xb_ids[:10]).any())
+            self.assertTrue(np.array_equal(tks.search(self.xq[1:3], top_k=1)[1][:, 0], xb_ids[10:12]))
+            self.assertNotIn(xb_ids[10], tks.search(xb[10:11], top_k=1)[1])
+            np.testing.assert_array_equal(tks.reconstruct_batch(xb_ids[10:12])[0], self.xq[1:3])
+
+            new_index = tks.new_index
+
+            def write_meanwhile():
+                # Writes landing while the compacted graph is built are carried over.
+                tks.remove(xb_ids[20:22])
+                tks.insert(self.xq[3:4], xb_ids[30:31])
+                return new_index()
+
+            tks.new_index = write_meanwhile
+            self.assertEqual(tks.compact(), 12)
+            self.assertEqual((tks.num_total, tks.num_tombstones), (4989, 3))
+            self.assertEqual(tks.search(self.xq[3:4], top_k=1)[1][0, 0], xb_ids[30])
+            _, ids = tks.search(xb[:40], top_k=10)
+            self.assertFalse(np.isin(ids, xb_ids[:10]).any() or np.isin(ids, xb_ids[20:22]).any())
+            tks.save()
+
+            restored = TopKSearch(tmp, self.version, self.d, index_factory="HNSW16", metric="L2")
+            restored.restore_from_fif()
+            self.assertEqual((restored.num_total, restored.num_tombstones), (4989, 3))
+            np.testing.assert_array_equal(restored.search(xb[:40], top_k=10)[1], tks.search(xb[:40], top_k=10)[1])
+
+    def test_invalid_index_factory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertRaisesRegex(ValueError, "Invalid `index_factory`",
+                                   TopKSearch, tmp, self.version, self.d, index_factory="NotAnIndex")
+            self.assertRaisesRegex(ValueError, "`metric`",
+                                   TopKSearch, tmp, self.version, self.d, metric="hamming")
+            for index_factory in ("HNSW16_PQ8", "HNSW16_SQ8", "PCA32,HNSW16", "NSG16"):
+                self.assertRaisesRegex(ValueError, "can't remove ids",
+                                       TopKSearch, tmp, self.version, self.d, index_factory=index_factory)
+            self.assertRaisesRegex(ValueError, "`snapshot_mode`",
+                                   TopKSearch, tmp, self.version, self.d, snapshot_mode="incremental",
+                                   index_load_mode="mmap")
+
+    def test_search_batching(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, search_batch_window_ms=50, search_batch_max_size=8)
+            tks.build(self.xb, self.xb_ids)
+            expected = tks._search(self.xq[:8], 10, 10)[1]
+            results = {}
+
+            def search(i):
+                results[i] = tks.search(self.xq[i:i + 1], top_k=10)[1]
+
+            threads = [threading.Thread(target=search, args=(i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            for i in range(8):
+                np.testing.assert_array_equal(results[i], expected[i:i + 1])
+            stats = tks.get_info()["search_batching"]
+            self.assertEqual(stats["requests"], 8)
+            self.assertLess(stats["batches"], 8)
+
     def test_write_aof(self):
 
         with tempfile.TemporaryDirectory() as tmp:
@@ -105,6 +237,67 @@ class TopKSearchTest(parameterized.TestCase):
             tks.restore_from_aof()
             self.assertEqual(tks.num_total, self.nb)
 
+    def test_restore_from_binary_aof(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, appendfsync="always")
+            tks.build(self.xb, self.xb_ids)
+            tks.insert(self.xq, self.xq_ids)
+            tks.remove(self.xq_ids[:100])
+            tks.close_aof()
+            new_tks = TopKSearch(tmp, self.version, self.d)
+            new_tks.aof_lock = True
+            new_tks.restore_from_aof()
+            self.assertEqual(new_tks.num_total, self.nb + self.nq - 100)
+            self.assertNotIn(self.xq_ids[0], new_tks.ids)
+
+    def test_restore_from_legacy_aof(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # Single file log of older versions, one line per command with its arrays dumped as npy.
+            os.makedirs(os.path.join(tmp, self.version, "data"))
+            lines = []
+            for no, (cmd, arrays) in enumerate([("BUILD", (self.xb, self.xb_ids)),
+                                                ("INSERT", (self.xq[:100], self.xq_ids[:100]))]):
+                paths = []
+                for i, array in enumerate(arrays):
+                    paths.append(os.path.join("data", "{}-{}.npy".format(no, i)))
+                    np.save(os.path.join(tmp, self.version, paths[-1]), array)
+                lines.append("\t".join(["2021-01-01 00:00:00.000000", cmd] + paths) + "\n")
+            with open(os.path.join(tmp, self.version, "AOF"), "w") as f:
+                f.writelines(lines)
+
+            tks = TopKSearch(tmp, self.version, self.d)
+            tks.aof_lock = True
+            tks.restore_from_aof()
+            tks.aof_lock = False
+            self.assertEqual(tks.num_total, self.nb + 100)
+            self.assertTrue(os.path.isdir(os.path.join(tmp, self.version, "AOF")))
+            self.assertTrue(os.path.isfile(os.path.join(tmp, self.version, "AOF.legacy")))
+
+            tks.insert(self.xq[100:200], self.xq_ids[100:200])
+            tks.remove(self.xq_ids[:10])
+            tks.close_aof()
+            new_tks = TopKSearch(tmp, self.version, self.d)
+            new_tks.aof_lock = True
+            new_tks.restore_from_aof()
+            self.assertEqual(new_tks.num_total, self.nb + 190)
+            self.assertTrue(np.array_equal(new_tks.ids, tks.ids))
+
+    def test_restore_rewritten_aof(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, metric="L2", appendfsync="always")
+            tks.build(self.xb, self.xb_ids)
+            tks.insert(self.xq[:1], self.xb_ids[5:6])
+            tks.insert(self.xq[1:2], self.xb_ids[5:6])
+            tks.get_aof_file().rewrite()
+            tks.close_aof()
+
+            new_tks = TopKSearch(tmp, self.version, self.d, metric="L2")
+            new_tks.aof_lock = True
+            new_tks.restore_from_aof()
+            self.assertEqual(new_tks.num_total, self.nb)
+            queries = np.concatenate([self.xq[:2], self.xb[5:6]])
+            self.assertTrue(np.array_equal(new_tks.search(queries, top_k=10)[1], tks.search(queries, top_k=10)[1]))
+
     def test_restore_from_fif(self):
         with tempfile.TemporaryDirectory() as tmp:
             tks = TopKSearch(tmp, self.version, self.d)
@@ -114,6 +307,266 @@ class TopKSearchTest(parameterized.TestCase):
             new_tks.restore_from_fif()
             self.assertEqual(new_tks.num_total, self.nb)
 
+    def test_restore_from_fif_mmap(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d)
+            tks.build(self.xb, self.xb_ids)
+            tks.save()
+            new_tks = TopKSearch(tmp, self.version, self.d, index_load_mode="mmap")
+            new_tks.restore_from_fif()
+            self.assertTrue(new_tks.get_memory_info()["mapped"])
+            self.assertGreater(new_tks.get_memory_info()["mapped_bytes"], 0)
+            distances, ids = new_tks.search(self.xq[:2], top_k=10)
+            np.testing.assert_array_equal(ids, tks.search(self.xq[:2], top_k=10)[1])
+
+            new_tks.insert(self.xq, self.xq_ids)
+            self.assertFalse(new_tks.get_memory_info()["mapped"])
+            self.assertEqual(new_tks.num_total, self.nb + self.nq)
+
+            new_tks.version = "2"
+            new_tks.save()
+            self.assertTrue(new_tks.get_memory_info()["mapped"])
+            self.assertEqual(new_tks.num_total, self.nb + self.nq)
+
+    def test_bgsave(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d)
+            tks.build(self.xb, self.xb_ids)
+            tks.insert(self.xq[:100], self.xq_ids[:100])
+            switched = []
+            save_info = tks.bgsave("2", on_switch=lambda: switched.append(tks.version))
+            self.assertEqual(switched, ["2"])
+            self.assertEqual(save_info["version"], "2")
+            self.assertGreater(save_info["bytes"], 0)
+            tks.insert(self.xq[100:], self.xq_ids[100:])
+            tks.close_aof()
+
+            new_tks = TopKSearch(tmp, "2", self.d)
+            new_tks.rebuild()
+            self.assertEqual(new_tks.num_total, self.nb + self.nq)
+
+    @parameterized.parameters(None, "PCA32,IVF64,PQ8")
+    def test_incremental_snapshot(self, index_factory):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, index_factory=index_factory, snapshot_mode="incremental")
+            tks.build(self.xb, self.xb_ids)
+            first = tks.bgsave("2")
+            self.assertEqual(first["chunks_linked"], 0)
+            self.assertFalse(os.path.exists(os.path.join(tmp, "2", "FIF")))
+
+            # Unchanged data is only linked, a few inserts rewrite the lists they land in.
+            self.assertEqual(tks.bgsave("3")["bytes"], 0)
+            tks.insert(self.xq[:10], self.xq_ids[:10])
+            save_info = tks.bgsave("4")
+            self.assertBetween(save_info["chunks_written"], 1, 10)
+            self.assertLess(save_info["bytes"], first["bytes"] / 2)
+            tks.remove(self.xb_ids[:5])
+            tks.bgsave("5")
+            tks.insert(self.xq[10:20], self.xq_ids[10:20])
+            tks.close_aof()
+
+            new_tks = TopKSearch(tmp, "5", self.d, index_factory=index_factory, snapshot_mode="incremental")
+            new_tks.rebuild()
+            self.assertEqual(new_tks.num_total, self.nb + 15)
+            self.assertTrue(np.array_equal(new_tks.ids, tks.ids))
+            np.testing.assert_array_equal(new_tks.search(self.xq[:20], top_k=10)[1],
+                                          tks.search(self.xq[:20], top_k=10)[1])
+
+            # Removing old versions leaves the chunks shared with later ones.
+            for version in ("2", "3", "4"):
+                shutil.rmtree(os.path.join(tmp, version))
+            self.assertGreater(new_tks.bgsave("6")["chunks_linked"], 0)
+            full_tks = TopKSearch(tmp, "6", self.d, index_factory=index_factory)
+            full_tks.restore_from_fif()
+            self.assertEqual(full_tks.num_total, self.nb + 15)
+
+    def test_contains(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d)
+            tks.build(self.xb, self.xb_ids)
+            tks.insert(self.xq, self.xq_ids)
+            tks.remove(self.xb_ids[:10])
+            self.assertFalse(tks.contains(self.xb_ids[:10]).any())
+            self.assertTrue(tks.contains(self.xb_ids[10:]).all())
+            self.assertTrue(tks.contains(self.xq_ids).all())
+            self.assertEqual(tks.num_total, self.nb + self.nq - 10)
+            tks.save()
+
+            new_tks = TopKSearch(tmp, self.version, self.d)
+            new_tks.restore_from_fif()
+            self.assertTrue(np.array_equal(new_tks.ids, tks.ids))
+
+            # Snapshots without the ids file fall back to scanning the index.
+            os.remove(os.path.join(tmp, self.version, "IDS.npy"))
+            new_tks = TopKSearch(tmp, self.version, self.d)
+            new_tks.restore_from_fif()
+            self.assertTrue(np.array_equal(new_tks.ids, tks.ids))
+
+    def test_tombstone(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d)
+            tks.build(self.xb, self.xb_ids)
+            tombstone_tks = TopKSearch(tmp, "2", self.d, delete_mode="tombstone", tombstone_compact_ratio=0)
+            tombstone_tks.build(self.xb, self.xb_ids)
+
+            # Remove most of the nearest hits so that the oversampled search has to retry.
+            _, top_ids = tks.search(self.xq[:20], top_k=50)
+            removed = np.unique(top_ids[:, :45])
+            tks.remove(removed)
+            tombstone_tks.remove(removed)
+            self.assertEqual(tombstone_tks.num_tombstones, len(removed))
+            self.assertEqual(tombstone_tks.num_total, tks.num_total)
+
+            distances, ids = tks.search(self.xq[:20], top_k=10)
+            tombstone_distances, tombstone_ids = tombstone_tks.search(self.xq[:20], top_k=10)
+            self.assertTrue(np.array_equal(tombstone_ids, ids))
+            self.assertTrue(np.allclose(tombstone_distances, distances))
+
+            tombstone_tks.insert(self.xb[removed[:5]], removed[:5])
+            self.assertEqual(tombstone_tks.num_tombstones, len(removed) - 5)
+            tombstone_tks.save()
+            new_tks = TopKSearch(tmp, "2", self.d, delete_mode="tombstone")
+            new_tks.restore_from_fif()
+            self.assertEqual(new_tks.num_tombstones, len(removed) - 5)
+
+            self.assertEqual(tombstone_tks.compact(), len(removed) - 5)
+            self.assertEqual(tombstone_tks.num_tombstones, 0)
+            tks.insert(self.xb[removed[:5]], removed[:5])
+            self.assertTrue(np.array_equal(tombstone_tks.search(self.xq[:20], top_k=10)[1],
+                                           tks.search(self.xq[:20], top_k=10)[1]))
+
+    def test_tombstone_auto_compact(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, delete_mode="tombstone", tombstone_compact_ratio=0.01)
+            tks.build(self.xb, self.xb_ids)
+            tks.remove(self.xb_ids[:self.nb // 200])
+            self.assertEqual(tks.num_tombstones, self.nb // 200)
+            tks.remove(self.xb_ids[self.nb // 200:self.nb // 100])
+            while tks.compaction_in_progress:
+                time.sleep(0.01)
+            self.assertEqual(tks.num_tombstones, 0)
+            self.assertEqual(tks.num_total, self.nb - self.nb // 100)
+            self.assertFalse(tks.contains(self.xb_ids[:self.nb // 100]).any())
+
+    def test_reconstruct_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, direct_map=True)
+            tks.build(self.xb, self.xb_ids)
+            tks.remove(self.xb_ids[:10])
+            tks.update(self.xq[:10], self.xb_ids[10:20])
+            vectors, ids = tks.reconstruct_batch(np.array([0, 10, 20, self.nb + self.nq]))
+            self.assertTrue(np.array_equal(ids, [10, 20]))
+            self.assertTrue(np.array_equal(vectors, np.stack([self.xq[0], self.xb[20]])))
+            tks.save()
+
+            new_tks = TopKSearch(tmp, self.version, self.d, index_load_mode="mmap")
+            new_tks.restore_from_fif()
+            self.assertTrue(np.array_equal(new_tks.reconstruct_batch(ids)[0], vectors))
+            new_tks.remove(ids[:1])
+            self.assertTrue(np.array_equal(new_tks.reconstruct_batch(ids)[1], ids[1:]))
+
+            # Without `direct_map` the hashtable is built on the first fetch.
+            lazy_tks = TopKSearch(tmp, self.version, self.d)
+            lazy_tks.restore_from_fif()
+            self.assertFalse(lazy_tks.get_info()["configs"]["direct_map"])
+            self.assertTrue(np.array_equal(lazy_tks.reconstruct_batch(ids)[0], vectors))
+            self.assertTrue(lazy_tks.get_info()["configs"]["direct_map"])
+
+    def test_result_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, result_cache_size=1 << 20)
+            tks.build(self.xb, self.xb_ids)
+            distances, ids = tks.search(self.xq[:100], top_k=10)
+            cached_distances, cached_ids = tks.search(self.xq[50:150], top_k=10)
+            np.testing.assert_array_equal(cached_ids[:50], ids[50:])
+            np.testing.assert_array_equal(cached_distances[:50], distances[50:])
+            stats = tks.get_info()["result_cache"]
+            self.assertEqual((stats["hits"], stats["misses"]), (50, 150))
+
+            tks.remove(ids[50:, 0])
+            _, ids = tks.search(self.xq[50:100], top_k=10)
+            self.assertFalse(np.isin(ids, cached_ids[:50, 0]).any())
+            self.assertEqual(tks.get_info()["result_cache"]["hits"], 50)
+
+    def test_bulk_build(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, ingest_batch_size=7000)
+            tks.bulk_build(NpyChunkReader(self.xb, self.xb_ids))
+            tks.bulk_insert(NpyChunkReader(self.xq, self.xq_ids))
+            self.assertEqual(tks.num_total, self.nb + self.nq)
+            aof_file = tks.get_aof_file()
+            self.assertEqual([r.cmd for r in aof_file][:2], ["TRAIN", "INSERT"])
+            self.assertLessEqual(max(len(r.ids) for r in aof_file), 7000)
+            distances, ids = tks.search(self.xq[:10], top_k=10)
+            tks.remove(self.xb_ids[:10])
+            aof_file.rewrite()
+            tks.close_aof()
+
+            new_tks = TopKSearch(tmp, self.version, self.d)
+            new_tks.rebuild()
+            self.assertEqual(new_tks.num_total, self.nb + self.nq - 10)
+            new_tks.insert(self.xb[:10], self.xb_ids[:10])
+            new_distances, new_ids = new_tks.search(self.xq[:10], top_k=10)
+            np.testing.assert_array_equal(new_ids, ids)
+            np.testing.assert_allclose(new_distances, distances, rtol=1e-5)
+
+    def test_bulk_build_serves_searches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, ingest_batch_size=7000)
+            tks.build(self.xb[:1000], self.xb_ids[:1000])
+            searched = []
+
+            class Reader(NpyChunkReader):
+                def chunks(self, batch_size):
+                    for no, chunk in enumerate(super().chunks(batch_size)):
+                        if no == 1:
+                            # Searches run on the old index while the batches are read.
+                            search = threading.Thread(target=tks.search, args=(chunk[0][:1],))
+                            search.start()
+                            search.join(timeout=5)
+                            searched.append(not search.is_alive())
+                        yield chunk
+
+            tks.bulk_build(Reader(self.xb, self.xb_ids))
+            self.assertEqual(searched, [True])
+            tks.insert(self.xq[:10], self.xq_ids[:10])
+            self.assertEqual(tks.num_total, self.nb + 10)
+            cmds = [r.cmd for r in tks.get_aof_file()]
+            self.assertEqual(cmds[:3], ["BUILD", "TRAIN", "INSERT"])
+            self.assertEqual(cmds.count("INSERT"), (self.nb + 6999) // 7000 + 1)
+            tks.close_aof()
+
+            new_tks = TopKSearch(tmp, self.version, self.d)
+            new_tks.rebuild()
+            self.assertTrue(np.array_equal(new_tks.ids, tks.ids))
+
+    def test_train(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tks = TopKSearch(tmp, self.version, self.d, train_size=5000)
+            self.assertEqual(tks.training_sample(self.xb, tks.new_index()).shape, (5000, self.d))
+            np.testing.assert_array_equal(tks.training_sample(self.xb, tks.new_index()),
+                                          tks.training_sample(NpyChunkReader(self.xb), tks.new_index()))
+            trained_index = tks.train(self.xb, filename=os.path.join(tmp, "shared.index"))
+            tks.build(self.xb, self.xb_ids)
+            self.assertEqual(tks.get_info()["configs"]["trained_index"], trained_index)
+            self.assertEqual([r.cmd for r in tks.get_aof_file()], ["TRAIN", "INSERT"])
+            distances, ids = tks.search(self.xq[:10], top_k=10)
+
+            # A sibling instance built from the same trained index skips training and gets the same index.
+            sibling_tks = TopKSearch(tmp, "2", self.d, trained_index=trained_index)
+            self.assertTrue(sibling_tks.new_index().is_trained)
+            sibling_tks.build(self.xb, self.xb_ids)
+            np.testing.assert_array_equal(sibling_tks.search(self.xq[:10], top_k=10)[1], ids)
+
+            tks.close_aof()
+            new_tks = TopKSearch(tmp, self.version, self.d)
+            new_tks.rebuild()
+            np.testing.assert_array_equal(new_tks.search(self.xq[:10], top_k=10)[1], ids)
+
+            self.assertRaisesRegex(ValueError, "dim = 32", TopKSearch, tmp, "3", 32, trained_index=trained_index)
+            self.assertRaisesRegex(ValueError, "is not exist", TopKSearch, tmp, "3", self.d,
+                                   trained_index=os.path.join(tmp, "missing.index"))
+
     def test_restore_from_buffer(self):
         with tempfile.TemporaryDirectory() as tmp:
             tks = TopKSearch(tmp, self.version, self.d)